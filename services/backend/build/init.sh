@@ -19,6 +19,19 @@ conda run -n backend python /backend/manage.py collectstatic --noinput
 
 if [ "$APP_MODE" = "run" ]; then
     echo "Starting Production Server..."
+    # Presence lives in Redis; copy it to the DB in one bulk UPDATE per interval.
+    conda run --no-capture-output -n backend python /backend/manage.py flush_presence &
+    # ASGI_WORKERS > 1 runs that many uvicorn processes on the same port; they
+    # share sockets' groups through the sharded Redis channel layer
+    # (CHANNEL_REDIS_HOSTS) and drain their state on shutdown (lifespan).
+    # uvicorn also negotiates permessage-deflate with clients that offer it
+    # (daphne has no WebSocket compression): ASGI_SERVER=uvicorn selects it
+    # for a single worker too.
+    if [ "${ASGI_SERVER:-daphne}" = "uvicorn" ] || [ "${ASGI_WORKERS:-1}" -gt 1 ]; then
+        exec conda run --no-capture-output -n backend uvicorn project.asgi:application \
+            --app-dir /backend --host 0.0.0.0 --port 8000 --workers "${ASGI_WORKERS:-1}" \
+            --ws websockets --ws-per-message-deflate true
+    fi
     exec conda run --no-capture-output -n backend daphne -b 0.0.0.0 -p 8000 project.asgi:application
 else
     echo "Running Tests..."
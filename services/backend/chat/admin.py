@@ -2,7 +2,8 @@
 
 from django.contrib import admin
 
-from .models import Message, Room
+from .models import Message, ReadCursor, Room
 
 admin.site.register(Room)
 admin.site.register(Message)
+admin.site.register(ReadCursor)
@@ -7,3 +7,7 @@ class ChatConfig(AppConfig):
     """Register the chat app with Django."""
 
     name = 'chat'
+
+    def ready(self) -> None:
+        """Activate the signals of the chat module."""
+        import chat.signals  # noqa: F401
@@ -0,0 +1,84 @@
+"""Per-worker cache of chat room membership used to authorize messages.
+
+Entries live for ROOM_CACHE_TTL seconds at most and are dropped as soon as
+Room.participants changes in this worker (see chat.signals). Changes made
+by another worker are picked up when the entry expires.
+"""
+
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from typing import NamedTuple
+
+from django.conf import settings
+
+from .models import Room
+
+
+class RoomMembers(NamedTuple):
+    """Cached room together with the ids of its participants' profiles."""
+
+    room: Room
+    participant_ids: frozenset
+
+
+class RoomMembershipCache:
+    """Thread-safe LRU of room uid -> RoomMembers with a TTL."""
+
+    def __init__(self, maxsize: int, ttl: float) -> None:
+        """Create an empty cache holding up to maxsize rooms for ttl seconds."""
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self._entries: OrderedDict[uuid.UUID, tuple[float, RoomMembers]] = OrderedDict()
+        self._lock = threading.Lock()
+
+    def peek(self, room_uid: uuid.UUID) -> RoomMembers | None:
+        """Return the cached members of a room without touching the DB."""
+        with self._lock:
+            entry = self._entries.get(room_uid)
+            if entry is None:
+                return None
+            expires_at, members = entry
+            if expires_at < time.monotonic():
+                del self._entries[room_uid]
+                return None
+            self._entries.move_to_end(room_uid)
+            return members
+
+    def load(self, room_uid: uuid.UUID) -> RoomMembers | None:
+        """Fetch a room and its participants from the DB and cache them."""
+        room = Room.objects.filter(uid=room_uid).first()
+        if room is None:
+            return None
+        members = RoomMembers(
+            room, frozenset(room.participants.values_list('id', flat=True)))
+        with self._lock:
+            self._entries[room_uid] = (time.monotonic() + self.ttl, members)
+            self._entries.move_to_end(room_uid)
+            while len(self._entries) > self.maxsize:
+                self._entries.popitem(last=False)
+        return members
+
+    def get(self, room_uid: uuid.UUID) -> RoomMembers | None:
+        """Return the members of a room, loading them on a miss (sync code only)."""
+        return self.peek(room_uid) or self.load(room_uid)
+
+    def invalidate(self, room_uid: uuid.UUID) -> None:
+        """Drop one room from the cache."""
+        with self._lock:
+            self._entries.pop(room_uid, None)
+
+    def invalidate_ids(self, room_ids: set | None) -> None:
+        """Drop rooms by primary key (every room if room_ids is None)."""
+        with self._lock:
+            if room_ids is None:
+                self._entries.clear()
+                return
+            stale = [uid for uid, (_, members) in self._entries.items()
+                     if members.room.id in room_ids]
+            for uid in stale:
+                del self._entries[uid]
+
+
+room_members = RoomMembershipCache(settings.ROOM_CACHE_SIZE, settings.ROOM_CACHE_TTL)
@@ -0,0 +1,109 @@
+"""Benchmark of the chat fan-out: frames encoded per socket versus once."""
+
+import asyncio
+import json
+import time
+import zlib
+from argparse import ArgumentParser
+from collections.abc import Awaitable, Callable
+
+from django.core.management.base import BaseCommand, CommandError
+
+from project import wire
+from project.consumers import GlobalConsumer
+
+
+def build_frame(body: str) -> dict:
+    """Build the chat_message frame every recipient of a broadcast gets."""
+    return {
+        'type': 'chat_message',
+        'sender': 'bench_user',
+        'message': body,
+        'message_uid': '6f1c1e2a-58a4-4a8b-9d43-2f1b1f0c9c55',
+        'created': '2026-01-01T12:00:00.000000+00:00',
+        'delivered': False,
+        'seen': False,
+    }
+
+
+def deflated_size(payload: bytes) -> int:
+    """Size of a payload once compressed with permessage-deflate (raw deflate)."""
+    compressor = zlib.compressobj(wbits=-zlib.MAX_WBITS)
+    return len(compressor.compress(payload) + compressor.flush(zlib.Z_SYNC_FLUSH)) - 4
+
+
+class Command(BaseCommand):
+    """Compare the CPU cost of both ways of delivering a chat broadcast."""
+
+    help = ("Measure the CPU spent delivering one chat broadcast to N recipients, "
+            "re-encoded per socket versus encoded once by the sender.")
+
+    def add_arguments(self, parser: ArgumentParser) -> None:
+        """Declare the --recipients, --rounds and --wire options."""
+        parser.add_argument(
+            "--recipients", type=int, default=1000,
+            help="Consumers receiving each broadcast.",
+        )
+        parser.add_argument(
+            "--rounds", type=int, default=20,
+            help="Broadcasts delivered per measurement.",
+        )
+        parser.add_argument(
+            "--wire", choices=["json", "msgpack"], default="json",
+            help="Wire format of the recipients.",
+        )
+
+    def handle(self, *args: tuple, **options: dict) -> None:
+        """Report the frame sizes, then the CPU time of each delivery."""
+        if options["wire"] == "msgpack" and not wire.available():
+            raise CommandError("msgpack recipients need msgpack and WS_MSGPACK=True")
+        frame = build_frame("hello " * 20)
+        text = json.dumps(frame).encode()
+        self.stdout.write(f"frame: {len(text)} B json, "
+                          f"{deflated_size(text)} B deflated")
+        event = {'type': 'chat.message', 'text': json.dumps(frame)}
+        if wire.available():
+            event['packed'] = wire.encode(frame)
+            self.stdout.write(f"       {len(event['packed'])} B msgpack, "
+                              f"{deflated_size(event['packed'])} B deflated")
+
+        per_socket = asyncio.run(
+            self._measure(lambda consumer: consumer.send_json(frame), options))
+        once = asyncio.run(
+            self._measure(lambda consumer: consumer.chat_message(event), options))
+        for label, seconds in (("encoded per socket", per_socket),
+                               ("encoded once", once)):
+            per_thousand = seconds / options["rounds"] / options["recipients"] * 1000
+            self.stdout.write(f"{label:<20} {per_thousand * 1000:8.2f} ms CPU "
+                              "per 1k recipients")
+        self.stdout.write(
+            f"saved {(1 - once / per_socket) * 100:.0f}% of the fan-out CPU")
+
+    async def _measure(self, deliver: Callable[[GlobalConsumer], Awaitable[None]],
+                       options: dict) -> float:
+        """Deliver one broadcast to every consumer and return the CPU time it took."""
+        sent = []
+
+        async def sink(message: dict) -> None:
+            sent.append(message)
+
+        consumers = []
+        for _ in range(options["recipients"]):
+            consumer = GlobalConsumer()
+            consumer.base_send = sink
+            consumer.group_name = "user_0"
+            consumer.wire = options["wire"]
+            consumers.append(consumer)
+
+        started = time.process_time()
+        for _ in range(options["rounds"]):
+            for consumer in consumers:
+                await deliver(consumer)
+            while len(sent) < options["recipients"]:
+                await asyncio.sleep(0)
+            sent.clear()
+        elapsed = time.process_time() - started
+
+        for consumer in consumers:
+            consumer.outbound_task.cancel()
+        return elapsed
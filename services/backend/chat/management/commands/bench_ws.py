@@ -0,0 +1,209 @@
+"""Load benchmark of GlobalConsumer with many in-process WebSocket clients."""
+
+import asyncio
+import statistics
+import time
+import tracemalloc
+from argparse import ArgumentParser
+from urllib.parse import urlsplit, urlunsplit
+
+import redis
+from channels import DEFAULT_CHANNEL_LAYER
+from channels.layers import channel_layers
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+from django.db import connection
+from django.test.utils import override_settings
+
+from chat.models import Room
+from friends.models import Friendship
+from project.asgi import application
+from project.redis_utils import RedisManager
+from userauth.models import SiteUser
+from userprofile.models import Profile
+
+IN_MEMORY_LAYERS = {'default': {'BACKEND': 'channels.layers.InMemoryChannelLayer'}}
+
+
+def redis_db_url(db: int) -> str:
+    """Return REDIS_URL pointed at another database of the same server."""
+    return urlunsplit(urlsplit(settings.REDIS_URL)._replace(path=f'/{db}'))
+
+
+def percentile(samples: list[float], rank: float) -> float:
+    """Return the rank-th percentile (0-100) of samples, in milliseconds."""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = min(len(ordered) - 1, round(rank / 100 * (len(ordered) - 1)))
+    return ordered[index] * 1000
+
+
+def create_population(sockets: int) -> list[tuple[SiteUser, Room]]:
+    """Create users paired by friendship, each pair sharing a chat room.
+
+    Everything is inserted with bulk_create, so building 10k users takes
+    seconds (no password hashing, no signals).
+    """
+    users = SiteUser.objects.bulk_create(
+        SiteUser(email=f'bench_{index}@bench.local', password='!')
+        for index in range(sockets))
+    Profile.objects.bulk_create(
+        Profile(user=user, username=f'bench_{index}', is_guest=False)
+        for index, user in enumerate(users))
+    profiles = dict(Profile.objects.filter(user__in=users).values_list('user_id', 'id'))
+    rooms = Room.objects.bulk_create(
+        Room(name=f'bench_room_{index}') for index in range(0, sockets, 2))
+    Friendship.objects.bulk_create(
+        Friendship(from_user=users[index], to_user=users[index + 1], status='accepted')
+        for index in range(0, sockets - 1, 2))
+    Room.participants.through.objects.bulk_create(
+        Room.participants.through(room_id=rooms[index // 2].id,
+                                  profile_id=profiles[user.id])
+        for index, user in enumerate(users))
+    users = list(SiteUser.objects.filter(id__in=[user.id for user in users])
+                 .select_related('profile').order_by('id'))
+    return [(user, rooms[index // 2]) for index, user in enumerate(users)]
+
+
+async def expect(communicator: WebsocketCommunicator, frame_type: str) -> dict:
+    """Read frames until one of the given type arrives (others are counted as noise)."""
+    while True:
+        frame = await communicator.receive_json_from(timeout=10)
+        if frame.get('type') == frame_type:
+            return frame
+
+
+class Command(BaseCommand):
+    """Drive presence, chat and receipt traffic through paired sockets."""
+
+    help = ("Benchmark GlobalConsumer: open many in-process WebSocket clients, "
+            "drive presence, chat and receipt traffic, report latency, "
+            "throughput and memory. "
+            "Latencies: connect; presence ping to pong; echo, chat message to its "
+            "broadcast back to the sender; receipt, read receipt to the sender's "
+            "status_update.")
+
+    def add_arguments(self, parser: ArgumentParser) -> None:
+        """Declare the population, traffic, layer and Redis options."""
+        parser.add_argument(
+            "--sockets", type=int, default=200,
+            help="Simulated clients (paired as friends sharing a room).",
+        )
+        parser.add_argument(
+            "--messages", type=int, default=10,
+            help="Chat messages (each followed by a read receipt) per pair.",
+        )
+        parser.add_argument(
+            "--layer", choices=["settings", "memory"], default="settings",
+            help="Channel layer: the configured Redis one, or in-memory.",
+        )
+        parser.add_argument(
+            "--redis-db", type=int, default=15,
+            help="Empty Redis database for presence, unread counts and recent "
+                 "messages; flushed when the benchmark ends.",
+        )
+
+    def handle(self, *args: tuple, **options: dict) -> None:
+        """Run the benchmark on a throwaway DB and Redis database."""
+        sockets = max(2, options["sockets"] - options["sockets"] % 2)
+        # Throwaway DB and Redis database, like the test runner: the benchmark
+        # never touches real data nor leaves keys behind.
+        redis_url = redis_db_url(options["redis_db"])
+        scratch = redis.Redis.from_url(redis_url)
+        if scratch.dbsize():
+            raise CommandError(f"Redis database {options['redis_db']} is not empty, "
+                               "pick another one with --redis-db")
+        old_name = connection.creation.create_test_db(verbosity=0, autoclobber=True,
+                                                      serialize=False)
+        try:
+            population = create_population(sockets)
+            overrides = {"REDIS_URL": redis_url}
+            if options["layer"] == "memory":
+                overrides["CHANNEL_LAYERS"] = IN_MEMORY_LAYERS
+            with override_settings(**overrides):
+                report = asyncio.run(self._run(population, options["messages"]))
+        finally:
+            connection.creation.destroy_test_db(old_name, verbosity=0)
+            scratch.flushdb()
+            scratch.close()
+        self._print_report(sockets, report)
+
+    async def _run(self, population: list, messages: int) -> dict:
+        """Connect every client, run the traffic phase and collect the report."""
+        report = {"latency": {"connect": [], "presence": [], "echo": [], "receipt": []}}
+        latency = report["latency"]
+
+        tracemalloc.start()
+        baseline = tracemalloc.take_snapshot()
+        clients = []
+        for user, room in population:
+            communicator = WebsocketCommunicator(application, "/ws/global/")
+            communicator.scope["user"] = user
+            started = time.perf_counter()
+            connected, _ = await communicator.connect(timeout=10)
+            latency["connect"].append(time.perf_counter() - started)
+            if not connected:
+                raise RuntimeError(f"{user.email} could not connect")
+            clients.append((communicator, room))
+        allocated = sum(stat.size_diff for stat in
+                        tracemalloc.take_snapshot().compare_to(baseline, "filename"))
+        tracemalloc.stop()
+        report["bytes_per_socket"] = allocated / len(clients)
+
+        async def heartbeat(communicator: WebsocketCommunicator) -> None:
+            started = time.perf_counter()
+            await communicator.send_json_to({"module": "presence", "action": "ping"})
+            await expect(communicator, "pong")
+            latency["presence"].append(time.perf_counter() - started)
+
+        async def conversation(sender: WebsocketCommunicator,
+                               reader: WebsocketCommunicator, room: Room) -> None:
+            for index in range(messages):
+                started = time.perf_counter()
+                await sender.send_json_to({"module": "chat", "action": "chat-message",
+                                           "room_uid": str(room.uid),
+                                           "message": f"bench {index}"})
+                # Chat messages are broadcast to the sender's user group only
+                # (recipients read them from the room history and unread
+                # counters), so this is the round trip to the sender's echo.
+                message = await expect(sender, "chat_message")
+                latency["echo"].append(time.perf_counter() - started)
+
+                started = time.perf_counter()
+                await reader.send_json_to({"module": "chat", "action": "read",
+                                           "room_uid": str(room.uid),
+                                           "up_to": message["message_uid"]})
+                await expect(sender, "status_update")
+                latency["receipt"].append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(heartbeat(communicator) for communicator, _ in clients))
+        await asyncio.gather(*(
+            conversation(clients[index][0], clients[index + 1][0], clients[index][1])
+            for index in range(0, len(clients), 2)))
+        report["elapsed"] = time.perf_counter() - started
+        report["frames"] = sum(len(samples) for name, samples in latency.items()
+                               if name != "connect")
+
+        for communicator, _ in clients:
+            await communicator.disconnect()
+        await RedisManager.close_connection()
+        layer = channel_layers[DEFAULT_CHANNEL_LAYER]
+        if hasattr(layer, "close_pools"):
+            await layer.close_pools()
+        return report
+
+    def _print_report(self, sockets: int, report: dict) -> None:
+        """Print latency percentiles, throughput and memory per socket."""
+        self.stdout.write(f"{sockets} sockets, traffic phase {report['elapsed']:.2f}s")
+        for name, samples in report["latency"].items():
+            self.stdout.write(
+                f"  {name:<9} n={len(samples):<6} p50={percentile(samples, 50):8.2f}ms "
+                f"p99={percentile(samples, 99):8.2f}ms "
+                f"mean={statistics.fmean(samples) * 1000 if samples else 0:8.2f}ms")
+        throughput = report['frames'] / report['elapsed']
+        self.stdout.write(f"  throughput {throughput:.0f} round trips/s")
+        self.stdout.write(
+            f"  memory     {report['bytes_per_socket'] / 1024:.1f} KiB per socket")
@@ -38,9 +38,81 @@ class Message(models.Model):
 	uid = models.UUIDField(default=uuid.uuid4, editable=False, unique=True)
 
 	class Meta:
-		"""Define ordering of the messages in the DB."""
-		ordering = ['-updated', '-created']
+		"""Define ordering and indexes of the messages in the DB."""
+		ordering = ['-created', '-id']
+		# Serves keyset pagination of a room's history (chat/pagination.py)
+		# and range receipts ("every message of a room up to X").
+		indexes = [models.Index(fields=['room', 'created', 'id'])]
 
 	def __str__(self) -> None:
 		"""Return a short preview of the message body."""
 		return f'{self.body[0:50]} from {self.sender_profile}'
+
+
+class ReadCursor(models.Model):
+	"""Stores how far a profile has read a room.
+
+	Unread counts are kept in Redis (see RedisManager.increment_unread);
+	cursors are the durable source they are rebuilt from.
+	"""
+
+	profile = models.ForeignKey('userprofile.Profile', on_delete=models.CASCADE,
+								related_name='read_cursors')
+	room = models.ForeignKey(Room, on_delete=models.CASCADE, related_name='read_cursors')
+	last_read = models.DateTimeField()
+	updated = models.DateTimeField(auto_now=True)
+
+	class Meta:
+		"""One cursor per profile and room."""
+		constraints = [
+			models.UniqueConstraint(fields=['profile', 'room'], name='unique_read_cursor'),
+		]
+
+	@staticmethod
+	def unread_counts(profile: models.Model, pending: list = ()) -> dict:
+		"""Count the unread messages of every room of a profile in two queries.
+
+		A third one reads the cursors when there are pending messages. Used
+		to rebuild the Redis counters when they are missing.
+
+		Args:
+			profile: Reader
+			pending: Unsaved write-behind messages to count as well; they are
+				left out of the DB count so that one written meanwhile is not
+				counted twice
+
+		Returns:
+			Dict of room uid (str) -> number of messages from others after
+			the profile's read cursor (every message if it has none)
+		"""
+		counts = {str(uid): 0 for uid in Room.objects.filter(
+			participants=profile).values_list('uid', flat=True)}
+		pending = [
+			message for message in pending
+			if str(message.room.uid) in counts
+			and message.sender_profile_id != profile.id]
+		last_read = ReadCursor.objects.filter(
+			profile=profile, room=models.OuterRef('room')).values('last_read')[:1]
+		rows = (Message.objects.filter(room__participants=profile)
+				.exclude(sender_profile=profile)
+				.exclude(uid__in=[message.uid for message in pending])
+				.annotate(last_read=models.Subquery(last_read))
+				.filter(models.Q(last_read__isnull=True)
+						| models.Q(created__gt=models.F('last_read')))
+				.order_by()
+				.values('room__uid')
+				.annotate(unread=models.Count('id')))
+		for row in rows:
+			counts[str(row['room__uid'])] = row['unread']
+		if pending:
+			cursors = dict(ReadCursor.objects.filter(profile=profile)
+				.values_list('room__uid', 'last_read'))
+			for message in pending:
+				cursor = cursors.get(message.room.uid)
+				if cursor is None or message.created > cursor:
+					counts[str(message.room.uid)] += 1
+		return counts
+
+	def __str__(self) -> str:
+		"""Return which room the cursor belongs to and its position."""
+		return f'{self.profile} read {self.room} up to {self.last_read}'
@@ -0,0 +1,74 @@
+"""Keyset pagination of a room's message history.
+
+Pages are keyed on (created, id), the order of the (room, created, id)
+index, so fetching a page is one index range scan whatever its depth in the
+history. Cursors are opaque to the client: they encode the key of the last
+message of a page.
+"""
+
+import base64
+from datetime import datetime
+
+from django.db.models import Q, QuerySet
+
+from .models import Message
+
+
+def encode_cursor(message: Message) -> str:
+    """Build the cursor pointing at a message."""
+    raw = f'{message.created.isoformat()}|{message.id}'
+    return base64.urlsafe_b64encode(raw.encode()).decode()
+
+
+def decode_cursor(cursor: str) -> tuple[datetime, int]:
+    """Read the (created, id) key of a cursor.
+
+    Raises:
+        ValueError: If the cursor was not produced by encode_cursor
+    """
+    try:
+        created, message_id = base64.urlsafe_b64decode(cursor.encode()).decode().split('|')
+        return datetime.fromisoformat(created), int(message_id)
+    except (UnicodeError, TypeError) as e:
+        raise ValueError('invalid cursor') from e
+
+
+def paginate_messages(messages: QuerySet, before: str | None = None,
+                      after: str | None = None, limit: int = 50) -> dict:
+    """Return one page of messages, newest first.
+
+    Args:
+        messages: Messages of a single room
+        before: Cursor; return messages older than it (default: latest page)
+        after: Cursor; return messages newer than it
+        limit: Page size
+
+    Returns:
+        Dict with the page ``messages`` and the ``before`` / ``after``
+        cursors of the neighbouring pages (None at either end)
+
+    Raises:
+        ValueError: If a cursor is invalid
+    """
+    if after is not None:
+        created, message_id = decode_cursor(after)
+        page = list(messages.filter(
+            Q(created__gt=created) | Q(created=created, id__gt=message_id)
+        ).order_by('created', 'id')[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit][::-1]
+        has_newer, has_older = has_more, True
+    else:
+        if before is not None:
+            created, message_id = decode_cursor(before)
+            messages = messages.filter(
+                Q(created__lt=created) | Q(created=created, id__lt=message_id))
+        page = list(messages.order_by('-created', '-id')[:limit + 1])
+        has_more = len(page) > limit
+        page = page[:limit]
+        has_newer, has_older = before is not None, has_more
+    return {
+        'messages': page,
+        'before': encode_cursor(page[-1]) if page and has_older else None,
+        'after': encode_cursor(page[0]) if page and has_newer else None,
+    }
@@ -0,0 +1,151 @@
+"""Write-behind persistence of chat messages (CHAT_WRITE_BEHIND setting).
+
+When enabled, the consumer builds the Message in memory (uid and created
+assigned up front), broadcasts it right away and hands it to the writer,
+which inserts queued messages with one bulk_create per batch. A batch is
+written once it holds BATCH_SIZE messages or FLUSH_INTERVAL seconds after
+its first message, whichever comes first.
+
+Durability: a message is acknowledged before it reaches the DB.
+- A clean shutdown drains the queue: through the ASGI lifespan hook
+  (project/lifespan.py) on servers that send lifespan events, and through
+  an atexit hook otherwise (daphne).
+- A hard crash of the worker (SIGKILL, OOM) loses the messages still
+  queued, i.e. at most MAX_PENDING and usually one FLUSH_INTERVAL's worth.
+- A batch the DB rejects is logged and dropped, it is not retried.
+- ``created`` is stamped again by the DB insert (auto_now_add), so the
+  stored value may trail the broadcast one by up to FLUSH_INTERVAL.
+"""
+
+import asyncio
+import atexit
+import threading
+import weakref
+
+from channels.db import database_sync_to_async
+from django.conf import settings
+
+from .models import Message
+
+
+class MessageWriter:
+    """Per-worker queue of unsaved messages flushed to the DB in batches.
+
+    Like RedisManager, state is kept per event loop: ASGI workers run one
+    loop, tests spin up short-lived ones. Messages not written yet are also
+    indexed by uid for readers that rebuild state from the DB (pending()).
+    """
+
+    def __init__(self) -> None:
+        """Create a writer with no queue yet."""
+        self._queues: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Queue]" = (
+            weakref.WeakKeyDictionary()
+        )
+        self._tasks: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Task]" = (
+            weakref.WeakKeyDictionary()
+        )
+        # Batch currently being inserted, per loop; drain() lets it finish.
+        self._writes: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Future]" = (
+            weakref.WeakKeyDictionary()
+        )
+        # Queued or being inserted, by uid; read from sync views' threads.
+        self._pending = {}
+        self._pending_lock = threading.Lock()
+
+    @property
+    def enabled(self) -> bool:
+        """Whether messages should go through the write-behind queue."""
+        return settings.CHAT_WRITE_BEHIND['ENABLED']
+
+    async def enqueue(self, message: Message) -> None:
+        """Queue an unsaved message; waits only if MAX_PENDING are already queued."""
+        loop = asyncio.get_running_loop()
+        queue = self._queues.get(loop)
+        if queue is None:
+            queue = asyncio.Queue(maxsize=settings.CHAT_WRITE_BEHIND['MAX_PENDING'])
+            self._queues[loop] = queue
+        task = self._tasks.get(loop)
+        if task is None or task.done():
+            self._tasks[loop] = loop.create_task(self._flush_forever(queue))
+        with self._pending_lock:
+            self._pending[message.uid] = message
+        await queue.put(message)
+
+    def pending(self) -> list:
+        """Return the messages of this worker that are not in the DB yet."""
+        with self._pending_lock:
+            return list(self._pending.values())
+
+    async def drain(self) -> None:
+        """Stop the flusher of the running loop and write every queued message."""
+        loop = asyncio.get_running_loop()
+        task = self._tasks.pop(loop, None)
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+        write = self._writes.pop(loop, None)
+        if write is not None:
+            await write
+        queue = self._queues.pop(loop, None)
+        if queue is not None:
+            await database_sync_to_async(self._write)(self._take_all(queue))
+
+    def drain_sync(self) -> None:
+        """Write what is left in every queue (interpreter exit, no loop running)."""
+        for queue in list(self._queues.values()):
+            self._write(self._take_all(queue))
+        self._queues.clear()
+
+    async def _flush_forever(self, queue: asyncio.Queue) -> None:
+        """Wait for a first message, then fill and write a batch."""
+        conf = settings.CHAT_WRITE_BEHIND
+        loop = asyncio.get_running_loop()
+        while True:
+            batch = [await queue.get()]
+            deadline = loop.time() + conf['FLUSH_INTERVAL']
+            try:
+                while len(batch) < conf['BATCH_SIZE']:
+                    timeout = deadline - loop.time()
+                    if timeout <= 0:
+                        break
+                    try:
+                        batch.append(await asyncio.wait_for(queue.get(), timeout))
+                    except asyncio.TimeoutError:
+                        break
+            except asyncio.CancelledError:
+                # drain() will write the queue: give the open batch back.
+                for message in batch:
+                    queue.put_nowait(message)
+                raise
+            # Shielded: cancelling the flusher must not abandon a batch
+            # whose insert already started in the DB thread.
+            write = asyncio.ensure_future(database_sync_to_async(self._write)(batch))
+            self._writes[loop] = write
+            await asyncio.shield(write)
+            self._writes.pop(loop, None)
+
+    @staticmethod
+    def _take_all(queue: asyncio.Queue) -> list:
+        """Empty a queue without waiting."""
+        batch = []
+        while not queue.empty():
+            batch.append(queue.get_nowait())
+        return batch
+
+    def _write(self, batch: list) -> None:
+        """Insert a batch of messages in one statement per BATCH_SIZE rows."""
+        if not batch:
+            return
+        try:
+            Message.objects.bulk_create(
+                batch, batch_size=settings.CHAT_WRITE_BEHIND['BATCH_SIZE'])
+        except Exception as e:
+            print(f"Error writing {len(batch)} chat messages: {e}")
+        finally:
+            with self._pending_lock:
+                for message in batch:
+                    self._pending.pop(message.uid, None)
+
+
+message_writer = MessageWriter()
+atexit.register(message_writer.drain_sync)
@@ -3,17 +3,22 @@
 After validation if needed, it converts different python objects
 to JSON and vice-versa, namely:
     - Room
+    - Message
 """
 
 from rest_framework import serializers
-from userprofile.serializers import LightProfileSerializer
+from userprofile.serializers import LightProfileSerializer, PresenceProfileSerializer
 
 from .models import Message, Room
 
 
 class RoomSerializer(serializers.ModelSerializer):
-    """Set how to serialize a user's friendship requests."""
-    participants = LightProfileSerializer(read_only=True, many=True)
+    """Set how to serialize a user's friendship requests.
+
+    Pass ``PresenceProfileSerializer.presence_context(room.participants.all())``
+    as context to annotate every participant with live presence in one call.
+    """
+    participants = PresenceProfileSerializer(read_only=True, many=True)
     class Meta:
         """Defines the metaclass for the Profile serializer.
         
@@ -27,22 +32,46 @@ class RoomSerializer(serializers.ModelSerializer):
                   'direct_key',
                   'uid']
 
+class SenderProfileSerializer(LightProfileSerializer):
+    """Public part of a message sender's profile (no session key)."""
+    class Meta(LightProfileSerializer.Meta):
+        """Restrict the light profile to what other participants may see."""
+        fields = ['uid', 'username', 'avatar', 'is_guest']
+
+
 class MessageSerializer(serializers.ModelSerializer):
-    """Set how to serialize a user's friendship requests."""
-    sender_profile = LightProfileSerializer(read_only=True)
-    room = RoomSerializer(read_only=True)
+    """Flat message representation for high-volume payloads.
+
+    Room and sender are referenced by uid; the senders' profiles are sent
+    once per response through ``side_load``. Select ``sender_profile`` and
+    ``room`` with the messages so a page costs a fixed number of queries.
+    """
+    room = serializers.UUIDField(source='room.uid', read_only=True)
+    sender = serializers.UUIDField(source='sender_profile.uid', read_only=True)
     class Meta:
-        """Defines the metaclass for the Profile serializer.
+        """Defines the metaclass for the Message serializer.
         
         This part tells the rest_framework serializer how to contruct the
-        ProfileSerializer class itself
+        MessageSerializer class itself
         """
         model = Message
-        fields = ['sender_profile',
+        fields = ['uid',
                   'room',
+                  'sender',
                   'body',
                   'delivered',
                   'seen',
                   'updated',
-                  'created',
-                  'uid']
\ No newline at end of file
+                  'created']
+        read_only_fields = ['uid', 'delivered', 'seen', 'updated', 'created']
+
+    @classmethod
+    def side_load(cls, messages: list[Message]) -> dict:
+        """Serialize messages with one entry per distinct sender in ``profiles``."""
+        senders = {message.sender_profile.uid: message.sender_profile
+                   for message in messages}
+        return {
+            'messages': cls(messages, many=True).data,
+            'profiles': {str(uid): SenderProfileSerializer(profile).data
+                         for uid, profile in senders.items()},
+        }
@@ -0,0 +1,32 @@
+"""Define automatic actions based on a designated trigger for the chat module."""
+
+from typing import Any
+
+from django.db.models.signals import m2m_changed, post_delete
+from django.dispatch import receiver
+
+from .cache import room_members
+from .models import Room
+
+
+@receiver(m2m_changed, sender=Room.participants.through)
+def invalidate_room_members(sender: type,
+                            instance: Any,
+                            action: str,
+                            reverse: bool,
+                            pk_set: set | None,
+                            **kwargs: Any) -> None:
+    """Drop cached memberships when participants are added or removed."""
+    if action not in ('post_add', 'post_remove', 'post_clear'):
+        return
+    if not reverse:
+        room_members.invalidate(instance.uid)
+    else:
+        # profile.chat_rooms.add/remove/clear: pk_set holds room ids.
+        room_members.invalidate_ids(pk_set)
+
+
+@receiver(post_delete, sender=Room)
+def invalidate_deleted_room(sender: type[Room], instance: Room, **kwargs: Any) -> None:
+    """Drop a deleted room from the membership cache."""
+    room_members.invalidate(instance.uid)
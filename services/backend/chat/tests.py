@@ -1,19 +1,28 @@
 """Tests for chat HTTP endpoints and WebSocket behavior."""
 
+import asyncio
 import uuid
 
 from asgiref.sync import async_to_sync
+from channels.db import database_sync_to_async
 from channels.testing import WebsocketCommunicator
-from django.test import TransactionTestCase
+from django.db import connection
+from django.test import TransactionTestCase, override_settings
+from django.test.utils import CaptureQueriesContext
 from django.urls import reverse
-from friends.models import Friendship
-from project.asgi import application
+from django.utils import timezone
 from rest_framework import status
 from rest_framework.test import APIClient, APITestCase
+
+from friends.models import Friendship
+from project.asgi import application
+from project.redis_utils import RedisManager
 from userauth.serializers import RegisterSerializer
 from userprofile.serializers import ProfileSerializer
 
-from .models import Message, Room
+from .cache import room_members
+from .models import Message, ReadCursor, Room
+from .persistence import message_writer
 
 
 class ChatViewsTests(APITestCase):
@@ -65,6 +74,11 @@ class ChatViewsTests(APITestCase):
 		self.assertEqual(response.data['name'], 'classic')
 		self.assertFalse(response.data['is_direct'])
 		self.assertEqual(response.data['participants'], [])
+		self.room.participants.add(self.friend.profile)
+		response = self.client.get(reverse('room', kwargs={'room_uid': self.room.uid}))
+		participant = response.data['participants'][0]
+		self.assertEqual(participant['username'], 'friend_user')
+		self.assertNotIn('session_key', participant)
 
 	def test_room_post_creates_message_and_adds_participant(self) -> None:
 		"""Posting to a room should create a message and add the sender as participant."""
@@ -97,6 +111,48 @@ class ChatViewsTests(APITestCase):
 		self.assertTrue(Room.objects.filter(name=self.room.name,
 											is_direct=False).exists())
 
+	def test_room_history_is_keyset_paginated(self) -> None:
+		"""History pages should walk back with before cursors and forward with after."""
+		self.room.participants.add(self.user.profile)
+		messages = [Message.objects.create(room=self.room,
+										sender_profile=self.user.profile,
+										body=f'history {index}')
+					for index in range(7)]
+		newest_first = [str(message.uid) for message in reversed(messages)]
+		url = reverse('room-messages', kwargs={'room_uid': self.room.uid})
+		self.client.force_login(self.user)
+
+		seen, params = [], {'limit': 3}
+		while True:
+			response = self.client.get(url, params)
+			self.assertEqual(response.status_code, status.HTTP_200_OK)
+			seen += [str(message['uid']) for message in response.data['messages']]
+			if response.data['before'] is None:
+				break
+			params = {'limit': 3, 'before': response.data['before']}
+		self.assertEqual(seen, newest_first)
+		sender_uid = str(response.data['messages'][0]['sender'])
+		self.assertEqual(str(response.data['messages'][0]['room']), str(self.room.uid))
+		self.assertEqual(list(response.data['profiles']), [sender_uid])
+		self.assertEqual(response.data['profiles'][sender_uid]['username'], 'chat_test_user')
+		self.assertNotIn('session_key', response.data['profiles'][sender_uid])
+
+		response = self.client.get(url, {'limit': 3, 'after': response.data['after']})
+		self.assertEqual([str(message['uid']) for message in response.data['messages']],
+						newest_first[3:6])
+
+		with CaptureQueriesContext(connection) as small_page:
+			self.client.get(url, {'limit': 2})
+		with CaptureQueriesContext(connection) as large_page:
+			self.client.get(url, {'limit': 7})
+		self.assertEqual(len(small_page), len(large_page))
+
+		response = self.client.get(url, {'before': 'garbage'})
+		self.assertEqual(response.status_code, status.HTTP_400_BAD_REQUEST)
+		self.client.force_login(self.friend)
+		response = self.client.get(url)
+		self.assertEqual(response.status_code, status.HTTP_403_FORBIDDEN)
+
 	def test_direct_room_is_created_for_friends(self) -> None:
 		"""Direct-room creation should return a shared DM room for friends."""
 		login_url = '/api/auth/login/'
@@ -199,7 +255,8 @@ class ChatWebsocketTests(TransactionTestCase):
 		"""Existing public rooms should accept WebSocket connections."""
 		async def scenario() -> None:
 			communicator = WebsocketCommunicator(application, '/ws/global/')
-			communicator.scope['user'] = self.guest
+			# Guests have no user: their profile is resolved at handshake.
+			communicator.scope['profile'] = self.guest
 			connected, _ = await communicator.connect()
 			self.assertTrue(connected)
 			await communicator.disconnect()
@@ -308,3 +365,270 @@ class ChatWebsocketTests(TransactionTestCase):
 			await communicator.disconnect()
 
 		async_to_sync(scenario)()
+
+	def test_new_friendship_invalidates_cached_friends(self) -> None:
+		"""Friends cached at handshake should be reloaded when a friendship is accepted."""
+		async def scenario() -> None:
+			communicator = WebsocketCommunicator(application, '/ws/global/')
+			communicator.scope['user'] = self.user
+			connected, _ = await communicator.connect()
+			self.assertTrue(connected)
+			direct_message = {'module': 'chat',
+							'action': 'direct-message',
+							'message': 'hello new friend',
+							'user_uid': str(self.stranger.uid)}
+
+			await communicator.send_json_to(direct_message)
+			response = await communicator.receive_json_from()
+			self.assertEqual(response['message'], 'Target is not a friend')
+
+			await database_sync_to_async(Friendship.objects.create)(
+				from_user=self.stranger, to_user=self.user, status='accepted')
+			await asyncio.sleep(0.2)
+			await communicator.send_json_to(direct_message)
+			response = await communicator.receive_json_from()
+			self.assertEqual(response['type'], 'notification')
+			self.assertEqual(response['message'], 'NEW_FRIEND_REQUEST')
+			response = await communicator.receive_json_from()
+			self.assertEqual(response['type'], 'chat_message')
+			self.assertEqual(response['message'], 'hello new friend')
+			await communicator.disconnect()
+
+		async_to_sync(scenario)()
+
+	def test_room_membership_cache_is_invalidated(self) -> None:
+		"""Adding or removing participants should drop the cached membership."""
+		members = room_members.get(self.room.uid)
+		self.assertNotIn(self.stranger.profile.id, members.participant_ids)
+		self.assertIs(room_members.peek(self.room.uid), members)
+
+		self.room.participants.add(self.stranger.profile)
+		self.assertIsNone(room_members.peek(self.room.uid))
+		self.assertIn(self.stranger.profile.id,
+					room_members.get(self.room.uid).participant_ids)
+
+		self.stranger.profile.chat_rooms.remove(self.room)
+		self.assertNotIn(self.stranger.profile.id,
+						room_members.get(self.room.uid).participant_ids)
+
+	@override_settings(CHAT_WRITE_BEHIND={'ENABLED': True,
+										'BATCH_SIZE': 2,
+										'FLUSH_INTERVAL': 0.05,
+										'MAX_PENDING': 10})
+	def test_write_behind_broadcasts_before_saving(self) -> None:
+		"""Messages should be broadcast with their uid and written in batches."""
+		async def scenario() -> list:
+			communicator = WebsocketCommunicator(application, '/ws/global/')
+			communicator.scope['user'] = self.user
+			connected, _ = await communicator.connect()
+			self.assertTrue(connected)
+			uids = []
+			for index in range(3):
+				await communicator.send_json_to({'module': 'chat',
+										'action': 'chat-message',
+										'message': f'queued {index}',
+										'room_uid': str(self.room.uid)})
+				response = await communicator.receive_json_from()
+				self.assertEqual(response['message'], f'queued {index}')
+				self.assertNotIn('message_id', response)
+				uids.append(response['message_uid'])
+			await message_writer.drain()
+			await communicator.send_json_to({'module': 'chat', 'action': 'read',
+									'message_uid': uids[0]})
+			response = await communicator.receive_json_from()
+			self.assertEqual((response['type'], response['message_uid']),
+							('status_update', uids[0]))
+			await communicator.disconnect()
+			return uids
+
+		uids = async_to_sync(scenario)()
+		self.assertEqual(
+			sorted(str(uid) for uid in Message.objects.filter(
+				body__startswith='queued').values_list('uid', flat=True)),
+			sorted(uids))
+		self.assertTrue(Message.objects.get(uid=uids[0]).seen)
+
+	def test_range_receipt_marks_messages_in_bulk(self) -> None:
+		"""One read frame should flag every earlier message and notify the sender once."""
+		received = [Message.objects.create(sender_profile=self.friend.profile,
+										room=self.room,
+										body=f'unread {index}')
+					for index in range(5)]
+		own = Message.objects.create(sender_profile=self.user.profile,
+									room=self.room, body='mine')
+
+		async def scenario() -> None:
+			friend_socket = WebsocketCommunicator(application, '/ws/global/')
+			friend_socket.scope['user'] = self.friend
+			user_socket = WebsocketCommunicator(application, '/ws/global/')
+			user_socket.scope['user'] = self.user
+			self.assertTrue((await friend_socket.connect())[0])
+			self.assertTrue((await user_socket.connect())[0])
+
+			await user_socket.send_json_to({'module': 'chat',
+									'action': 'read',
+									'room_uid': str(self.room.uid),
+									'up_to': str(received[-2].uid)})
+			updates = []
+			while not await friend_socket.receive_nothing(timeout=0.5):
+				response = await friend_socket.receive_json_from()
+				if response['type'] == 'status_update':
+					updates.append(response)
+			self.assertEqual(len(updates), 1)
+			self.assertEqual(updates[0]['action'], 'read')
+			self.assertEqual(updates[0]['up_to'], str(received[-2].uid))
+
+			await user_socket.send_json_to({'module': 'chat',
+									'action': 'read',
+									'room_uid': str(self.room.uid),
+									'up_to': str(uuid.uuid4())})
+			response = await user_socket.receive_json_from()
+			self.assertEqual(response['message'], 'message_not_found')
+			await user_socket.disconnect()
+			await friend_socket.disconnect()
+
+		async_to_sync(scenario)()
+		seen = Message.objects.filter(seen=True, delivered=True)
+		self.assertEqual(seen.count(), 4)
+		self.assertFalse(seen.filter(id__in=[received[-1].id, own.id]).exists())
+
+	def test_join_returns_recent_messages_from_ring_buffer(self) -> None:
+		"""Joining should read cold rooms from the DB once, then from Redis."""
+		Message.objects.create(sender_profile=self.friend.profile,
+							room=self.room, body='before join')
+
+		async def scenario() -> None:
+			redis = await RedisManager.get_connection()
+			key = RedisManager.RECENT_MESSAGES_KEY.format(room_uid=self.room.uid)
+			await redis.delete(key)
+			# A push must not create a partial buffer for a cold room.
+			await RedisManager.push_recent_message(str(self.room.uid), {'body': 'pushed'})
+			self.assertFalse(await redis.exists(key))
+			communicator = WebsocketCommunicator(application, '/ws/global/')
+			communicator.scope['user'] = self.user
+			self.assertTrue((await communicator.connect())[0])
+			join = {'module': 'chat', 'action': 'join', 'room_uid': str(self.room.uid)}
+
+			await communicator.send_json_to(join)
+			response = await communicator.receive_json_from()
+			self.assertEqual(response['type'], 'room_history')
+			self.assertEqual([entry['body'] for entry in response['messages']],
+							['before join'])
+
+			await communicator.send_json_to({'module': 'chat',
+									'action': 'chat-message',
+									'message': 'after join',
+									'room_uid': str(self.room.uid)})
+			await communicator.receive_json_from()
+			await database_sync_to_async(Message.objects.all().delete)()
+
+			await communicator.send_json_to(join)
+			response = await communicator.receive_json_from()
+			self.assertEqual([entry['body'] for entry in response['messages']],
+							['after join', 'before join'])
+			self.assertEqual(response['messages'][0]['sender_name'], 'chat_test_user')
+			self.assertFalse(await RedisManager.fill_recent_messages(
+				str(self.room.uid), [{'body': 'stale'}]))
+			await redis.delete(key)
+			await communicator.disconnect()
+
+		async_to_sync(scenario)()
+
+	def test_messages_pushed_during_a_fill_are_kept(self) -> None:
+		"""A message sent while a cold room is read from the DB should reach its buffer."""
+		room_uid = str(self.room.uid)
+		key = RedisManager.RECENT_MESSAGES_KEY.format(room_uid=room_uid)
+		fill_key = RedisManager.RECENT_FILL_KEY.format(room_uid=room_uid)
+
+		async def scenario() -> None:
+			redis = await RedisManager.get_connection()
+			await redis.delete(key, fill_key)
+			self.assertTrue(await RedisManager.begin_recent_fill(room_uid))
+			await RedisManager.push_recent_message(room_uid, {'uid': 'b', 'body': 'both'})
+			await RedisManager.push_recent_message(room_uid, {'uid': 'a', 'body': 'new'})
+			self.assertFalse(await redis.exists(key))
+			self.assertTrue(await RedisManager.fill_recent_messages(
+				room_uid, [{'uid': 'b', 'body': 'both'}, {'uid': 'c', 'body': 'old'}]))
+			self.assertEqual(
+				[entry['body'] for entry in await RedisManager.get_recent_messages(room_uid)],
+				['new', 'both', 'old'])
+			self.assertFalse(await redis.exists(fill_key))
+			self.assertFalse(await RedisManager.begin_recent_fill(room_uid))
+			await redis.delete(key)
+
+		async_to_sync(scenario)()
+
+	def test_unread_counters_follow_sends_and_reads(self) -> None:
+		"""Sends should bump the recipients' counters and reads should reset them."""
+		unread_key = RedisManager.UNREAD_KEY.format(profile_id=self.user.profile.id)
+
+		async def scenario() -> list:
+			redis = await RedisManager.get_connection()
+			await redis.delete(unread_key)
+			friend_socket = WebsocketCommunicator(application, '/ws/global/')
+			friend_socket.scope['user'] = self.friend
+			self.assertTrue((await friend_socket.connect())[0])
+			uids = []
+			for index in range(3):
+				await friend_socket.send_json_to({'module': 'chat',
+										'action': 'chat-message',
+										'message': f'unread {index}',
+										'room_uid': str(self.room.uid)})
+				response = await friend_socket.receive_json_from()
+				while response['type'] != 'chat_message':
+					response = await friend_socket.receive_json_from()
+				uids.append(response['message_uid'])
+			# Cold counters are rebuilt whole on read, not started partially.
+			self.assertFalse(await redis.exists(unread_key))
+			await friend_socket.disconnect()
+			return uids
+
+		uids = async_to_sync(scenario)()
+		client = APIClient()
+		client.force_login(self.user)
+		url = reverse('unread-counts')
+		self.assertEqual(client.get(url).data, {'unread': {str(self.room.uid): 3}})
+
+		async def read() -> None:
+			user_socket = WebsocketCommunicator(application, '/ws/global/')
+			user_socket.scope['user'] = self.user
+			self.assertTrue((await user_socket.connect())[0])
+			await user_socket.send_json_to({'module': 'chat',
+									'action': 'read',
+									'room_uid': str(self.room.uid),
+									'up_to': uids[1]})
+			await asyncio.sleep(0.2)
+			await user_socket.disconnect()
+
+		async_to_sync(read)()
+		self.assertEqual(client.get(url).data, {'unread': {str(self.room.uid): 1}})
+		RedisManager.get_sync_connection().delete(unread_key)
+		self.assertEqual(client.get(url).data, {'unread': {str(self.room.uid): 1}})
+		RedisManager.get_sync_connection().delete(unread_key)
+
+	def test_unread_rebuild_caches_empty_counts_and_counts_pending(self) -> None:
+		"""Rebuilt counters should expire, cache empty results and count queued messages."""
+		redis = RedisManager.get_sync_connection()
+		loner = RegisterSerializer(data={'email': 'loner@mail.com',
+										'profile_username': 'loner_user',
+										'password': 'Password123!'},
+									context={'is_creation': True})
+		loner.is_valid(raise_exception=True)
+		loner = loner.save()
+		loner_key = RedisManager.UNREAD_KEY.format(profile_id=loner.profile.id)
+		client = APIClient()
+		client.force_login(loner)
+		self.assertEqual(client.get(reverse('unread-counts')).data, {'unread': {}})
+		self.assertEqual(RedisManager.get_unread_counts_sync(loner.profile.id), {})
+		self.assertGreater(redis.ttl(loner_key), 0)
+		redis.delete(loner_key)
+
+		written = Message.objects.create(sender_profile=self.friend.profile,
+										room=self.room, body='written meanwhile')
+		queued = Message(sender_profile=self.friend.profile, room=self.room,
+						body='queued', created=timezone.now())
+		own = Message(sender_profile=self.user.profile, room=self.room,
+					body='mine', created=timezone.now())
+		self.assertEqual(
+			ReadCursor.unread_counts(self.user.profile, [written, queued, own]),
+			{str(self.room.uid): 2})
@@ -2,9 +2,11 @@
 
 from django.urls import path
 
-from .views import DirectMessageView, RoomView
+from .views import DirectMessageView, RoomMessagesView, RoomView, UnreadCountsView
 
 urlpatterns = [
 	path('direct/', DirectMessageView.as_view(), name='direct-room'),
-	path('room/<uuid:room_uid>/', RoomView.as_view(), name='room')
+	path('room/<uuid:room_uid>/', RoomView.as_view(), name='room'),
+	path('room/<uuid:room_uid>/messages/', RoomMessagesView.as_view(), name='room-messages'),
+	path('unread/', UnreadCountsView.as_view(), name='unread-counts'),
 ]
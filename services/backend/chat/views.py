@@ -5,18 +5,26 @@ import uuid
 from django.contrib.auth import get_user_model
 from django.db.models import Q
 from friends.models import Friendship
+from project.redis_utils import RedisManager
 from rest_framework import status
 from rest_framework.permissions import AllowAny, IsAuthenticated
 from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from userprofile.models import Profile
+from userprofile.serializers import PresenceProfileSerializer
 
-from .models import Room
+from .cache import room_members
+from .models import Message, ReadCursor, Room
+from .pagination import paginate_messages
+from .persistence import message_writer
 from .serializers import MessageSerializer, RoomSerializer
 
 User = get_user_model()
 
+HISTORY_PAGE_SIZE = 50
+HISTORY_MAX_PAGE_SIZE = 100
+
 
 def _direct_key_for(profile_a: Profile, profile_b: Profile) -> str:
     """Generate a stable, unique key for a direct message room between two users.
@@ -87,9 +95,11 @@ class RoomView(APIView):
     def get(self, request: Request, room_uid: uuid.UUID) -> Response:
         """Return room metadata."""
         try:
-            room = Room.objects.get(uid=room_uid)
+            room = Room.objects.prefetch_related('participants').get(uid=room_uid)
             if room:
-                serializer = RoomSerializer(room)
+                context = PresenceProfileSerializer.presence_context(
+                    room.participants.all())
+                serializer = RoomSerializer(room, context=context)
                 return Response(serializer.data,
                     status=status.HTTP_200_OK)
         except Room.DoesNotExist:
@@ -116,4 +126,61 @@ class RoomView(APIView):
             return Response(serializer.data, status=status.HTTP_201_CREATED)
         else:
             return Response(serializer.errors, status=status.HTTP_400_BAD_REQUEST)
-        
\ No newline at end of file
+        
+
+
+class RoomMessagesView(APIView):
+    """HTTP view to scroll through the message history of a room."""
+    permission_classes=[AllowAny]
+
+    def get(self, request: Request, room_uid: uuid.UUID) -> Response:
+        """Return one page of messages, newest first, with their senders' profiles.
+
+        Query params: ``before`` or ``after`` (cursors returned by a previous
+        page) and ``limit`` (default 50, at most 100).
+        """
+        members = room_members.get(room_uid)
+        if members is None:
+            return Response({'error': {'room': 'ROOM_NOT_FOUND'}},
+                            status=status.HTTP_404_NOT_FOUND)
+        if request.profile.id not in members.participant_ids:
+            return Response({'error': {'room': 'NOT_A_MEMBER'}},
+                            status=status.HTTP_403_FORBIDDEN)
+        try:
+            limit = min(int(request.query_params.get('limit', HISTORY_PAGE_SIZE)),
+                        HISTORY_MAX_PAGE_SIZE)
+        except ValueError:
+            limit = 0
+        if limit < 1:
+            return Response({'error': {'limit': 'INVALID_LIMIT'}},
+                            status=status.HTTP_400_BAD_REQUEST)
+        messages = Message.objects.filter(room=members.room).select_related(
+            'sender_profile', 'room')
+        try:
+            page = paginate_messages(messages,
+                                     before=request.query_params.get('before'),
+                                     after=request.query_params.get('after'),
+                                     limit=limit)
+        except ValueError:
+            return Response({'error': {'cursor': 'INVALID_CURSOR'}},
+                            status=status.HTTP_400_BAD_REQUEST)
+        page.update(MessageSerializer.side_load(page['messages']))
+        return Response(page, status=status.HTTP_200_OK)
+
+
+class UnreadCountsView(APIView):
+    """HTTP view returning the unread badges of every room of the user."""
+    permission_classes=[AllowAny]
+
+    def get(self, request: Request) -> Response:
+        """Return room uid -> unread count in one Redis call.
+
+        Counters are rebuilt from the read cursors when Redis has none,
+        counting the messages this worker has not written yet.
+        """
+        counts = RedisManager.get_unread_counts_sync(request.profile.id)
+        if counts is None:
+            counts = ReadCursor.unread_counts(request.profile,
+                                              message_writer.pending())
+            RedisManager.fill_unread_counts_sync(request.profile.id, counts)
+        return Response({'unread': counts}, status=status.HTTP_200_OK)
@@ -7,3 +7,7 @@ class FriendsConfig(AppConfig):
     """Define linking of social module to the rest of the backend."""
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'friends'
+
+    def ready(self) -> None:
+        """Activate the signals of the social module."""
+        import friends.signals  # noqa: F401
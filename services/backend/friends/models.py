@@ -6,6 +6,7 @@ The following models are defines:
 import uuid
 
 from django.db import models
+from django.db.models import Q
 from userauth.models import SiteUser
 
 
@@ -31,4 +32,31 @@ class Friendship(models.Model):
         constraints = [
             models.UniqueConstraint(fields=['from_user', 'to_user'],
                                     name='unique_friend_request')
-        ]
\ No newline at end of file
+        ]
+
+    @staticmethod
+    def friend_map(user: SiteUser | None) -> dict[str, dict]:
+        """Map the SiteUser uid of every accepted friend to its profile, in one query.
+
+        Returns:
+            Dict of str(user uid) -> {'id': profile id, 'uid': profile uid}
+        """
+        if user is None:
+            return {}
+        rows = Friendship.objects.filter(
+            Q(from_user=user) | Q(to_user=user),
+            status='accepted',
+        ).values_list('from_user_id',
+                      'from_user__uid', 'from_user__profile__id', 'from_user__profile__uid',
+                      'to_user__uid', 'to_user__profile__id', 'to_user__profile__uid')
+        friends = {}
+        for from_user_id, *sides in rows:
+            user_uid, profile_id, profile_uid = (
+                sides[3:] if from_user_id == user.id else sides[:3])
+            friends[str(user_uid)] = {'id': profile_id, 'uid': profile_uid}
+        return friends
+
+    @staticmethod
+    def friend_profile_ids(user: SiteUser | None) -> set[int]:
+        """Return the Profile ids of every accepted friend of user, in one query."""
+        return {friend['id'] for friend in Friendship.friend_map(user).values()}
@@ -4,7 +4,7 @@ from typing import Any
 
 from asgiref.sync import async_to_sync
 from channels.layers import get_channel_layer
-from django.db.models.signals import post_save
+from django.db.models.signals import post_delete, post_save
 from django.dispatch import receiver
 
 from friends.models import Friendship
@@ -18,11 +18,11 @@ def save_profile(sender: type[Friendship],
     """Trigger sending of notifications when friendship is saved."""
     channel_layer = get_channel_layer()
     if created:
-        user_group = f"user_{instance.to_user.id}"
+        user_group = f"user_{instance.to_user.profile.id}"
         message = 'NEW_FRIEND_REQUEST'
         from_user = instance.from_user.username
     else:
-        user_group = f"user_{instance.from_user.id}"
+        user_group = f"user_{instance.from_user.profile.id}"
         message = 'FRIEND_REQUEST_ACCEPTED'
         from_user = instance.to_user.username
     async_to_sync(channel_layer.group_send)(
@@ -33,4 +33,20 @@ def save_profile(sender: type[Friendship],
             'message': message,
             'from-user': from_user
         }
-    )
\ No newline at end of file
+    )
+
+
+@receiver(post_save, sender=Friendship)
+@receiver(post_delete, sender=Friendship)
+def invalidate_friend_sets(sender: type[Friendship],
+                           instance: Friendship,
+                           **kwargs: Any) -> None:
+    """Tell both sides' open sockets to reload the friend set cached in their scope."""
+    if instance.status != 'accepted':
+        return
+    channel_layer = get_channel_layer()
+    for user in (instance.from_user, instance.to_user):
+        async_to_sync(channel_layer.group_send)(
+            f"presence_{user.profile.id}",
+            {'type': 'friends.invalidate'},
+        )
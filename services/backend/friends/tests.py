@@ -165,6 +165,8 @@ class FriendRequestsTests(APITestCase):
                 response = user2.get(friend_see_url)
                 self.assertEqual(response.status_code, status.HTTP_200_OK)
                 self.assertEqual(1, len(response.data['friends']))
+                self.assertFalse(response.data['friends'][0]['is_online'])
+                self.assertNotIn('session_key', response.data['friends'][0])
 
             elif res == 'reject':
                 self.assertEqual('FRIENDSHIP_REQUEST_REJECTED',
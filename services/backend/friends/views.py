@@ -7,7 +7,7 @@ from rest_framework.request import Request
 from rest_framework.response import Response
 from rest_framework.views import APIView
 from userauth.models import SiteUser
-from userprofile.serializers import LightProfileSerializer
+from userprofile.serializers import PresenceProfileSerializer
 
 from .models import Friendship
 from .serializers import FriendshipSerializer
@@ -44,7 +44,9 @@ class FriendSee(APIView):
                 friends.append(f.to_user.profile)
             else:
                 friends.append(f.from_user.profile)
-        serializer = LightProfileSerializer(friends, many=True)
+        serializer = PresenceProfileSerializer(
+            friends, many=True,
+            context=PresenceProfileSerializer.presence_context(friends))
         return Response({'friends': serializer.data}, status=status.HTTP_200_OK)
 
 class FriendRequestsRespond(APIView):
@@ -0,0 +1,64 @@
+"""Latency-compensated timing of the answers of a round.
+
+Answer times are measured on the server only, by the consumer of the
+player's socket: from the moment it receives the round's game_round
+frame to the moment the guess reaches it. Channel-layer hops to the
+worker owning the session are thus left out, wherever the socket is
+connected; the engine only bounds that delta by its own. The remaining
+legs (the frame travelling to the player, the guess travelling back)
+make up about one round trip, so the player's reaction time is that
+delta minus the socket's RTT.
+
+The RTT is estimated by each socket with game_ping frames answered by
+``pong`` actions, smoothed like TCP's SRTT (RFC 6298), and capped by
+MAX_LATENCY_COMPENSATION so that a client delaying its pongs cannot buy
+more than that.
+"""
+
+import itertools
+import time
+
+# Weight of a new sample in the smoothed RTT.
+RTT_ALPHA = 0.125
+# Pings awaiting their pong; older ones are forgotten.
+MAX_PENDING_PINGS = 4
+
+
+class RttEstimator:
+    """Smoothed round-trip time of one socket, from its ping/pong exchanges."""
+
+    __slots__ = ('rtt', '_pending', '_nonces')
+
+    def __init__(self) -> None:
+        """Start with no estimate."""
+        self.rtt = None
+        self._pending = {}
+        self._nonces = itertools.count(1)
+
+    def ping(self) -> dict:
+        """Timestamp a new ping and return its frame."""
+        nonce = next(self._nonces)
+        self._pending[nonce] = time.monotonic()
+        if len(self._pending) > MAX_PENDING_PINGS:
+            del self._pending[next(iter(self._pending))]
+        return {'type': 'game_ping', 'nonce': nonce}
+
+    def pong(self, nonce: object) -> float | None:
+        """Fold the answer of a ping into the estimate.
+
+        Returns:
+            The new estimate in seconds, or None for an unknown nonce
+        """
+        sent = self._pending.pop(nonce, None)
+        if sent is None:
+            return None
+        sample = time.monotonic() - sent
+        self.rtt = sample if self.rtt is None else (
+            (1 - RTT_ALPHA) * self.rtt + RTT_ALPHA * sample)
+        return self.rtt
+
+
+def fair_time(elapsed: float, rtt: float | None, max_compensation: float) -> float:
+    """Reaction time of a player from the server delta of its guess and its RTT."""
+    compensation = min(max(rtt or 0.0, 0.0), max_compensation)
+    return max(elapsed - compensation, 0.0)
@@ -0,0 +1,572 @@
+"""In-memory engine of live blind-test games.
+
+A GameSession holds everything a game needs while it is played: players,
+scores, the current round and its timer. Rounds run on the worker's event
+loop with monotonic clocks and never touch the DB, which is written twice
+per game, in one transaction each:
+- at start: the Game, its chat Room and the players (UserGameStats);
+- at the end: every GameRoundStats and UserRoundStats in bulk, the XP and
+  badges of the players, and Game.is_over.
+
+Answers are timed by the server and compensated for each socket's round
+trip (see game.clock). The consumer of each socket times the guess from
+the moment it received the round's start, on its own clock, so the
+channel-layer hops to and from the owning worker are not counted either.
+After the first right title, a round stays open for
+MAX_LATENCY_COMPENSATION seconds: a slower connection's guess that
+reacted faster can still win it.
+
+A session lives in the worker that created it. Sockets connected to other
+workers reach it through the channel layer: the channel of the owning
+worker is registered in Redis and actions for sessions that are not local
+are sent there. Frames for the players go to the ``game_{uid}`` group
+their sockets join, encoded once like chat broadcasts.
+
+A worker that dies loses its live games; a clean shutdown ends them and
+saves the rounds already played (see project/lifespan.py).
+"""
+
+import asyncio
+import json
+import time
+import uuid
+import weakref
+from datetime import timedelta
+
+from channels.db import database_sync_to_async
+from channels.layers import get_channel_layer
+from django.conf import settings
+from django.db import transaction
+from django.db.models import Case, F, When
+
+from chat.models import Room
+from music.decks import deal
+from music.matcher import TrackMatcher
+from music.models import Playlist
+from project import wire
+from project.defaults import get_badge
+from project.redis_utils import RedisManager
+from stats.models import GameRoundStats, UserGameStats, UserRoundStats
+from userprofile.models import Profile
+
+from .clock import fair_time
+from .models import Game
+
+# Bounds of the settings a host may choose.
+MIN_ROUND_SECONDS = 5
+MAX_ROUND_SECONDS = 120
+# XP of a round's winner: a fixed part plus a part shrinking with the time taken.
+WIN_XP = 10
+SPEED_XP = 20
+
+
+def frame_event(frame: dict) -> dict:
+    """Wrap a client frame in a ``game.frame`` channel-layer event.
+
+    The frame is encoded once for every wire format; consumers write the
+    encoding of theirs verbatim.
+    """
+    event = {'type': 'game.frame', 'text': json.dumps(frame)}
+    if wire.available():
+        event['packed'] = wire.encode(frame)
+    return event
+
+
+class Player:
+    """A player of a session and the XP it has earned so far."""
+
+    __slots__ = ('id', 'uid', 'username', 'score')
+
+    def __init__(self, id: int, uid: str, username: str) -> None:
+        """Create a player with no XP."""
+        self.id = id
+        self.uid = uid
+        self.username = username
+        self.score = 0
+
+    def as_frame(self) -> dict:
+        """Represent the player in client frames."""
+        return {'uid': self.uid, 'username': self.username, 'score': self.score}
+
+
+class Round:
+    """State of one round: its track, clock and result."""
+
+    __slots__ = ('number', 'track', 'matcher', 'started', 'over', 'closing',
+                 'answers', 'winner_id', 'elapsed', 'xp')
+
+    def __init__(self, number: int, track: dict) -> None:
+        """Prepare the answers of the track; the clock starts once it is announced."""
+        self.number = number
+        self.track = track
+        self.matcher = TrackMatcher(track['title'], track['artist'])
+        self.started = None
+        self.over = asyncio.Event()
+        # Timer ending the round after the first right title.
+        self.closing = None
+        # Profile id -> fair time of each right title, in seconds.
+        self.answers = {}
+        self.winner_id = None
+        self.elapsed = None
+        self.xp = 0
+
+    def settle(self, round_seconds: int) -> None:
+        """Pick the fastest fair answer as winner and compute its XP."""
+        if self.closing is not None:
+            self.closing.cancel()
+        if not self.answers:
+            return
+        self.winner_id = min(self.answers, key=self.answers.get)
+        self.elapsed = self.answers[self.winner_id]
+        remaining = max(0.0, 1 - self.elapsed / round_seconds)
+        self.xp = WIN_XP + int(SPEED_XP * remaining)
+
+
+class GameSession:
+    """A live game, from its lobby to its last round.
+
+    States: ``lobby`` (players join, the host starts), ``starting`` (the
+    Game is being written), ``playing`` and ``finished``.
+    """
+
+    def __init__(self, engine: 'GameEngine', host: dict, playlist: Playlist,
+                 rounds: int, round_seconds: int, is_public: bool,
+                 seed: int | None = None) -> None:
+        """Open the lobby of a new game with its host as only player."""
+        self.engine = engine
+        self.uid = str(uuid.uuid4())
+        self.group_name = f'game_{self.uid}'
+        self.playlist = playlist
+        self.round_count = rounds
+        self.round_seconds = round_seconds
+        self.is_public = is_public
+        # Seeded games all get the same deck (tournaments).
+        self.seed = seed
+        self.state = 'lobby'
+        self.host_id = host['id']
+        self.players = {host['id']: Player(**host)}
+        # Everyone who played, kept for the stats even after leaving.
+        self.roster = {}
+        self.tracks = []
+        self.rounds = []
+        self.current = None
+        self.game_id = None
+        self.room_uid = None
+        self.task = None
+        self.countdown = 0
+        self.stopping = False
+
+    async def handle(self, player: dict, action: str, content: dict) -> dict | None:
+        """Apply a player's action.
+
+        Returns:
+            A frame to send back to that player only (errors included), or
+            None when the outcome was broadcast to the game
+        """
+        if action == 'join':
+            return await self._join(player)
+        if action in ('leave', 'disconnect'):
+            return await self._leave(player, action)
+        if player['id'] not in self.players:
+            return {'type': 'error', 'message': 'Not a game player'}
+        if action == 'start':
+            return await self._start(player)
+        if action == 'guess':
+            return await self._guess(player, str(content.get('guess', '')),
+                                     content.get('rtt'), content.get('clock'))
+        return {'type': 'error', 'message': 'unsupported_action'}
+
+    async def _join(self, player: dict) -> dict | None:
+        """Add a player to the lobby, or resync a player back in a running game."""
+        if self.state != 'lobby':
+            if player['id'] in self.roster:
+                self.players.setdefault(player['id'], self.roster[player['id']])
+                return self._state_frame()
+            return {'type': 'error', 'message': 'game_already_started'}
+        if player['id'] not in self.players:
+            if len(self.players) >= settings.GAME_ENGINE['MAX_PLAYERS']:
+                return {'type': 'error', 'message': 'game_full'}
+            self.players[player['id']] = Player(**player)
+        await self.publish_lobby()
+        return None
+
+    async def _leave(self, player: dict, action: str) -> dict | None:
+        """Remove a player; a dropped socket only counts as leaving in the lobby."""
+        if player['id'] not in self.players or (
+                action == 'disconnect' and self.state != 'lobby'):
+            return None
+        del self.players[player['id']]
+        if self.state == 'lobby':
+            if not self.players:
+                await self.engine.discard(self)
+                return None
+            if player['id'] == self.host_id:
+                self.host_id = next(iter(self.players))
+            await self.publish_lobby()
+        elif not self.players:
+            self.stop()
+        return None
+
+    async def _start(self, player: dict) -> dict | None:
+        """Write the Game and play its rounds in the background (host only)."""
+        if player['id'] != self.host_id:
+            return {'type': 'error', 'message': 'Only the host can start the game'}
+        if self.state != 'lobby':
+            return {'type': 'error', 'message': 'game_already_started'}
+        error = await self.begin()
+        if error:
+            return error
+        await self.broadcast(self.started_frame())
+        return None
+
+    async def begin(self, countdown: float = 0) -> dict | None:
+        """Write the Game, then play its rounds in the background after a countdown.
+
+        Returns:
+            An error frame if the game could not start (it is back in the lobby)
+        """
+        self.state = 'starting'
+        self.roster = dict(self.players)
+        self.countdown = countdown
+        try:
+            await database_sync_to_async(self._open)()
+        except Exception as e:
+            print(f"Error starting game {self.uid}: {e}")
+            self.state = 'lobby'
+            return {'type': 'error', 'message': 'An unexpected error occured'}
+        if not self.tracks:
+            self.state = 'lobby'
+            return {'type': 'error', 'message': 'playlist_empty'}
+        self.state = 'playing'
+        self.task = asyncio.create_task(self._play())
+        return None
+
+    def started_frame(self) -> dict:
+        """Announce the start of the game to its players."""
+        return {'type': 'game_started', 'game_uid': self.uid,
+                'room_uid': self.room_uid, 'rounds': len(self.tracks),
+                'countdown': self.countdown,
+                'players': [p.as_frame() for p in self.players.values()]}
+
+    async def _guess(self, player: dict, guess: str, rtt: float | None,
+                     clock: list | None) -> dict | None:
+        """Time a guess against the current track; the fastest fair right title wins.
+
+        Guesses are matched loosely (see music.matcher); a wrong title that
+        names the artist is reported to the guesser as a hint. rtt is the
+        round trip of the guesser's socket and clock its [round, seconds
+        since that round's start], both measured by its consumer.
+        """
+        elapsed = time.monotonic()
+        current = self.current
+        if current is None or current.started is None or current.over.is_set():
+            return {'type': 'error', 'message': 'no_round_in_progress'}
+        elapsed -= current.started
+        if (isinstance(clock, list | tuple) and len(clock) == 2
+                and clock[0] == current.number and isinstance(clock[1], int | float)):
+            # The consumer received the start after this clock started and
+            # the guess before it got here: its delta can only be shorter.
+            elapsed = min(elapsed, max(clock[1], 0.0))
+        found = current.matcher.match(guess)
+        if not found.title:
+            return {'type': 'game_guess', 'game_uid': self.uid,
+                    'round': current.number, 'correct': False, 'artist': found.artist}
+        if player['id'] in current.answers:
+            return None
+        compensation = settings.GAME_ENGINE['MAX_LATENCY_COMPENSATION']
+        current.answers[player['id']] = fair_time(
+            elapsed, rtt if isinstance(rtt, (int, float)) else None, compensation)
+        if current.closing is None:
+            current.closing = asyncio.get_running_loop().call_later(
+                compensation, current.over.set)
+        return None
+
+    def stop(self) -> None:
+        """End the game after the current round (no players left, shutdown)."""
+        self.stopping = True
+        if self.current is not None:
+            self.current.over.set()
+
+    async def _play(self) -> None:
+        """Play every round, then save the game."""
+        conf = settings.GAME_ENGINE
+        try:
+            await asyncio.sleep(self.countdown)
+            for number, track in enumerate(self.tracks, start=1):
+                await self._play_round(number, track)
+                if self.stopping or number == len(self.tracks):
+                    break
+                await asyncio.sleep(conf['INTERMISSION_SECONDS'])
+        finally:
+            await self._finish()
+
+    async def _play_round(self, number: int, track: dict) -> None:
+        """Play one round until it is won or its time is up."""
+        self.current = Round(number, track)
+        self.rounds.append(self.current)
+        await self.broadcast({'type': 'game_round', 'game_uid': self.uid,
+                              'round': number, 'rounds': len(self.tracks),
+                              'preview_url': track['preview_url'],
+                              'seconds': self.round_seconds}, starts_round=number)
+        self.current.started = time.monotonic()
+        try:
+            await asyncio.wait_for(self.current.over.wait(), self.round_seconds)
+        except TimeoutError:
+            self.current.over.set()
+        self.current.settle(self.round_seconds)
+        winner = self.roster.get(self.current.winner_id)
+        if winner:
+            winner.score += self.current.xp
+        await self.broadcast({
+            'type': 'game_round_end',
+            'game_uid': self.uid,
+            'round': number,
+            'track': {'title': track['title'], 'artist': track['artist'],
+                      'artwork_url': track['artwork_url']},
+            'winner': winner.username if winner else None,
+            'time': round(self.current.elapsed, 3) if winner else None,
+            'scores': [p.as_frame() for p in self.roster.values()],
+        }, ping=True)
+
+    async def _finish(self) -> None:
+        """Save the rounds played, announce the final scores and drop the session."""
+        self.state = 'finished'
+        self.current = None
+        try:
+            await database_sync_to_async(self._close)()
+        except Exception as e:
+            print(f"Error saving game {self.uid}: {e}")
+        await self.broadcast({'type': 'game_over', 'game_uid': self.uid,
+                              'scores': [p.as_frame() for p in self.roster.values()]})
+        await self.engine.discard(self)
+
+    def _open(self) -> None:
+        """Deal the tracks and write the Game, its Room and players at once."""
+        self.tracks = deal(self.playlist.id, self.round_count, list(self.roster),
+                           self.seed)
+        if not self.tracks:
+            return
+        with transaction.atomic():
+            room = Room.objects.create(name=self.group_name)
+            room.participants.add(*self.roster)
+            game = Game.objects.create(game_name=self.playlist.name, room=room,
+                                       uid=self.uid, is_public=self.is_public)
+            UserGameStats.objects.bulk_create(
+                UserGameStats(game=game, player_id=player_id)
+                for player_id in self.roster)
+        self.game_id = game.id
+        self.room_uid = str(room.uid)
+
+    def _close(self) -> None:
+        """Write every round, the players' XP and the end of the game at once.
+
+        The rows are bulk-inserted, so the post_save XP signal of
+        GameRoundStats does not fire: XP and badges are updated here.
+        """
+        full_time = timedelta(seconds=self.round_seconds)
+        earned = {player_id: player.score for player_id, player in self.roster.items()
+                  if player.score}
+        with transaction.atomic():
+            round_rows = GameRoundStats.objects.bulk_create(
+                GameRoundStats(game_id=self.game_id, round_number=played.number,
+                               winner_id=played.winner_id,
+                               track_id=played.track['itunes_id'])
+                for played in self.rounds)
+            UserRoundStats.objects.bulk_create(
+                UserRoundStats(game_id=self.game_id, player_id=player_id, round=row,
+                               track_id=played.track['itunes_id'],
+                               is_won=played.winner_id == player_id,
+                               time=(timedelta(seconds=played.answers[player_id])
+                                     if player_id in played.answers else full_time),
+                               xp_earned=(played.xp if played.winner_id == player_id
+                                          else 0))
+                for played, row in zip(self.rounds, round_rows, strict=True)
+                for player_id in self.roster)
+            Game.objects.filter(id=self.game_id).update(is_over=True)
+            if earned:
+                Profile.objects.filter(id__in=earned).update(exp_points=Case(
+                    *(When(id=player_id, then=F('exp_points') + xp)
+                      for player_id, xp in earned.items())))
+                profiles = list(Profile.objects.filter(id__in=earned)
+                                .only('id', 'exp_points'))
+                for profile in profiles:
+                    profile.badges = get_badge(profile.exp_points)
+                Profile.objects.bulk_update(profiles, ['badges'])
+
+    async def publish_lobby(self) -> None:
+        """Send the lobby's players and settings to the game."""
+        await self.broadcast(self._state_frame())
+
+    def _state_frame(self) -> dict:
+        """Describe the session to (re)joining players."""
+        frame = {
+            'type': 'game_lobby' if self.state == 'lobby' else 'game_state',
+            'game_uid': self.uid,
+            'state': self.state,
+            'host': (self.players[self.host_id].username
+                     if self.host_id in self.players else None),
+            'playlist': self.playlist.slug,
+            'rounds': self.round_count,
+            'round_seconds': self.round_seconds,
+            'players': [p.as_frame() for p in self.players.values()],
+        }
+        if self.state != 'lobby':
+            frame['room_uid'] = self.room_uid
+            frame['round'] = self.current.number if self.current else None
+        return frame
+
+    async def broadcast(self, frame: dict, ping: bool = False,
+                        starts_round: int | None = None) -> None:
+        """Send a frame to every socket in the game's group.
+
+        With ping, the sockets also measure their round trip (see game.clock),
+        e.g. between two rounds, while nothing else is timed. With
+        starts_round, they start the clock of that round.
+        """
+        event = frame_event(frame)
+        if ping:
+            event['ping'] = True
+        if starts_round is not None:
+            event['round_start'] = {'game_uid': self.uid, 'round': starts_round}
+        await get_channel_layer().group_send(self.group_name, event)
+
+
+class GameEngine:
+    """Registry of the sessions held by this worker.
+
+    Sessions and the channel listening for forwarded actions belong to the
+    event loop they were created on: ASGI workers run a single one.
+    """
+
+    def __init__(self) -> None:
+        """Create an engine with no session."""
+        self.sessions: dict[str, GameSession] = {}
+        self._listeners: weakref.WeakKeyDictionary[
+            asyncio.AbstractEventLoop, tuple
+        ] = weakref.WeakKeyDictionary()
+
+    async def create(
+        self, host: dict, content: dict
+    ) -> tuple[GameSession | None, dict | None]:
+        """Open a lobby from a ``create`` frame.
+
+        Frame: {'module': 'game', 'action': 'create', 'playlist': <slug>,
+        'rounds': int, 'round_seconds': int, 'is_public': bool,
+        'seed': int (optional, same tracks for every game of that seed)}.
+
+        Returns:
+            The session, or an error frame
+        """
+        conf = settings.GAME_ENGINE
+        try:
+            rounds = int(content.get('rounds', conf['ROUNDS']))
+            round_seconds = int(content.get('round_seconds', conf['ROUND_SECONDS']))
+            seed = None if content.get('seed') is None else int(content['seed'])
+        except (TypeError, ValueError):
+            return None, {'type': 'error',
+                          'message': 'rounds, round_seconds and seed must be integers'}
+        if not (1 <= rounds <= conf['MAX_ROUNDS']
+                and MIN_ROUND_SECONDS <= round_seconds <= MAX_ROUND_SECONDS):
+            return None, {'type': 'error', 'message': 'invalid_game_settings'}
+        playlist = await Playlist.objects.filter(
+            slug=str(content.get('playlist'))).afirst()
+        if playlist is None:
+            return None, {'type': 'error', 'message': 'Playlist not found'}
+        session = await self.open_session([host], playlist, rounds, round_seconds,
+                                          bool(content.get('is_public', False)), seed)
+        return session, None
+
+    async def open_session(self, players: list, playlist: Playlist, rounds: int,
+                           round_seconds: int, is_public: bool,
+                           seed: int | None = None) -> GameSession:
+        """Register a new session in this worker; the first player hosts it."""
+        session = GameSession(self, players[0], playlist, rounds, round_seconds,
+                              is_public, seed)
+        for player in players[1:]:
+            session.players[player['id']] = Player(**player)
+        self.sessions[session.uid] = session
+        await RedisManager.set_game_session_owner(
+            session.uid, await self._channel(), settings.GAME_ENGINE['SESSION_TTL'])
+        return session
+
+    async def dispatch(self, game_uid: str, player: dict, action: str,
+                       content: dict) -> dict | None:
+        """Route a player's action to its session, wherever it lives.
+
+        Returns:
+            A frame for that player only; replies of sessions held by other
+            workers are sent to the player's ``user_`` group instead
+        """
+        session = self.sessions.get(game_uid)
+        if session is not None:
+            return await session.handle(player, action, content)
+        owner = await RedisManager.get_game_session_owner(game_uid)
+        if owner is None:
+            return {'type': 'error', 'message': 'game_not_found'}
+        await get_channel_layer().send(owner, {
+            'type': 'game.action',
+            'game_uid': game_uid,
+            'player': player,
+            'action': action,
+            'content': content,
+        })
+        return None
+
+    async def discard(self, session: GameSession) -> None:
+        """Forget a finished or abandoned session."""
+        self.sessions.pop(session.uid, None)
+        await RedisManager.clear_game_session_owner(session.uid)
+
+    async def shutdown(self) -> None:
+        """End every session of the running loop, saving the rounds played."""
+        tasks = []
+        for session in list(self.sessions.values()):
+            if session.task is not None:
+                session.stop()
+                tasks.append(session.task)
+            else:
+                await self.discard(session)
+        await asyncio.gather(*tasks, return_exceptions=True)
+        listener = self._listeners.pop(asyncio.get_running_loop(), None)
+        if listener is not None:
+            listener[1].cancel()
+
+    async def _channel(self) -> str:
+        """Return the channel this worker receives forwarded actions on."""
+        loop = asyncio.get_running_loop()
+        listener = self._listeners.get(loop)
+        if listener is None or listener[1].done():
+            layer = get_channel_layer()
+            # Default prefix: channels_redis reads every process-local channel
+            # through one shared receive loop, which only serves that prefix.
+            channel_name = await layer.new_channel()
+            task = loop.create_task(self._listen(layer, channel_name))
+            listener = (channel_name, task)
+            self._listeners[loop] = listener
+        return listener[0]
+
+    async def _listen(self, layer: object, channel_name: str) -> None:
+        """Apply the actions other workers forward to this worker's sessions."""
+        while True:
+            message = await layer.receive(channel_name)
+            # Only local sessions: a stale owner record must not bounce actions back.
+            session = self.sessions.get(message['game_uid'])
+            try:
+                if session is not None:
+                    reply = await session.handle(message['player'], message['action'],
+                                                 message['content'])
+                elif message['action'] != 'disconnect':
+                    reply = {'type': 'error', 'message': 'game_not_found'}
+                else:
+                    reply = None
+                if reply is not None:
+                    event = frame_event(reply)
+                    if message['action'] == 'join' and reply['type'] == 'error':
+                        # The sockets subscribed to the game to see its lobby.
+                        event['leave_game'] = message['game_uid']
+                    await layer.group_send(f"user_{message['player']['id']}", event)
+            except Exception as e:
+                print(f"Error handling forwarded game action: {e}")
+
+
+game_engine = GameEngine()
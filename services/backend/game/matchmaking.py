@@ -0,0 +1,136 @@
+"""Matchmaking of public games, shared by every worker through Redis.
+
+Players queue for a playlist with ``queue-join`` frames. Each playlist has
+two Redis sorted sets, one scoring the queued profiles by exp_points and
+one by the time they joined, so joining and leaving are O(log N).
+
+Lobbies are formed around a player (the anchor, tried from the longest
+waiting), among players whose exp_points are within a window around the
+anchor's.
+The window widens with the anchor's wait (MATCHMAKING settings). Within
+LATENCY_BUDGET seconds a full lobby (LOBBY_SIZE) is required; past it,
+MIN_PLAYERS are enough. A Lua script takes a lobby's players out of the
+queue atomically, so every worker can match the same queues: each one
+tries when a player joins through it and on every tick.
+
+The worker that forms a lobby hosts its session (game.engine): the Game,
+its Room and participants are written in one transaction, then each
+player is notified through its ``user_{id}`` group. Sockets receiving the
+notification join the game's group before the first round starts.
+"""
+
+import asyncio
+import weakref
+
+from channels.layers import get_channel_layer
+from django.conf import settings
+
+from music.models import Playlist
+from project.redis_utils import RedisManager
+
+from .engine import frame_event, game_engine
+
+
+class Matchmaker:
+    """Queue players and form lobbies; one ticker task per event loop."""
+
+    def __init__(self) -> None:
+        """Create a matchmaker with no ticker yet."""
+        self._tickers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Task]" = (
+            weakref.WeakKeyDictionary()
+        )
+
+    async def join(self, player: dict, skill: int, content: dict) -> dict:
+        """Queue a player from a ``queue-join`` frame and try to form its lobby.
+
+        Frame: {'module': 'game', 'action': 'queue-join', 'playlist': <slug>}.
+
+        Returns:
+            The frame to send back to the player
+        """
+        slug = str(content.get('playlist'))
+        if not await Playlist.objects.filter(slug=slug).aexists():
+            return {'type': 'error', 'message': 'Playlist not found'}
+        if not await RedisManager.join_matchmaking(slug, player, skill):
+            return {'type': 'error', 'message': 'matchmaking_unavailable'}
+        self._ensure_ticker()
+        await self.match(slug)
+        return {'type': 'queue_joined', 'playlist': slug}
+
+    async def leave(self, profile_id: int) -> bool:
+        """Take a player out of the queue; returns whether it was queued."""
+        return await RedisManager.leave_matchmaking(profile_id)
+
+    async def match(self, slug: str) -> None:
+        """Form every lobby that the queue of a playlist allows right now.
+
+        Players are tried as anchors from the longest waiting, so one that
+        nobody is close to yet does not hold back the rest of the queue.
+        """
+        conf = settings.MATCHMAKING
+        formed = True
+        while formed:
+            formed = False
+            for anchor_id, waited, skill in await RedisManager.waiting_in_matchmaking(slug):
+                window = min(conf['BASE_WINDOW'] + conf['WINDOW_GROWTH'] * waited,
+                             conf['MAX_WINDOW'])
+                needed = (conf['LOBBY_SIZE'] if waited < conf['LATENCY_BUDGET']
+                          else conf['MIN_PLAYERS'])
+                players = await RedisManager.pop_matchmaking_lobby(
+                    slug, anchor_id, skill - window, skill + window, needed,
+                    conf['LOBBY_SIZE'])
+                if players:
+                    await self._open_lobby(slug, players)
+                    # The queue changed: read it again.
+                    formed = True
+                    break
+
+    async def _open_lobby(self, slug: str, players: list) -> None:
+        """Start a public game for a lobby and notify its players."""
+        conf = settings.GAME_ENGINE
+        playlist = await Playlist.objects.filter(slug=slug).afirst()
+        players = [{key: player[key] for key in ('id', 'uid', 'username')}
+                   for player in players]
+        if playlist is None:
+            await self._notify(players, {'type': 'error', 'message': 'Playlist not found'})
+            return
+        session = await game_engine.open_session(
+            players, playlist, conf['ROUNDS'], conf['ROUND_SECONDS'], is_public=True)
+        error = await session.begin(countdown=settings.MATCHMAKING['COUNTDOWN_SECONDS'])
+        if error:
+            await game_engine.discard(session)
+            await self._notify(players, error)
+            return
+        await self._notify(players, {**session.started_frame(), 'type': 'game_matched'},
+                           game_uid=session.uid)
+
+    @staticmethod
+    async def _notify(players: list, frame: dict, game_uid: str | None = None) -> None:
+        """Send a frame to every socket of the players.
+
+        With a game_uid, the sockets also join that game's group.
+        """
+        event = {**frame_event(frame), 'type': 'game.matched', 'game_uid': game_uid}
+        layer = get_channel_layer()
+        await asyncio.gather(*(layer.group_send(f"user_{player['id']}", event)
+                               for player in players))
+
+    def _ensure_ticker(self) -> None:
+        """Start the periodic matching of the running loop if needed."""
+        loop = asyncio.get_running_loop()
+        task = self._tickers.get(loop)
+        if task is None or task.done():
+            self._tickers[loop] = loop.create_task(self._tick_forever())
+
+    async def _tick_forever(self) -> None:
+        """Retry every queue periodically, so waiting players get wider windows."""
+        while True:
+            await asyncio.sleep(settings.MATCHMAKING['TICK_SECONDS'])
+            for slug in await RedisManager.matchmaking_playlists():
+                try:
+                    await self.match(slug)
+                except Exception as e:
+                    print(f"Error matching players of {slug}: {e}")
+
+
+matchmaker = Matchmaker()
@@ -1,5 +1,324 @@
 """Tests for the game module."""
 
-from django.test import TestCase
+import asyncio
+import time
+import uuid
 
-# Create your tests here.
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.test import TransactionTestCase, override_settings
+
+from music.models import Playlist, Track
+from project.redis_utils import RedisManager
+from project.testing import connect_global, register
+from stats.models import GameRoundStats, UserRoundStats
+from userprofile.models import Profile
+
+from .clock import RttEstimator, fair_time
+from .engine import GameSession, Round, game_engine
+from .matchmaking import matchmaker
+from .models import Game
+
+
+async def receive_frame(socket: WebsocketCommunicator, frame_type: str,
+                        **fields: object) -> dict:
+    """Return the next frame of a type with the given fields, skipping the others."""
+    while True:
+        frame = await socket.receive_json_from(timeout=5)
+        if frame['type'] == frame_type and fields.items() <= frame.items():
+            return frame
+
+
+@override_settings(GAME_ENGINE={'ROUNDS': 2, 'MAX_ROUNDS': 5, 'ROUND_SECONDS': 30,
+                                'INTERMISSION_SECONDS': 0, 'MAX_PLAYERS': 2,
+                                'SESSION_TTL': 60, 'RECENT_ROUNDS': 50,
+                                'MAX_LATENCY_COMPENSATION': 0.2})
+class GameEngineTests(TransactionTestCase):
+    """Validate game sessions played over the global WebSocket."""
+
+    def setUp(self) -> None:
+        """Create two players and a playlist of two tracks."""
+        self.host = register('host@mail.com', 'host_user')
+        self.guest = register('guest@mail.com', 'guest_user')
+        self.playlist = Playlist.objects.create(name='Rock', slug='rock',
+                                                rss_url='https://example.org/rock')
+        for itunes_id, title in ((1, 'Back in Black'), (2, 'Highway to Hell')):
+            Track.objects.create(itunes_id=itunes_id, title=title, artist='AC/DC',
+                                 preview_url=f'https://example.org/{itunes_id}.m4a'
+                                 ).playlists.add(self.playlist)
+
+    def test_full_game_is_written_at_start_and_end(self) -> None:
+        """A game should be played in memory and saved in bulk when over."""
+        async def scenario() -> None:
+            host = await connect_global(self.host)
+            guest = await connect_global(self.guest)
+            await host.send_json_to({'module': 'game', 'action': 'create',
+                                     'playlist': 'rock'})
+            lobby = await receive_frame(host, 'game_lobby')
+            game_uid = lobby['game_uid']
+
+            await guest.send_json_to({'module': 'game', 'action': 'start',
+                                      'game_uid': game_uid})
+            self.assertEqual((await receive_frame(guest, 'error'))['message'],
+                             'Not a game player')
+            await guest.send_json_to({'module': 'game', 'action': 'join',
+                                      'game_uid': game_uid})
+            lobby = await receive_frame(guest, 'game_lobby')
+            self.assertEqual(len(lobby['players']), 2)
+            self.assertEqual(await Game.objects.acount(), 0)
+
+            await host.send_json_to({'module': 'game', 'action': 'start',
+                                     'game_uid': game_uid})
+            started = await receive_frame(guest, 'game_started')
+            self.assertEqual(started['rounds'], 2)
+            for number, winner, socket in ((1, self.guest, guest), (2, self.host, host)):
+                playing = await receive_frame(socket, 'game_round', round=number)
+                title = (await Track.objects.aget(
+                    preview_url=playing['preview_url'])).title
+                await socket.send_json_to({'module': 'game', 'action': 'guess',
+                                           'game_uid': game_uid, 'guess': 'acdc'})
+                hint = await receive_frame(socket, 'game_guess')
+                self.assertEqual((hint['correct'], hint['artist']), (False, True))
+                await socket.send_json_to({'module': 'game', 'action': 'guess',
+                                           'game_uid': game_uid, 'guess': title[:-1].upper()})
+                ended = await receive_frame(socket, 'game_round_end', round=number)
+                self.assertEqual(ended['winner'], winner.profile.username)
+            over = await receive_frame(guest, 'game_over')
+            self.assertTrue(all(player['score'] > 0 for player in over['scores']))
+            self.assertNotIn(game_uid, game_engine.sessions)
+            await host.disconnect()
+            await guest.disconnect()
+
+        async_to_sync(scenario)()
+        game = Game.objects.get()
+        self.assertTrue(game.is_over)
+        self.assertEqual(game.room.participants.count(), 2)
+        self.assertEqual(GameRoundStats.objects.filter(game=game).count(), 2)
+        self.assertEqual(UserRoundStats.objects.filter(game=game, is_won=True).count(), 2)
+        self.assertEqual(UserRoundStats.objects.filter(game=game).count(), 4)
+        guest_profile = Profile.objects.get(id=self.guest.profile.id)
+        earned = sum(UserRoundStats.objects.filter(
+            game=game, player=guest_profile).values_list('xp_earned', flat=True))
+        self.assertEqual(guest_profile.exp_points, earned)
+
+    def test_answer_times_are_compensated_for_latency(self) -> None:
+        """A slower connection's right title should win if it was faster once compensated."""
+        async def scenario() -> None:
+            host = await connect_global(self.host)
+            guest = await connect_global(self.guest)
+            await host.send_json_to({'module': 'game', 'action': 'create',
+                                     'playlist': 'rock', 'rounds': 1})
+            game_uid = (await receive_frame(host, 'game_lobby'))['game_uid']
+            await guest.send_json_to({'module': 'game', 'action': 'join',
+                                      'game_uid': game_uid})
+            ping = await receive_frame(guest, 'game_ping')
+            await asyncio.sleep(0.15)
+            await guest.send_json_to({'module': 'game', 'action': 'pong',
+                                      'nonce': ping['nonce']})
+            await receive_frame(guest, 'game_lobby')
+
+            await host.send_json_to({'module': 'game', 'action': 'start',
+                                     'game_uid': game_uid})
+            playing = await receive_frame(host, 'game_round')
+            title = (await Track.objects.aget(preview_url=playing['preview_url'])).title
+            await host.send_json_to({'module': 'game', 'action': 'guess',
+                                     'game_uid': game_uid, 'guess': title})
+            await asyncio.sleep(0.05)
+            await guest.send_json_to({'module': 'game', 'action': 'guess',
+                                      'game_uid': game_uid, 'guess': title, 'rtt': 0,
+                                      'clock': [1, 1000]})
+            ended = await receive_frame(host, 'game_round_end')
+            self.assertEqual(ended['winner'], 'guest_user')
+            await receive_frame(guest, 'game_ping')
+            await receive_frame(host, 'game_over')
+            await host.disconnect()
+            await guest.disconnect()
+
+        async_to_sync(scenario)()
+        times = dict(UserRoundStats.objects.values_list('player__username', 'time'))
+        self.assertLess(times['guest_user'], times['host_user'])
+        self.assertLess(times['host_user'].total_seconds(), 1)
+
+    def test_guesses_are_timed_on_the_consumer_clock(self) -> None:
+        """Hops to the owning worker should not count, but never lengthen an answer."""
+        async def scenario() -> None:
+            players = [{'id': index, 'uid': str(index), 'username': f'p{index}'}
+                       for index in range(1, 5)]
+            session = GameSession(game_engine, players[0], self.playlist, 1, 30, False)
+            session.current = Round(1, {'title': 'Back in Black', 'artist': 'AC/DC'})
+            session.current.started = time.monotonic() - 1.0
+            for player, clock in zip(players, ([1, 0.4], None, [1, 5.0], [2, 0.1])):
+                self.assertIsNone(await session._guess(player, 'back in black', None, clock))
+            session.current.settle(30)
+            answers = session.current.answers
+            self.assertAlmostEqual(answers[1], 0.4)
+            for player_id in (2, 3, 4):
+                self.assertAlmostEqual(answers[player_id], 1.0, delta=0.1)
+            self.assertEqual(session.current.winner_id, 1)
+
+        async_to_sync(scenario)()
+
+    def test_rtt_estimate_and_fair_time(self) -> None:
+        """Pongs should be smoothed into the RTT, whose deduction is capped."""
+        latency = RttEstimator()
+        first, second = latency.ping(), latency.ping()
+        self.assertIsNone(latency.pong('unknown'))
+        self.assertGreaterEqual(latency.pong(first['nonce']), 0)
+        self.assertIsNone(latency.pong(first['nonce']))
+        self.assertIsNotNone(latency.pong(second['nonce']))
+        self.assertEqual(fair_time(2.0, 0.3, 0.5), 1.7)
+        self.assertEqual(fair_time(2.0, 3.0, 0.5), 1.5)
+        self.assertEqual(fair_time(0.1, 0.3, 0.5), 0.0)
+        self.assertEqual(fair_time(2.0, None, 0.5), 2.0)
+
+    def test_unknown_and_full_games_are_rejected(self) -> None:
+        """Joining should fail for unknown games and full lobbies."""
+        third = register('third@mail.com', 'third_user')
+
+        async def scenario() -> None:
+            host = await connect_global(self.host)
+            await host.send_json_to({'module': 'game', 'action': 'join',
+                                     'game_uid': str(uuid.uuid4())})
+            self.assertEqual((await receive_frame(host, 'error'))['message'],
+                             'game_not_found')
+            await host.send_json_to({'module': 'game', 'action': 'create',
+                                     'playlist': 'rock', 'rounds': 99})
+            self.assertEqual((await receive_frame(host, 'error'))['message'],
+                             'invalid_game_settings')
+            await host.send_json_to({'module': 'game', 'action': 'create',
+                                     'playlist': 'rock'})
+            game_uid = (await receive_frame(host, 'game_lobby'))['game_uid']
+
+            others = [await connect_global(self.guest), await connect_global(third)]
+            await others[0].send_json_to({'module': 'game', 'action': 'join',
+                                          'game_uid': game_uid})
+            await receive_frame(others[0], 'game_lobby')
+            await others[1].send_json_to({'module': 'game', 'action': 'join',
+                                          'game_uid': game_uid})
+            self.assertEqual((await receive_frame(others[1], 'error'))['message'],
+                             'game_full')
+
+            for socket in [host, *others]:
+                await socket.disconnect()
+
+        async_to_sync(scenario)()
+        self.assertEqual(Game.objects.count(), 0)
+
+    def test_join_refused_by_another_worker_unsubscribes(self) -> None:
+        """A join forwarded to the owning worker and refused there should leave the group."""
+        async def scenario() -> None:
+            host = await connect_global(self.host)
+            guest = await connect_global(self.guest)
+            await host.send_json_to({'module': 'game', 'action': 'create',
+                                     'playlist': 'rock'})
+            game_uid = (await receive_frame(host, 'game_lobby'))['game_uid']
+            # Seen from this worker, the session now lives elsewhere.
+            session = game_engine.sessions.pop(game_uid)
+            await guest.send_json_to({'module': 'game', 'action': 'join',
+                                      'game_uid': game_uid})
+            self.assertEqual((await receive_frame(guest, 'error'))['message'],
+                             'game_not_found')
+            game_engine.sessions[game_uid] = session
+            await session.publish_lobby()
+            await receive_frame(host, 'game_lobby')
+            self.assertTrue(await guest.receive_nothing(timeout=0.5))
+            await game_engine.discard(session)
+            await host.disconnect()
+            await guest.disconnect()
+
+        async_to_sync(scenario)()
+
+
+@override_settings(MATCHMAKING={'LOBBY_SIZE': 2, 'MIN_PLAYERS': 2, 'LATENCY_BUDGET': 60,
+                                'BASE_WINDOW': 100, 'WINDOW_GROWTH': 0, 'MAX_WINDOW': 100,
+                                'TICK_SECONDS': 0.1, 'COUNTDOWN_SECONDS': 1})
+class MatchmakingTests(TransactionTestCase):
+    """Validate the matchmaking queue of public games."""
+
+    def setUp(self) -> None:
+        """Create three players of different skills and a playlist."""
+        self.novice = register('novice@mail.com', 'novice_user')
+        self.peer = register('peer@mail.com', 'peer_user')
+        self.expert = register('expert@mail.com', 'expert_user')
+        Profile.objects.filter(id=self.peer.profile.id).update(exp_points=50)
+        Profile.objects.filter(id=self.expert.profile.id).update(exp_points=5000)
+        self.playlist = Playlist.objects.create(name='Pop', slug=f'pop-{uuid.uuid4()}',
+                                                rss_url='https://example.org/pop')
+        Track.objects.create(itunes_id=1, title='Flowers', artist='Miley Cyrus',
+                             preview_url='https://example.org/1.m4a'
+                             ).playlists.add(self.playlist)
+
+    def test_players_of_similar_skill_are_matched(self) -> None:
+        """Queued players within the skill window should be put in a public game."""
+        async def scenario() -> None:
+            expert = await connect_global(self.expert)
+            novice = await connect_global(self.novice)
+            peer = await connect_global(self.peer)
+            for socket in (expert, novice):
+                await socket.send_json_to({'module': 'game', 'action': 'queue-join',
+                                           'playlist': self.playlist.slug})
+                await receive_frame(socket, 'queue_joined')
+
+            await peer.send_json_to({'module': 'game', 'action': 'queue-join',
+                                     'playlist': self.playlist.slug})
+            matched = await receive_frame(peer, 'game_matched')
+            self.assertEqual({player['username'] for player in matched['players']},
+                             {'novice_user', 'peer_user'})
+            self.assertEqual((await receive_frame(novice, 'game_matched'))['game_uid'],
+                             matched['game_uid'])
+            await receive_frame(novice, 'game_round')
+
+            await expert.send_json_to({'module': 'game', 'action': 'queue-leave'})
+            await receive_frame(expert, 'queue_left')
+            await expert.send_json_to({'module': 'game', 'action': 'queue-leave'})
+            self.assertEqual((await receive_frame(expert, 'error'))['message'], 'not_queued')
+            self.assertNotIn(self.playlist.slug, await RedisManager.matchmaking_playlists())
+
+            await game_engine.shutdown()
+            for socket in (expert, novice, peer):
+                await socket.disconnect()
+
+        async_to_sync(scenario)()
+        game = Game.objects.get()
+        self.assertTrue(game.is_public)
+        self.assertEqual(set(game.room.participants.values_list('username', flat=True)),
+                         {'novice_user', 'peer_user'})
+        self.assertEqual(game.player_stats.count(), 2)
+
+    def test_latency_budget_widens_the_lobby(self) -> None:
+        """Past the latency budget, a lobby should form once the window is wide enough."""
+        async def scenario() -> None:
+            await RedisManager.join_matchmaking(
+                self.playlist.slug, {'id': 900, 'uid': 'a', 'username': 'a'}, 0)
+            await RedisManager.join_matchmaking(
+                self.playlist.slug, {'id': 901, 'uid': 'b', 'username': 'b'}, 400)
+            with override_settings(MATCHMAKING={**settings.MATCHMAKING,
+                                                'LOBBY_SIZE': 3, 'LATENCY_BUDGET': 0}):
+                popped = await RedisManager.pop_matchmaking_lobby(
+                    self.playlist.slug, 900, -100, 100, 2, 3)
+                self.assertEqual(popped, [])
+                popped = await RedisManager.pop_matchmaking_lobby(
+                    self.playlist.slug, 900, -500, 500, 2, 3)
+            self.assertEqual([player['id'] for player in popped], [900, 901])
+            self.assertEqual(await RedisManager.waiting_in_matchmaking(self.playlist.slug), [])
+            self.assertFalse(await matchmaker.leave(900))
+
+        async_to_sync(scenario)()
+
+    def test_joining_another_playlist_moves_the_player(self) -> None:
+        """A queued player joining another queue should leave the first one."""
+        async def scenario() -> None:
+            other = f'other-{uuid.uuid4()}'
+            player = {'id': 902, 'uid': 'c', 'username': 'c'}
+            self.assertTrue(await RedisManager.join_matchmaking(self.playlist.slug, player, 10))
+            self.assertTrue(await RedisManager.join_matchmaking(other, player, 10))
+            self.assertEqual(await RedisManager.waiting_in_matchmaking(self.playlist.slug), [])
+            playlists = await RedisManager.matchmaking_playlists()
+            self.assertNotIn(self.playlist.slug, playlists)
+            self.assertIn(other, playlists)
+            self.assertTrue(await RedisManager.leave_matchmaking(902))
+            self.assertNotIn(other, await RedisManager.matchmaking_playlists())
+            self.assertFalse(await RedisManager.leave_matchmaking(902))
+
+        async_to_sync(scenario)()
@@ -5,3 +5,7 @@ class MusicConfig(AppConfig):
     """Define linking of music module to the rest of the backend."""
     default_auto_field = 'django.db.models.BigAutoField'
     name = 'music'
+
+    def ready(self) -> None:
+        """Activate the signals of the music module."""
+        import music.signals  # noqa: F401
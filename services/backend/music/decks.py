@@ -0,0 +1,140 @@
+"""Per-worker index of playable tracks and the decks dealt from it.
+
+Picking a game's tracks with ``ORDER BY RANDOM()`` sorts the whole
+playlist on every game. Instead each worker loads the playable tracks of
+a playlist (those with a preview URL) once, with one query, and deals
+decks from memory:
+- sample() draws k tracks without replacement in O(k), with a sparse
+  Fisher-Yates shuffle that only remembers the positions it swapped;
+- tracks the players heard in their latest rounds (UserRoundStats) are
+  skipped while enough others remain;
+- a seed makes a deck reproducible, e.g. for every table of a tournament.
+
+sync_playlists bumps a version counter in Redis; an index built for an
+older version is reloaded on its next use. Without Redis, an index is
+trusted for TRACK_INDEX_TTL seconds.
+"""
+
+import random
+import threading
+import time
+from collections.abc import Sequence
+from typing import NamedTuple
+
+from django.conf import settings
+
+from project.redis_utils import RedisManager
+from stats.models import UserRoundStats
+
+from .models import Track
+
+TRACK_FIELDS = ('itunes_id', 'title', 'artist', 'preview_url', 'artwork_url')
+
+
+class PlaylistTracks(NamedTuple):
+    """Playable tracks of a playlist, as loaded for one version of the playlists."""
+
+    version: int | None
+    loaded_at: float
+    # Sorted, so that a seed deals the same deck on every worker.
+    ids: tuple
+    tracks: dict
+
+
+def sample(population: Sequence, k: int, rng: random.Random,
+           exclude: frozenset | set = frozenset()) -> list:
+    """Draw k distinct items in O(k), avoiding excluded ones while possible.
+
+    A Fisher-Yates shuffle stopped after k steps, whose swaps are kept in
+    a dict instead of a copy of the population. Excluded items are set
+    aside as they come up and only used if too few others remain.
+    """
+    size = len(population)
+    swapped = {}
+    picked, set_aside = [], []
+    for i in range(size):
+        if len(picked) == k:
+            break
+        j = rng.randrange(i, size)
+        index = swapped.get(j, j)
+        swapped[j] = swapped.get(i, i)
+        item = population[index]
+        if item in exclude:
+            set_aside.append(item)
+        else:
+            picked.append(item)
+    return picked + set_aside[:k - len(picked)]
+
+
+class TrackIndex:
+    """Thread-safe map of playlist id -> PlaylistTracks."""
+
+    def __init__(self, ttl: float) -> None:
+        """Create an empty index trusting entries ttl seconds without Redis."""
+        self.ttl = ttl
+        self._playlists: dict[int, PlaylistTracks] = {}
+        self._lock = threading.Lock()
+
+    def get(self, playlist_id: int) -> PlaylistTracks:
+        """Return the playable tracks of a playlist, loading them if stale.
+
+        Sync code only.
+        """
+        version = RedisManager.get_playlists_version_sync()
+        with self._lock:
+            entry = self._playlists.get(playlist_id)
+        if entry is not None and (
+                entry.version == version if version is not None
+                else entry.loaded_at + self.ttl > time.monotonic()):
+            return entry
+        tracks = {track['itunes_id']: track for track in
+                  Track.objects.filter(playlists=playlist_id)
+                  .exclude(preview_url__isnull=True).exclude(preview_url='')
+                  .values(*TRACK_FIELDS)}
+        entry = PlaylistTracks(version, time.monotonic(), tuple(sorted(tracks)), tracks)
+        with self._lock:
+            self._playlists[playlist_id] = entry
+        return entry
+
+    def invalidate(self) -> None:
+        """Drop every playlist of this worker."""
+        with self._lock:
+            self._playlists.clear()
+
+
+track_index = TrackIndex(settings.TRACK_INDEX_TTL)
+
+
+def recent_track_ids(profile_ids: Sequence, rounds: int) -> set:
+    """Return the tracks of the latest rounds of each profile."""
+    recent = set()
+    for profile_id in profile_ids:
+        recent.update(UserRoundStats.objects.filter(player_id=profile_id)
+                      .exclude(track_id__isnull=True)
+                      .order_by('-played_at')
+                      .values_list('track_id', flat=True)[:rounds])
+    return recent
+
+
+def deal(playlist_id: int, k: int, profile_ids: Sequence = (),
+         seed: int | None = None) -> list:
+    """Deal a deck of up to k tracks of a playlist (sync code only).
+
+    Args:
+        playlist_id: Playlist to draw from
+        k: Number of rounds
+        profile_ids: Players whose recently heard tracks are avoided;
+            ignored for seeded decks, which must not depend on the players
+        seed: Makes the deck reproducible
+
+    Returns:
+        Track dicts with the TRACK_FIELDS keys
+    """
+    playlist = track_index.get(playlist_id)
+    exclude = frozenset()
+    if seed is None and profile_ids:
+        exclude = frozenset(recent_track_ids(profile_ids,
+                                             settings.GAME_ENGINE['RECENT_ROUNDS']))
+    rng = random.Random(seed)
+    return [playlist.tracks[track_id]
+            for track_id in sample(playlist.ids, k, rng, exclude)]
@@ -0,0 +1,97 @@
+"""Benchmark of the guess matcher (music.matcher) on the synced tracks."""
+
+import random
+import statistics
+import time
+from argparse import ArgumentParser
+
+from django.core.management.base import BaseCommand
+
+from music.matcher import TrackMatcher, allowed_typos, normalize
+from music.models import Playlist, Track
+
+from .seed_playlists import STATIC_TRACK_IDS
+
+
+def with_typos(text: str, count: int, rng: random.Random) -> str:
+    """Replace count letters of a text with random ones."""
+    chars = list(text)
+    letters = [i for i, char in enumerate(chars) if char.isalpha()]
+    for i in rng.sample(letters, min(count, len(letters))):
+        others = 'abcdefghijklmnopqrstuvwxyz'.replace(chars[i].lower(), '')
+        chars[i] = rng.choice(others)
+    return ''.join(chars)
+
+
+class Command(BaseCommand):
+    """Time matcher builds and guesses per playlist group."""
+
+    help = ("Benchmark the guess matcher on the synced tracks of the static "
+            "(STATIC_TRACK_IDS) and RSS playlists.")
+
+    def add_arguments(self, parser: ArgumentParser) -> None:
+        """Declare the --repeat and --seed options."""
+        parser.add_argument(
+            "--repeat", type=int, default=20,
+            help="Times each guess is matched.",
+        )
+        parser.add_argument(
+            "--seed", type=int, default=0,
+            help="Seed of the generated typos and wrong answers.",
+        )
+
+    def handle(self, *args: tuple, **options: dict) -> None:
+        """Benchmark the static and the RSS playlists separately."""
+        groups = {
+            "static": Playlist.objects.filter(slug__in=STATIC_TRACK_IDS),
+            "rss": Playlist.objects.exclude(rss_url=''),
+        }
+        for label, playlists in groups.items():
+            tracks = list(Track.objects.filter(playlists__in=playlists)
+                          .distinct().values_list('title', 'artist'))
+            if not tracks:
+                self.stdout.write(self.style.WARNING(
+                    f"{label}: no tracks. "
+                    "Run 'python manage.py sync_playlists' first."))
+                continue
+            self._bench(label, tracks, options)
+
+    def _bench(self, label: str, tracks: list, options: dict) -> None:
+        """Time matcher builds and guesses, and report each kind's acceptance."""
+        rng = random.Random(options["seed"])
+        builds, matches = [], []
+        accepted = {"exact": 0, "typos": 0, "title+artist": 0, "artist": 0, "wrong": 0}
+
+        for title, artist in tracks:
+            started = time.perf_counter_ns()
+            matcher = TrackMatcher(title, artist)
+            builds.append(time.perf_counter_ns() - started)
+
+            plain = normalize(title)
+            other_title = rng.choice(tracks)[0]
+            guesses = {
+                "exact": (title, 'title'),
+                "typos": (with_typos(plain, allowed_typos(plain), rng), 'title'),
+                "title+artist": (f"{plain} {artist}", 'title'),
+                "artist": (artist, 'artist'),
+                "wrong": (other_title, 'title'),
+            }
+            for kind, (guess, part) in guesses.items():
+                if kind == "wrong" and normalize(other_title) == plain:
+                    continue
+                started = time.perf_counter_ns()
+                for _ in range(options["repeat"]):
+                    found = matcher.match(guess)
+                matches.append((time.perf_counter_ns() - started) / options["repeat"])
+                accepted[kind] += getattr(found, part)
+
+        matches.sort()
+        self.stdout.write(f"{label}: {len(tracks)} tracks")
+        self.stdout.write(f"  build  mean {statistics.fmean(builds) / 1000:6.1f} us")
+        self.stdout.write(
+            f"  match  mean {statistics.fmean(matches) / 1000:6.1f} us, "
+            f"p50 {matches[len(matches) // 2] / 1000:.1f} us, "
+            f"p99 {matches[int(len(matches) * 0.99)] / 1000:.1f} us")
+        rates = ", ".join(f"{kind} {count / len(tracks):.0%}"
+                          for kind, count in accepted.items())
+        self.stdout.write(f"  accepted: {rates}")
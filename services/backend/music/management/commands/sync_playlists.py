@@ -2,6 +2,7 @@ from django.core.management.base import BaseCommand
 
 from music.models import Playlist, Track
 from music.itunes_client import fetch_ids_from_rss, batch_lookup, full_lookup
+from project.redis_utils import RedisManager
 from .seed_playlists import STATIC_TRACK_IDS
 
 
@@ -125,4 +126,6 @@ class Command(BaseCommand):
                 )
                 continue
 
+        # Workers reload their track index (music/decks.py) on next use.
+        RedisManager.bump_playlists_version_sync()
         self.stdout.write(self.style.SUCCESS("All playlists synced."))
\ No newline at end of file
@@ -0,0 +1,209 @@
+"""Forgiving matching of blind-test guesses against a track's title and artist.
+
+Titles and artists are normalized once, when a track is loaded into a
+round: accents, case and punctuation are dropped, as are the decorations
+that nobody types ("(feat. X)", "[Live]", "- 2011 Remaster", ...). The
+bracketed words of a title are also kept in an extra form ("(I Can't Get
+No) Satisfaction"), and alone when they spell out the rest ("P.Y.T.
+(Pretty Young Thing)"). Each guess is normalized the same way, then
+accepted if it is equal to one of the forms or close enough to it:
+- a trigram signature first rejects guesses that share too little with
+  the answer, without computing any distance;
+- the remaining ones are compared with an edit distance bounded by the
+  typos allowed for the answer's length, which stops as soon as the bound
+  is exceeded.
+A guess costs a few microseconds, so it can run on every submitted guess.
+"""
+
+import re
+import unicodedata
+from typing import NamedTuple
+
+# Bracketed parts: "(feat. X)", "[Live]", "(2011 Remaster)", ...
+_BRACKETS = re.compile(r'\([^)]*\)|\[[^\]]*\]|\{[^}]*\}')
+# Featured artists until the end of the string.
+_FEATURING = re.compile(r'\s(?:feat|ft|featuring)\b\.?.*$')
+# Version suffixes after a dash: " - Remastered 2011", " - Radio Edit".
+_VERSION = re.compile(
+    r'\s[-–—]\s.*\b(?:remaster(?:ed)?|version|edit|mix|live|mono|stereo'
+    r'|acoustic|instrumental|demo|bonus|deluxe|single|original)\b.*$')
+_NOT_ALNUM = re.compile(r'[^0-9a-z]+')
+# Leading articles players tend to leave out ("beatles", "rolling stones").
+_ARTICLE = re.compile(r'^(?:the|a|an|le|la|les|l)\s')
+# Dotted acronyms ("p.y.t.", "r.e.m"), joined into one word.
+_ACRONYM = re.compile(r'\b[0-9a-z](?:\.[0-9a-z])+\b\.?')
+# Separators of several credited artists (before normalization).
+_ARTISTS = re.compile(r'\s*(?:,|&|\+|\sx\s|\s(?:feat|ft|featuring|vs)\b\.?)\s*',
+                      re.IGNORECASE)
+
+# Share of the answer's trigrams a guess must have to be compared at all.
+MIN_TRIGRAM_SIMILARITY = 0.3
+# Characters of a guess that are matched; the rest is ignored.
+MAX_GUESS_LENGTH = 200
+
+
+def strip_accents(text: str) -> str:
+    """Remove diacritics (é -> e) and fold ligatures (œ -> oe)."""
+    folded = text.casefold().replace('œ', 'oe').replace('æ', 'ae')
+    decomposed = unicodedata.normalize('NFKD', folded)
+    return ''.join(char for char in decomposed if not unicodedata.combining(char))
+
+
+def normalize(text: str, keep_brackets: bool = False) -> str:
+    """Reduce a title, an artist or a guess to lowercase ASCII words.
+
+    Bracketed parts are dropped unless keep_brackets is set.
+    """
+    text = strip_accents(text)
+    text = _ACRONYM.sub(lambda acronym: acronym.group().replace('.', ''), text)
+    if not keep_brackets:
+        text = _BRACKETS.sub(' ', text)
+    text = _FEATURING.sub('', text)
+    text = _VERSION.sub('', text)
+    text = text.replace('&', ' and ')
+    return ' '.join(_NOT_ALNUM.sub(' ', text).split())
+
+
+def title_forms(title: str) -> list:
+    """Return the normalized forms of a title a guess may name.
+
+    The title without its bracketed parts, the title with them (the only
+    form left for "(Untitled)"), and each bracketed part whose initials
+    spell the rest of the title, like the expansion of an acronym.
+    """
+    plain = normalize(title)
+    forms = [plain, normalize(title, keep_brackets=True)]
+    for part in _BRACKETS.findall(strip_accents(title)):
+        expansion = normalize(part[1:-1])
+        initials = ''.join(word[0] for word in expansion.split())
+        if plain and initials == plain.replace(' ', ''):
+            forms.append(expansion)
+    return forms
+
+
+def trigrams(text: str) -> frozenset:
+    """Return the character trigrams of a normalized text, word edges included."""
+    padded = f'  {text} '
+    return frozenset(padded[i:i + 3] for i in range(len(padded) - 2))
+
+
+def allowed_typos(text: str) -> int:
+    """Number of edits tolerated for an answer of this length."""
+    length = len(text)
+    if length <= 3:
+        return 0
+    if length <= 6:
+        return 1
+    if length <= 12:
+        return 2
+    return 3
+
+
+def bounded_levenshtein(a: str, b: str, bound: int) -> int:
+    """Return the edit distance of a and b, or bound + 1 once it exceeds bound.
+
+    Only the diagonal band of width 2 * bound + 1 is computed, and the
+    computation stops at the first row whose best cell is over the bound.
+    """
+    if abs(len(a) - len(b)) > bound:
+        return bound + 1
+    # Equal ends cost nothing: only the differing middle goes through the table.
+    prefix = 0
+    while prefix < len(a) and prefix < len(b) and a[prefix] == b[prefix]:
+        prefix += 1
+    a, b = a[prefix:], b[prefix:]
+    while a and b and a[-1] == b[-1]:
+        a, b = a[:-1], b[:-1]
+    if len(a) > len(b):
+        a, b = b, a
+    over = bound + 1
+    previous = list(range(len(b) + 1))
+    for i in range(1, len(a) + 1):
+        start = max(1, i - bound)
+        end = min(len(b), i + bound)
+        current = [over] * (len(b) + 1)
+        current[0] = i if i <= bound else over
+        char = a[i - 1]
+        best = current[0]
+        for j in range(start, end + 1):
+            cost = 0 if char == b[j - 1] else 1
+            value = min(previous[j] + 1, current[j - 1] + 1, previous[j - 1] + cost)
+            current[j] = value if value < over else over
+            if current[j] < best:
+                best = current[j]
+        if best > bound:
+            return over
+        previous = current
+    return min(previous[len(b)], over)
+
+
+class Answer(NamedTuple):
+    """One accepted form of an answer with its precomputed signature."""
+
+    text: str
+    trigrams: frozenset
+    typos: int
+
+    @classmethod
+    def build(cls, text: str) -> 'Answer':
+        """Precompute the signature of a normalized answer."""
+        return cls(text, trigrams(text), allowed_typos(text))
+
+    def accepts(self, guess: str, guess_trigrams: frozenset) -> bool:
+        """Whether a normalized guess is this answer, give or take a few typos."""
+        if guess == self.text:
+            return True
+        if not self.typos or abs(len(guess) - len(self.text)) > self.typos:
+            return False
+        shared = len(self.trigrams & guess_trigrams)
+        if shared < MIN_TRIGRAM_SIMILARITY * len(self.trigrams):
+            return False
+        return bounded_levenshtein(guess, self.text, self.typos) <= self.typos
+
+
+class Match(NamedTuple):
+    """Which parts of a track a guess found."""
+
+    title: bool
+    artist: bool
+
+
+class TrackMatcher:
+    """Precomputed answers of one track, built when it is loaded into a round."""
+
+    __slots__ = ('titles', 'artists', 'pairs')
+
+    def __init__(self, title: str, artist: str) -> None:
+        """Normalize the title and every credited artist once."""
+        self.titles = self._answers(title_forms(title))
+        self.artists = self._answers(
+            [normalize(part) for part in [artist, *_ARTISTS.split(artist)]])
+        self.pairs = self._answers(
+            [f'{title.text} {other.text}'
+             for title in self.titles for other in self.artists]
+            + [f'{other.text} {title.text}'
+               for title in self.titles for other in self.artists])
+
+    @staticmethod
+    def _answers(forms: list) -> tuple:
+        """Build the distinct non-empty answers of forms, with and without article."""
+        forms = dict.fromkeys(form for text in forms
+                              for form in (text, _ARTICLE.sub('', text)))
+        return tuple(Answer.build(form) for form in forms if form)
+
+    def match(self, guess: str) -> Match:
+        """Check a raw guess against the title and the artists.
+
+        A guess naming both ("title - artist", "artist title") finds both.
+        Only the first MAX_GUESS_LENGTH characters are read.
+        """
+        text = normalize(guess[:MAX_GUESS_LENGTH])
+        if not text:
+            return Match(False, False)
+        signature = trigrams(text)
+        title = any(answer.accepts(text, signature) for answer in self.titles)
+        artist = any(answer.accepts(text, signature) for answer in self.artists)
+        if not (title and artist) and any(
+                answer.accepts(text, signature) for answer in self.pairs):
+            return Match(True, True)
+        return Match(title, artist)
@@ -0,0 +1,21 @@
+"""Define automatic actions based on a designated trigger for the music module."""
+
+from typing import Any
+
+from django.db.models.signals import m2m_changed, post_delete, post_save
+from django.dispatch import receiver
+
+from .decks import track_index
+from .models import Track
+
+
+@receiver(m2m_changed, sender=Track.playlists.through)
+@receiver(post_save, sender=Track)
+@receiver(post_delete, sender=Track)
+def invalidate_track_index(sender: type, **kwargs: Any) -> None:
+	"""Drop this worker's track index when tracks or playlist contents change.
+
+	Other workers learn about it from the version bumped by sync_playlists.
+	"""
+	if kwargs.get('action', 'post_').startswith('post_'):
+		track_index.invalidate()
@@ -1,15 +1,21 @@
 """Tests for the music module."""
 
+import random
 from io import StringIO
 from unittest.mock import Mock, patch
 
 import requests
 from django.core.management import call_command
-from django.test import TestCase
+from django.test import SimpleTestCase, TestCase
+from game.models import Game
 
 from music.itunes_client import batch_lookup, fetch_ids_from_rss, full_lookup
 from music.management.commands.seed_playlists import PLAYLISTS, STATIC_TRACK_IDS
+from music.decks import deal, sample, track_index
+from music.matcher import TrackMatcher, bounded_levenshtein, normalize
 from music.models import Playlist, Track
+from stats.models import GameRoundStats, UserRoundStats
+from userprofile.models import Profile
 
 
 class MusicModelsTests(TestCase):
@@ -318,3 +324,111 @@ class MusicManagementCommandsTests(TestCase):
 		self.assertTrue(Track.objects.filter(itunes_id=first_track_id, title='Static Song').exists())
 		self.assertTrue(playlist.tracks.filter(itunes_id=first_track_id).exists())
 		mock_full_lookup.assert_any_call(static_ids, country='US')
+
+
+class MatcherTests(SimpleTestCase):
+	"""Validate the fuzzy matching of guesses."""
+
+	def test_normalize_drops_decorations(self):
+		"""Accents, featurings, brackets and remaster suffixes should be ignored."""
+		self.assertEqual(normalize('Ça Plane Pour Moi (Remastered) [Live]'),
+			'ca plane pour moi')
+		self.assertEqual(normalize('Get Lucky (feat. Pharrell Williams)'), 'get lucky')
+		self.assertEqual(normalize('Hey Jude - Remastered 2015'), 'hey jude')
+		self.assertEqual(normalize('Rock ft. Someone'), 'rock')
+		self.assertEqual(normalize('Stay With Me'), 'stay with me')
+
+	def test_bounded_levenshtein(self):
+		"""The distance should be exact up to the bound and capped above it."""
+		self.assertEqual(bounded_levenshtein('kitten', 'sitting', 3), 3)
+		self.assertEqual(bounded_levenshtein('kitten', 'sitting', 2), 3)
+		self.assertEqual(bounded_levenshtein('abc', 'abc', 0), 0)
+		self.assertEqual(bounded_levenshtein('', 'ab', 2), 2)
+
+	def test_match_title_artist_and_both(self):
+		"""Typos, articles and combined guesses should be accepted, short noise not."""
+		matcher = TrackMatcher('Hey Jude - Remastered 2015', 'The Beatles')
+		self.assertEqual(matcher.match('hey judes'), (True, False))
+		self.assertEqual(matcher.match('beatles'), (False, True))
+		self.assertEqual(matcher.match('beatles - hey jude'), (True, True))
+		self.assertEqual(matcher.match('hey'), (False, False))
+		self.assertEqual(matcher.match('let it be'), (False, False))
+
+	def test_match_every_credited_artist(self):
+		"""Any of several credited artists should count as the artist."""
+		matcher = TrackMatcher('Kill Bill', 'SZA, Kendrick Lamar')
+		self.assertTrue(matcher.match('kendrick lamar').artist)
+		self.assertTrue(matcher.match('SZA').artist)
+		self.assertFalse(matcher.match('kiss').title)
+
+	def test_match_bracketed_titles_and_acronyms(self):
+		"""Bracketed words, acronyms and their expansions should be accepted."""
+		matcher = TrackMatcher("(I Can't Get No) Satisfaction", 'The Rolling Stones')
+		self.assertTrue(matcher.match('i cant get no satisfaction').title)
+		self.assertTrue(matcher.match('satisfaction').title)
+		matcher = TrackMatcher('P.Y.T. (Pretty Young Thing)', 'Michael Jackson')
+		for guess in ('pyt', 'P.Y.T.', 'pretty young thing', 'pyt pretty young thing'):
+			self.assertTrue(matcher.match(guess).title, guess)
+		live = TrackMatcher('Back in Black (Live)', 'AC/DC')
+		self.assertFalse(live.match('live').title)
+		untitled = TrackMatcher('(Untitled)', 'Sigur Rós')
+		self.assertTrue(untitled.match('untitled').title)
+		long_guess = 'hey jude' + 'x' * 5000
+		self.assertEqual(TrackMatcher('Hey Jude', 'The Beatles').match(long_guess),
+			(False, False))
+
+
+class DeckTests(TestCase):
+	"""Validate track sampling and decks dealt from the track index."""
+
+	def setUp(self):
+		"""Create a playlist of ten playable tracks and one without preview."""
+		self.playlist = Playlist.objects.create(name='Deck', slug='deck', rss_url='')
+		for itunes_id in range(1, 11):
+			Track.objects.create(
+				itunes_id=itunes_id, title=f'Song {itunes_id}', artist='Artist',
+				preview_url=f'https://example.org/{itunes_id}.m4a',
+			).playlists.add(self.playlist)
+		silent = Track.objects.create(itunes_id=99, title='Silent', artist='Artist')
+		silent.playlists.add(self.playlist)
+
+	def test_sample_avoids_excluded_items_while_possible(self):
+		"""Samples should be distinct and only fall back on excluded items."""
+		rng = random.Random(1)
+		population = list(range(100))
+		picked = sample(population, 10, rng, exclude=frozenset(range(50)))
+		self.assertEqual(len(set(picked)), 10)
+		self.assertTrue(all(item >= 50 for item in picked))
+		picked = sample(population[:5], 4, rng, exclude=frozenset(range(3)))
+		self.assertEqual(sorted(picked[:2]), [3, 4])
+		self.assertEqual(len(set(picked)), 4)
+		self.assertEqual(len(sample(population[:3], 10, rng)), 3)
+
+	def test_seeded_decks_are_reproducible(self):
+		"""A seed should always deal the same deck of playable tracks."""
+		first = deal(self.playlist.id, 5, seed=42)
+		self.assertEqual(first, deal(self.playlist.id, 5, seed=42))
+		self.assertNotIn(99, [track['itunes_id'] for track in first])
+		with self.assertNumQueries(0):
+			deal(self.playlist.id, 5, seed=7)
+
+	def test_deal_skips_recently_heard_tracks(self):
+		"""Tracks of a player's latest rounds should be left out of new decks."""
+		profile = Profile.objects.create(username='listener')
+		game = Game.objects.create(game_name='Deck')
+		for itunes_id in range(1, 8):
+			played = GameRoundStats.objects.create(game=game, round_number=itunes_id,
+				track_id=itunes_id)
+			UserRoundStats.objects.create(game=game, player=profile, round=played,
+				track_id=itunes_id)
+		deck = deal(self.playlist.id, 3, profile_ids=[profile.id])
+		self.assertEqual(sorted(track['itunes_id'] for track in deck), [8, 9, 10])
+
+	def test_index_is_reloaded_when_tracks_change(self):
+		"""Adding a track to the playlist should show up in the next deck."""
+		deal(self.playlist.id, 1)
+		Track.objects.create(
+			itunes_id=11, title='New', artist='Artist',
+			preview_url='https://example.org/11.m4a',
+		).playlists.add(self.playlist)
+		self.assertIn(11, track_index.get(self.playlist.id).tracks)
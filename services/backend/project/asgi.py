@@ -17,10 +17,15 @@ django_asgi_app = get_asgi_application()
 import project.routing
 from channels.routing import ProtocolTypeRouter, URLRouter
 from channels.auth import AuthMiddlewareStack
+from project.lifespan import LifespanApp
+from project.middleware import WebsocketProfileMiddleware
 
 application = ProtocolTypeRouter({
 	'http': django_asgi_app,
 	'websocket': AuthMiddlewareStack(
-		URLRouter(project.routing.websocket_urlpatterns),
+		WebsocketProfileMiddleware(
+			URLRouter(project.routing.websocket_urlpatterns),
+		),
 	),
+	'lifespan': LifespanApp(),
 })
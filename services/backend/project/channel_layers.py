@@ -0,0 +1,37 @@
+"""Channel layer spreading groups and channels over several Redis shards."""
+
+import hashlib
+
+from channels_redis.core import RedisChannelLayer
+
+
+def jump_hash(key: int, buckets: int) -> int:
+    """Map a 64-bit key to a bucket with Lamping & Veach's jump consistent hash.
+
+    Growing from n to n + 1 buckets only moves about 1/(n + 1) of the keys,
+    all of them to the new bucket.
+    """
+    bucket, candidate = -1, 0
+    while candidate < buckets:
+        bucket = candidate
+        key = (key * 2862933555777941757 + 1) & 0xFFFFFFFFFFFFFFFF
+        candidate = int((bucket + 1) * ((1 << 31) / ((key >> 33) + 1)))
+    return bucket
+
+
+class ShardedRedisChannelLayer(RedisChannelLayer):
+    """RedisChannelLayer whose shard is chosen with jump consistent hashing.
+
+    Every worker must list the same hosts in the same order (CHANNEL_REDIS_HOSTS):
+    a group such as ``user_42`` then lives on one shard that all workers agree
+    on, whichever worker its sockets are connected to.
+    """
+
+    def consistent_hash(self, value: str | bytes) -> int:
+        """Return the index of the host holding a group or channel."""
+        if self.ring_size == 1:
+            return 0
+        if isinstance(value, str):
+            value = value.encode('utf8')
+        key = int.from_bytes(hashlib.blake2b(value, digest_size=8).digest(), 'big')
+        return jump_hash(key, self.ring_size)
@@ -1,21 +1,42 @@
 """WebSocket consumer logic for public rooms and private direct messages."""
 
+import asyncio
+import json
+import time
 import uuid
+from datetime import datetime
 
 from channels.db import database_sync_to_async
 from channels.generic.websocket import (
     AsyncJsonWebsocketConsumer,
     AsyncWebsocketConsumer,
 )
-from chat.models import Message, Room
-from friends.models import Friendship
+from django.conf import settings
+from django.utils import timezone
+
+from chat.cache import room_members
+from chat.models import Message, ReadCursor, Room
+from chat.persistence import message_writer
+from game.clock import RttEstimator
+from game.engine import game_engine
+from game.matchmaking import matchmaker
 from game.models import Game
 from userauth.models import SiteUser
 from userprofile.models import Profile
 
+from . import wire
+from .presence_consumers import PresenceMixin
+from .ratelimit import RateLimitMixin
+from .redis_utils import RedisManager
+from .wire import WireMixin
+
+
+class GlobalConsumer(RateLimitMixin, WireMixin, PresenceMixin, AsyncJsonWebsocketConsumer):
+    """Handle chat WebSocket connections, message broadcasts, and status updates.
 
-class GlobalConsumer(AsyncJsonWebsocketConsumer):
-    """Handle chat WebSocket connections, message broadcasts, and status updates."""
+    Frames are routed by their ``module`` key (chat, game, presence), so one
+    socket per user carries everything.
+    """
     
     def __init__(self, *args: tuple, **kwargs: dict) -> None:
         """Define initialisation of consumer class."""
@@ -23,6 +44,12 @@ class GlobalConsumer(AsyncJsonWebsocketConsumer):
         
         self.room = None
         self.profile = None
+        self.direct_rooms = {}
+        self.game_uids = set()
+        self.latency = RttEstimator()
+        # game uid -> (round, monotonic time its start frame was received)
+        self.round_clocks = {}
+        self.queued = False
         self.room_name = "default_room"
         self.group_name = None
         self.chat_group_name = f"chat_{self.room_name}"
@@ -36,24 +63,36 @@ class GlobalConsumer(AsyncJsonWebsocketConsumer):
         self.active_layers = set()
         self.group_name = f"user_{self.profile.id}"
         await self.add_to_layer(self.group_name)
-        await self._update_online_status(is_online=True)
-        await self.accept()
+        # Presence only lives in Redis; the flush_presence job copies it to
+        # Profile.is_online / last_active in bulk.
+        await self.join_presence()
+        await self.accept_wire()
+        await self.broadcast_status("online")
         return
 
     async def disconnect(self, close_code: int) -> None:
         """Remove the socket from its channel-layer group when disconnecting."""
-        for layer in self.active_layers:
+        for layer in getattr(self, 'active_layers', ()):
             await self.channel_layer.group_discard(layer, self.channel_name)
-        await self._update_online_status(False)
+        for game_uid in self.game_uids:
+            await game_engine.dispatch(game_uid, self._player(), 'disconnect', {})
+        if self.queued:
+            await matchmaker.leave(self.profile.id)
+        await self.leave_presence()
         return
     
     async def receive_json(self, content: dict) -> None:
         """Receive websocket framework and reroute it to the appropriate module."""
         module = content.get("module")
+        if module in ("chat", "game", "presence") and not await self.check_rate_limit(
+                module, content.get("action")):
+            return
         if module == "chat":
             await self.chat_subroutine(content)
         elif module == "game":
             await self.game_subroutine(content)
+        elif module == "presence":
+            await self.presence_subroutine(content)
         else:
             await self.close(code=4405)
         return
@@ -72,81 +111,62 @@ class GlobalConsumer(AsyncJsonWebsocketConsumer):
         """Send a message to the specified channel."""
         await self.channel_layer.group_send(group_name, message)
 
-    @database_sync_to_async
-    def _get_profile_from_scope(self) -> Profile:
-        """Custom helper to find the Profile identity for a WebSocket connection."""
+    async def _get_profile_from_scope(self) -> Profile | None:
+        """Return the Profile resolved at handshake by WebsocketProfileMiddleware.
+
+        None (no profile for this socket) makes connect() close it with 4401.
+        """
         self.user = self.scope.get('user')
-        if self.user and isinstance(self.user, SiteUser) and self.user.is_authenticated:
-            try:
-                return self.user.profile
-            except Profile.DoesNotExist:
-                return None
         profile = self.scope.get('profile')
         if isinstance(profile, Profile):
             return profile
-        session = self.scope.get('session', {})
-        guest_id = session.get('guest_profile_id')
-        if guest_id:
-            return Profile.objects.filter(id=guest_id, is_guest=True).first()
-        return Profile.objects.create() # TODO: remove in prod: Should not happen: it would mean we have websocket connection before http connection
+        return None
     
     async def chat_subroutine(self, content: dict, **kwargs: dict) -> None:
-        """Process incoming message, delivered, and read actions from the client."""
+        """Process incoming message, join, delivered, and read actions from the client."""
         action = content.get('action')
 
-        if action == 'chat-message':
+        if action in ('chat-message', 'direct-message'):
             body = str(content.get('message', '')).strip()
             if not body:
                 await self.send_json({'type': 'error',
                                       'message': 'message is required'})
                 return
-            success, message = await self._save_message(body, action, content)
-            if not success:
-                await self.send_json(message)
+            room, error = await self._resolve_room(action, content)
+            if error:
+                await self.send_json(error)
                 return
+            message = await self._save_message(body, room)
 
-            await self.group_send(f'user_{self.profile.id}', {
-                'type': 'chat.message',
-                'message_uid': message.uid,
-                'message': message.body,
-                'sender': self._sender_name(),
-                'created': message.created.isoformat(),
-                'delivered': message.delivered,
-                'seen': message.seen,
-            })
+            # Encoded once here for the whole group; the event carries only
+            # the encodings, which recipients write verbatim.
+            frame = self._chat_frame(message)
+            event = {'type': 'chat.message', 'text': json.dumps(frame)}
+            if wire.available():
+                event['packed'] = wire.encode(frame)
+            await self.group_send(f'user_{self.profile.id}', event)
+            await self._track_message(message)
             return
-        elif action == 'direct-message':
-            body = str(content.get('message', '')).strip()
-            if not body:
-                await self.send_json({'type': 'error',
-                                      'message': 'message is required'})
-                return
-            success, message = await self._save_message(body, action, content)
-            if not success:
-                await self.send_json(message)
-                return
-
-            await self.group_send(f'user_{self.profile.id}', {
-                'type': 'chat.message',
-                'message_id': message.id,
-                'message': message.body,
-                'sender': self._sender_name(),
-                'created': message.created.isoformat(),
-                'delivered': message.delivered,
-                'seen': message.seen,
-            })
+        elif action == 'join':
+            await self._join_room(content)
+            return
+        elif action in ('delivered', 'read') and 'up_to' in content:
+            await self._acknowledge_range(action, content)
             return
         elif action in ('delivered', 'read'):
-            message_id = content.get('message_id')
-            if not message_id:
+            # Receipts name messages by uid: with write-behind persistence a
+            # broadcast message has no DB id yet.
+            try:
+                message_uid = uuid.UUID(str(content.get('message_uid')))
+            except ValueError:
                 await self.send_json({'type': 'error',
-                                      'message': 'message_id is required'})
+                                      'message': 'message_uid is required'})
                 return
 
             if action == 'delivered':
-                changed = await self._mark_delivered(message_id)
+                changed = await self._mark_delivered(message_uid)
             else:
-                changed = await self._mark_seen(message_id)
+                changed = await self._mark_seen(message_uid)
 
             if not changed:
                 await self.send_json({'type': 'error', 'message': 'message_not_found'})
@@ -154,7 +174,7 @@ class GlobalConsumer(AsyncJsonWebsocketConsumer):
 
             await self.group_send(self.group_name, {
                 'type': 'status.update',
-                'message_id': int(message_id),
+                'message_uid': str(message_uid),
                 'action': action,
                 'username': self._sender_name(),
             })
@@ -162,33 +182,265 @@ class GlobalConsumer(AsyncJsonWebsocketConsumer):
 
         await self.send_json({'type': 'error', 'message': 'unsupported_action'})
 
+    async def game_subroutine(self, content: dict) -> None:
+        """Process create, join, start, guess and leave actions of games.
+
+        Sessions are run by game.engine; this socket only joins the game's
+        group to receive its frames. queue-join and queue-leave go through
+        the matchmaking of public games (game.matchmaking). pong answers a
+        game_ping; guesses carry the resulting round trip (game.clock).
+        """
+        action = content.get('action')
+        if action == 'pong':
+            self.latency.pong(content.get('nonce'))
+            return
+        if action == 'queue-join':
+            self.queued = True
+            await self.send_json(await matchmaker.join(
+                self._player(), self.profile.exp_points, content))
+            return
+        if action == 'queue-leave':
+            self.queued = False
+            if await matchmaker.leave(self.profile.id):
+                await self.send_json({'type': 'queue_left'})
+            else:
+                await self.send_json({'type': 'error', 'message': 'not_queued'})
+            return
+        if action == 'create':
+            session, error = await game_engine.create(self._player(), content)
+            if error:
+                await self.send_json(error)
+                return
+            await self._enter_game(session.uid)
+            await session.publish_lobby()
+            return
+        if action not in ('join', 'start', 'guess', 'leave'):
+            await self.send_json({'type': 'error', 'message': 'unsupported_action'})
+            return
+        try:
+            game_uid = str(uuid.UUID(str(content.get('game_uid'))))
+        except ValueError:
+            await self.send_json({'type': 'error', 'message': 'game_uid is required'})
+            return
+        # Joined first so that the lobby frame of the join reaches this socket.
+        if action == 'join' and game_uid not in self.game_uids:
+            await self._enter_game(game_uid)
+        if action == 'guess':
+            # Set here, so that clients cannot claim their own timing.
+            clock = self.round_clocks.get(game_uid)
+            content = {**content, 'rtt': self.latency.rtt,
+                       'clock': clock and [clock[0], time.monotonic() - clock[1]]}
+        reply = await game_engine.dispatch(game_uid, self._player(), action, content)
+        if action == 'leave' or (action == 'join' and reply and reply['type'] == 'error'):
+            await self._leave_game(game_uid)
+        if reply:
+            await self.send_json(reply)
+
+    async def _enter_game(self, game_uid: str) -> None:
+        """Subscribe this socket to the frames of a game."""
+        self.game_uids.add(game_uid)
+        await self.add_to_layer(f'game_{game_uid}')
+        await self.send_json(self.latency.ping())
+
+    async def _leave_game(self, game_uid: str) -> None:
+        """Unsubscribe this socket from the frames of a game, if it was subscribed."""
+        if game_uid in self.game_uids:
+            self.game_uids.discard(game_uid)
+            self.round_clocks.pop(game_uid, None)
+            await self.remove_from_layer(f'game_{game_uid}')
+
+    def _player(self) -> dict:
+        """Describe this socket's profile to the game engine."""
+        return {'id': self.profile.id, 'uid': str(self.profile.uid),
+                'username': self.profile.username}
+
+    async def game_matched(self, event: dict) -> None:
+        """Enter the game matchmaking formed for this profile, then forward its frame."""
+        self.queued = False
+        if event['game_uid'] and event['game_uid'] not in self.game_uids:
+            await self._enter_game(event['game_uid'])
+        await self.game_frame(event)
+
+    async def game_frame(self, event: dict) -> None:
+        """Forward a game frame, already encoded by the engine, to the client.
+
+        A join refused by the worker owning the game comes back here, with
+        leave_game: the socket subscribed to the game for nothing.
+        """
+        if event.get('leave_game'):
+            await self._leave_game(event['leave_game'])
+        if event.get('round_start'):
+            self.round_clocks[event['round_start']['game_uid']] = (
+                event['round_start']['round'], time.monotonic())
+        await self.queue_json(event['packed' if self.wire == 'msgpack' else 'text'])
+        if event.get('ping'):
+            await self.send_json(self.latency.ping())
+
+    async def _join_room(self, content: dict) -> None:
+        """Make a room current and send its latest messages.
+
+        The messages come from the room's Redis ring buffer (one LRANGE);
+        the DB is only read for rooms that are not buffered yet.
+        """
+        try:
+            room_uid = uuid.UUID(str(content.get('room_uid')))
+        except ValueError:
+            await self.send_json({'type': 'error', 'message': 'room_uid is required'})
+            return
+        members = (room_members.peek(room_uid)
+                   or await database_sync_to_async(room_members.load)(room_uid))
+        if members is None or self.profile.id not in members.participant_ids:
+            await self.send_json({'type': 'error', 'message': 'Not a chat member'})
+            return
+        self.room = members.room
+
+        messages = await RedisManager.get_recent_messages(str(room_uid))
+        if messages is None:
+            # Messages sent while the DB is read are kept for the fill; the
+            # buffer is read again to include them.
+            await RedisManager.begin_recent_fill(str(room_uid))
+            messages = await self._load_recent_messages(members.room)
+            await RedisManager.fill_recent_messages(str(room_uid), messages)
+            messages = await RedisManager.get_recent_messages(str(room_uid)) or messages
+        await self.send_json({
+            'type': 'room_history',
+            'room_uid': str(room_uid),
+            'messages': messages,
+        })
+
+    async def _track_message(self, message: Message) -> None:
+        """Add a just-broadcast message to its room's ring buffer and unread counters."""
+        room_uid = message.room.uid
+        members = (room_members.peek(room_uid)
+                   or await database_sync_to_async(room_members.load)(room_uid))
+        recipients = members.participant_ids - {self.profile.id} if members else ()
+        await asyncio.gather(
+            RedisManager.push_recent_message(
+                str(room_uid), self._recent_entry(message, self.profile)),
+            RedisManager.increment_unread(list(recipients), str(room_uid)),
+        )
+
+    @staticmethod
+    def _recent_entry(message: Message, sender: Profile) -> dict:
+        """Represent a message in the ring buffer (flat, like MessageSerializer)."""
+        return {
+            'uid': str(message.uid),
+            'room': str(message.room.uid),
+            'sender': str(sender.uid),
+            'sender_name': sender.username,
+            'body': message.body,
+            'created': message.created.isoformat(),
+        }
+
     @database_sync_to_async
-    def _update_online_status(self, is_online: bool) -> None:
-        self.profile.is_online = is_online
-        self.profile.save(update_fields=['is_online'])
-    
+    def _load_recent_messages(self, room: Room) -> list:
+        """Read the latest messages of a cold room from the DB, newest first.
+
+        Messages this worker has queued for write-behind are merged in.
+        """
+        pending = [message for message in message_writer.pending()
+                   if message.room_id == room.id]
+        messages = list(Message.objects.filter(room=room).select_related(
+            'sender_profile', 'room')[:settings.CHAT_RECENT_MESSAGES])
+        if pending:
+            written = {message.uid for message in messages}
+            messages += [message for message in pending if message.uid not in written]
+            messages.sort(key=lambda message: message.created, reverse=True)
+        return [self._recent_entry(message, message.sender_profile)
+                for message in messages[:settings.CHAT_RECENT_MESSAGES]]
+
+    async def _acknowledge_range(self, action: str, content: dict) -> None:
+        """Acknowledge every message of a room up to ``up_to`` in one go.
+
+        Frame: {'module': 'chat', 'action': 'delivered' | 'read',
+        'room_uid': ..., 'up_to': <message uid>}. Messages of other senders
+        created up to that message are updated with one bulk UPDATE, and each
+        affected sender gets a single status_update for the whole range.
+        """
+        try:
+            room_uid = uuid.UUID(str(content.get('room_uid')))
+            up_to = uuid.UUID(str(content.get('up_to')))
+        except ValueError:
+            await self.send_json({'type': 'error',
+                                  'message': 'room_uid and up_to are required'})
+            return
+        members = (room_members.peek(room_uid)
+                   or await database_sync_to_async(room_members.load)(room_uid))
+        if members is None or self.profile.id not in members.participant_ids:
+            await self.send_json({'type': 'error', 'message': 'Not a chat member'})
+            return
+
+        marked = await self._mark_range(members.room, up_to, action)
+        if marked is None:
+            await self.send_json({'type': 'error', 'message': 'message_not_found'})
+            return
+        cutoff, sender_ids = marked
+        if action == 'read':
+            unread = await self._advance_read_cursor(members.room, cutoff)
+            await RedisManager.set_unread(self.profile.id, str(room_uid), unread)
+        event = {
+            'type': 'status.update',
+            'room_uid': str(room_uid),
+            'up_to': str(up_to),
+            'action': action,
+            'username': self._sender_name(),
+        }
+        await asyncio.gather(*(
+            self.group_send(f'user_{sender_id}', event) for sender_id in sender_ids
+        ))
 
     async def chat_message(self, event: dict) -> None:
-        """Forward a chat message event to the connected client."""
-        await self.send_json({
+        """Forward a chat message event to the connected client.
+
+        The frame was encoded once by the sender; it is only decoded again
+        for a MessagePack socket when the sender's worker did not offer that
+        format.
+        """
+        if self.wire != 'msgpack':
+            await self.queue_json(event['text'])
+        elif 'packed' in event:
+            await self.queue_json(event['packed'])
+        else:
+            await self.send_json(json.loads(event['text']))
+
+    def _chat_frame(self, message: Message) -> dict:
+        """Build the client frame of a chat message (same for every recipient)."""
+        return {
             'type': 'chat_message',
-            'group': self.group_name,
-            'sender': event['sender'],
+            'sender': self._sender_name(),
+            'message': message.body,
+            'message_uid': str(message.uid),
+            'created': message.created.isoformat(),
+            'delivered': message.delivered,
+            'seen': message.seen,
+        }
+
+    async def send_notification(self, event: dict) -> None:
+        """Forward a social notification (friend requests) to the connected client."""
+        await self.send_json({
+            'type': 'notification',
+            'module': event['module'],
             'message': event['message'],
-            'message_id': event.get('message_id'),
-            'created': event.get('created'),
-            'delivered': event.get('delivered'),
-            'seen': event.get('seen'),
+            'from-user': event['from-user'],
         })
 
     async def status_update(self, event: dict) -> None:
-        """Forward a delivery or read status update to the connected client."""
-        await self.send_json({
+        """Forward a delivery or read status update to the connected client.
+
+        Range receipts of a room supersede each other, so a client that
+        falls behind only gets the latest one per room and action.
+        """
+        key = None
+        if event.get('room_uid'):
+            key = ('status_update', event['room_uid'], event['action'])
+        await self.queue_json({
             'type': 'status_update',
-            'message_id': event['message_id'],
+            'message_uid': event.get('message_uid'),
+            'room_uid': event.get('room_uid'),
+            'up_to': event.get('up_to'),
             'action': event['action'],
             'username': event['username'],
-        })
+        }, key=key)
 
     def _sender_name(self) -> str:
         """Return the authenticated sender username or an anonymous fallback."""
@@ -203,64 +455,151 @@ class GlobalConsumer(AsyncJsonWebsocketConsumer):
             return False
         return self.room.participants.filter(id=self.profile.id).exists()
 
+    async def _resolve_room(self, action: str,
+                            content: dict) -> tuple[Room | None, dict | None]:
+        """Find the room a message targets and check the sender belongs to it.
+
+        Membership comes from the per-worker room cache, so a steady stream
+        of messages to the same room costs no DB query here.
+        """
+        if action == 'direct-message':
+            room_uid, error = await self._get_direct_room_uid(content)
+            if error:
+                return None, error
+        elif content.get('room_uid'):
+            try:
+                room_uid = uuid.UUID(str(content['room_uid']))
+            except ValueError:
+                room_uid = None
+        elif self.room:
+            room_uid = self.room.uid
+        else:
+            room_uid = await self._get_game_room_uid()
+        members = None
+        if room_uid is not None:
+            members = (room_members.peek(room_uid)
+                       or await database_sync_to_async(room_members.load)(room_uid))
+        if members is None or self.profile is None:
+            return None, {'type': 'error',
+                          'message': 'An unexpected error occured'}
+        if action == 'chat-message':
+            self.room = members.room
+        if self.profile.id not in members.participant_ids:
+            return None, {'type': 'error',
+                          'message': 'Not a chat member'}
+        return members.room, None
+
+    async def _get_direct_room_uid(self,
+                                   content: dict) -> tuple[uuid.UUID | None, dict | None]:
+        """Return the DM room shared with the targeted friend, creating it once."""
+        if not self.user or not self.user.is_authenticated:
+            return None, {'type': 'error',
+                          'message': 'Authentication failed'}
+        # Friends were resolved at handshake: only unknown targets hit the DB.
+        user_uid = str(content.get('user_uid'))
+        target = self.scope.get('friends', {}).get(user_uid)
+        if target is None:
+            target_exists = await database_sync_to_async(
+                SiteUser.objects.filter(uid=content['user_uid']).exists)()
+            if not target_exists:
+                return None, {'type': 'error',
+                              'message': 'User not found'}
+            return None, {'type': 'error',
+                          'message': 'Target is not a friend'}
+        if user_uid not in self.direct_rooms:
+            self.direct_rooms[user_uid] = await self._get_or_create_direct_room(target)
+        return self.direct_rooms[user_uid], None
+
     @database_sync_to_async
-    def _save_message(self, body: str,
-                      action: str,
-                      content: dict) -> tuple[bool, Message | dict]:
+    def _get_or_create_direct_room(self, target: dict) -> uuid.UUID:
+        """Fetch or create the DM room between this profile and target."""
+        id_a, id_b = self.profile.uid, target['uid']
+        min_uid, max_uid = (id_a, id_b) if id_a < id_b else (id_b, id_a)
+        room, created = Room.objects.get_or_create(
+            name=f'user_{min_uid}_user_{max_uid}')
+        if created:
+            room.participants.add(self.profile.id, target['id'])
+        return room.uid
+
+    @database_sync_to_async
+    def _get_game_room_uid(self) -> uuid.UUID | None:
+        """Return the room of the game this profile is currently playing, if any."""
+        game = Game.objects.filter(is_over=False,
+                                   players=self.profile).select_related('room').first()
+        if game and game.room:
+            return game.room.uid
+        return None
+
+    async def _save_message(self, body: str, room: Room) -> Message:
+        """Persist a message, or queue it for write-behind when enabled.
+
+        In write-behind mode the returned message is not saved yet: its uid
+        and created date are set here so it can be broadcast right away,
+        but it has no id until the writer flushes it.
+        """
+        if message_writer.enabled:
+            message = Message(sender_profile=self.profile, room=room, body=body,
+                              created=timezone.now())
+            await message_writer.enqueue(message)
+            return message
+        return await self._create_message(body, room)
+
+    @database_sync_to_async
+    def _create_message(self, body: str, room: Room) -> Message:
         """Persist a message for the profile (user) in the resolved room."""
-        room = None
-        if action == 'direct-message':
-            if not self.user or not self.user.is_authenticated:
-                return False, {'type': 'error',
-                               'message': 'Authentication failed'}
-            target_user = SiteUser.objects.filter(uid=content['user_uid']).first()
-            if target_user is None:
-                return False, {'type': 'error',
-                               'message': 'User not found'}
-            if not (Friendship.objects.filter(from_user__in=[target_user, self.user],
-                                              to_user__in=[self.user, target_user],
-                                              status='accepted'
-                                              ).exists()):
-                return False, {'type': 'error',
-                               'message': 'Target is not a friend'}
-            target_profile = target_user.profile
-            id_a, id_b = self.profile.uid, target_profile.uid
-            min_uid, max_uid = (id_a, id_b) if id_a < id_b else (id_b, id_a)
-            room, created = Room.objects.get_or_create(
-                name=f'user_{min_uid}_user_{max_uid}')
-            if created:
-                room.participants.add(self.profile)
-                room.participants.add(target_profile)
-        elif action == 'chat-message':
-            if content.get('room_uid'):
-                room = Room.objects.filter(uid=content['room_uid']).first()
-                self.room = room
-            elif self.room:
-                room = self.room
-            else:
-                game = Game.objects.filter(
-                    is_over=False,
-                    players=self.profile).first().room
-                if game and self.profile.game:
-                    self.room = game.room
-                    room = self.room
-        if room is None or self.profile is None:
-            return False, {'type': 'error',
-                           'message': 'An unexpected error occured'}
-        if not room.participants.filter(uid=self.profile.uid).exists():
-            return False, {'type': 'error',
-                           'message': 'Not a chat member'}
-        message = Message.objects.create(
+        return Message.objects.create(
             sender_profile=self.profile,
             room=room,
             body=body,
         )
-        return True, message
 
     @database_sync_to_async
-    def _mark_delivered(self, message_id: str) -> bool:
-        """Mark a room message as delivered if it exists."""
-        message = Message.objects.filter(id=message_id).first()
+    def _mark_range(self, room: Room, up_to: uuid.UUID, action: str) -> tuple | None:
+        """Flag the room's messages from others up to a message as delivered/seen.
+
+        Returns:
+            (creation time of ``up_to``, profile ids of the senders whose
+            messages changed), or None if ``up_to`` is not a message of the
+            room (e.g. still queued by the write-behind writer)
+        """
+        cutoff = Message.objects.filter(uid=up_to, room=room).values_list(
+            'created', flat=True).first()
+        if cutoff is None:
+            return None
+        pending = Message.objects.filter(room=room, created__lte=cutoff).exclude(
+            sender_profile=self.profile)
+        if action == 'delivered':
+            pending = pending.filter(delivered=False)
+            changes = {'delivered': True}
+        else:
+            pending = pending.filter(seen=False)
+            changes = {'delivered': True, 'seen': True}
+        sender_ids = list(pending.order_by().values_list(
+            'sender_profile_id', flat=True).distinct())
+        if sender_ids:
+            pending.update(**changes)
+        return cutoff, sender_ids
+
+    @database_sync_to_async
+    def _advance_read_cursor(self, room: Room, cutoff: datetime) -> int:
+        """Move this profile's read cursor of a room forward to a creation time.
+
+        Returns:
+            Number of messages from others still unread after the cursor
+        """
+        cursor, created = ReadCursor.objects.get_or_create(
+            profile=self.profile, room=room, defaults={'last_read': cutoff})
+        if not created and cursor.last_read < cutoff:
+            cursor.last_read = cutoff
+            cursor.save(update_fields=['last_read', 'updated'])
+        return Message.objects.filter(room=room, created__gt=cursor.last_read).exclude(
+            sender_profile=self.profile).count()
+
+    @database_sync_to_async
+    def _mark_delivered(self, message_uid: uuid.UUID) -> bool:
+        """Mark a message of one of this profile's rooms as delivered if it exists."""
+        message = Message.objects.filter(uid=message_uid,
+                                         room__participants=self.profile).first()
         if not message:
             return False
         if not message.delivered:
@@ -270,8 +609,9 @@ class GlobalConsumer(AsyncJsonWebsocketConsumer):
 
     @database_sync_to_async
     def _mark_seen(self, message_uid: uuid.UUID) -> bool:
-        """Mark a room message as seen and delivered if it exists."""
-        message = Message.objects.filter(uid=message_uid, room=self.room).first()
+        """Mark a message of one of this profile's rooms as seen and delivered if it exists."""
+        message = Message.objects.filter(uid=message_uid,
+                                         room__participants=self.profile).first()
         if not message:
             return False
         changed = False
@@ -0,0 +1,29 @@
+"""ASGI lifespan handling: graceful shutdown hooks of a worker."""
+
+from chat.persistence import message_writer
+from game.engine import game_engine
+
+from .redis_utils import RedisManager
+
+
+class LifespanApp:
+    """Answer lifespan events and run the shutdown hooks of the worker.
+
+    Only servers that implement the lifespan protocol (e.g. uvicorn) send
+    these events; under daphne the atexit hooks of each module apply.
+    """
+
+    async def __call__(self, scope: dict, receive: callable, send: callable) -> None:
+        """Acknowledge startup, then drain pending work on shutdown."""
+        while True:
+            message = await receive()
+            if message['type'] == 'lifespan.startup':
+                await send({'type': 'lifespan.startup.complete'})
+            elif message['type'] == 'lifespan.shutdown':
+                # End live games (saving their rounds) and write queued chat
+                # messages before the Redis pool goes away.
+                await game_engine.shutdown()
+                await message_writer.drain()
+                await RedisManager.close_connection()
+                await send({'type': 'lifespan.shutdown.complete'})
+                return
@@ -0,0 +1,49 @@
+"""Per-worker counters and gauges, exported by the /api/metrics/ view.
+
+Every ASGI worker keeps its own figures: with several workers, scrape each
+one (or sum what they report).
+"""
+
+import os
+import weakref
+from collections import Counter
+
+from django.http import HttpRequest, JsonResponse
+
+from .redis_utils import RedisManager
+
+counters: Counter = Counter()
+# Outbound queues of the sockets currently open on this worker.
+outbound_queues: weakref.WeakSet = weakref.WeakSet()
+
+
+def incr(name: str, value: int = 1) -> None:
+    """Increase a counter of this worker."""
+    counters[name] += value
+
+
+def snapshot() -> dict:
+    """Return every metric of this worker."""
+    depths = [len(queue) for queue in list(outbound_queues)]
+    return {
+        'pid': os.getpid(),
+        'counters': dict(counters),
+        'outbound': {
+            'sockets': len(depths),
+            'depth_total': sum(depths),
+            'depth_max': max(depths, default=0),
+        },
+        'redis_pool': RedisManager.pool_stats(),
+    }
+
+
+async def metrics_view(request: HttpRequest) -> JsonResponse:
+    """Expose the worker's metrics to staff users.
+
+    Async so that it runs on the worker's event loop, where the Redis pool
+    and the socket queues live.
+    """
+    user = await request.auser()
+    if not user.is_staff:
+        return JsonResponse({'error': {'auth': 'FORBIDDEN'}}, status=403)
+    return JsonResponse(snapshot())
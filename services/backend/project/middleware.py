@@ -2,7 +2,11 @@
 
 import uuid
 
+from channels.db import database_sync_to_async
+from channels.middleware import BaseMiddleware
 from django.http import HttpRequest, HttpResponse
+from friends.models import Friendship
+from userauth.models import SiteUser
 from userprofile.models import Profile
 
 
@@ -31,3 +35,46 @@ class ProfileMiddleware:
             request.session['guest_profile_uid'] = str(request.profile.uid)
             request.session.modified = True
         return self.get_response(request)
+
+
+class WebsocketProfileMiddleware(BaseMiddleware):
+    """Resolve the socket identity once, at handshake.
+
+    Adds to the scope, for the whole socket lifetime:
+        profile:    the connecting Profile (None if it cannot be resolved)
+        friends:    str(user uid) -> {'id', 'uid'} of the accepted friends'
+                    profiles (see Friendship.friend_map)
+        friend_ids: set of the accepted friends' profile ids
+    Consumers refresh the friend entries when a friends.invalidate event is
+    pushed on their presence group (see friends.signals).
+    Must run inside AuthMiddlewareStack, which provides user and session.
+    """
+
+    async def __call__(self, scope: dict, receive: callable, send: callable) -> None:
+        """Attach the resolved identity to a copy of the scope."""
+        scope = dict(scope)
+        scope.update(await self.resolve_identity(scope))
+        return await self.inner(scope, receive, send)
+
+    @staticmethod
+    @database_sync_to_async
+    def resolve_identity(scope: dict) -> dict:
+        """Look up profile and friends with the same priority as the HTTP middleware."""
+        user = scope.get('user')
+        if not (isinstance(user, SiteUser) and user.is_authenticated):
+            user = None
+        profile = None
+        if user is not None:
+            profile = Profile.objects.filter(user=user).first()
+        elif isinstance(scope.get('profile'), Profile):
+            profile = scope['profile']
+        else:
+            guest_uid = scope.get('session', {}).get('guest_profile_uid')
+            if guest_uid:
+                profile = Profile.objects.filter(uid=guest_uid, is_guest=True).first()
+        friends = Friendship.friend_map(user)
+        return {
+            'profile': profile,
+            'friends': friends,
+            'friend_ids': {friend['id'] for friend in friends.values()},
+        }
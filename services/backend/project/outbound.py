@@ -0,0 +1,164 @@
+"""Bounded per-connection outbound queues for WebSocket consumers.
+
+Handlers no longer write to the socket themselves: frames are queued and a
+writer task per connection sends them. A slow client therefore only grows
+its own queue instead of stalling the consumer, which keeps draining the
+channel layer (whose per-channel buffer would otherwise fill up and drop
+messages silently).
+
+When a queue is full, WS_OUTBOUND['POLICY'] decides:
+- ``drop_oldest``: drop the oldest droppable frame (presence events);
+- ``coalesce``: first replace a queued frame carrying the same key (status
+  updates of a room), then behave like drop_oldest;
+- ``disconnect``: close the socket.
+A full queue with nothing droppable always closes the socket (code 4408):
+chat messages are never dropped silently, the client resyncs on reconnect.
+A closing frame is written after the frames queued before it.
+"""
+
+import asyncio
+from collections import deque
+
+from django.conf import settings
+
+from . import metrics, wire
+
+SLOW_CONSUMER_CLOSE_CODE = 4408
+# Seconds a closing frame waits for the queued frames to be written
+CLOSE_FLUSH_TIMEOUT = 5
+
+
+class OutboundQueue:
+    """Frames waiting to be written to one socket."""
+
+    def __init__(self, maxsize: int, policy: str) -> None:
+        """Create an empty queue holding at most maxsize frames."""
+        self.maxsize = maxsize
+        self.policy = policy
+        # Entries are [droppable, key, frame]; lists so coalescing can swap frames.
+        self._frames = deque()
+        self._ready = asyncio.Event()
+        self._finishing = False
+        metrics.outbound_queues.add(self)
+
+    def __len__(self) -> int:
+        """Return the number of queued frames."""
+        return len(self._frames)
+
+    def push(self, frame: dict, droppable: bool = False, key: object = None) -> bool:
+        """Queue a frame, applying the overflow policy.
+
+        Returns:
+            False if the frame could not be queued and the socket must be closed
+        """
+        if key is not None and self.policy == 'coalesce':
+            for entry in self._frames:
+                if entry[1] == key:
+                    entry[2] = frame
+                    metrics.incr('ws.outbound.coalesced')
+                    return True
+        if len(self._frames) >= self.maxsize and (
+                self.policy == 'disconnect' or not self._drop_oldest()):
+            metrics.incr('ws.outbound.overflow_disconnects')
+            return False
+        self._frames.append([droppable, key, frame])
+        self._ready.set()
+        return True
+
+    async def pop(self) -> dict | None:
+        """Wait for and return the oldest frame.
+
+        Returns:
+            None once the queue is empty after finish() was called
+        """
+        while not self._frames:
+            if self._finishing:
+                return None
+            self._ready.clear()
+            await self._ready.wait()
+        return self._frames.popleft()[2]
+
+    def finish(self) -> None:
+        """Let pop() return None once the queued frames are out."""
+        self._finishing = True
+        self._ready.set()
+
+    def _drop_oldest(self) -> bool:
+        """Remove the oldest droppable frame, if any."""
+        for index, entry in enumerate(self._frames):
+            if entry[0]:
+                del self._frames[index]
+                metrics.incr('ws.outbound.dropped')
+                return True
+        return False
+
+
+class OutboundMixin:
+    """Route every ``send_json`` of a JSON consumer through an OutboundQueue.
+
+    Must come before AsyncJsonWebsocketConsumer in the bases.
+    """
+
+    async def send_json(self, content: dict, close: bool = False) -> None:
+        """Queue a frame that must not be dropped (chat messages, replies).
+
+        A closing frame is written once the frames queued before it are out
+        (for at most CLOSE_FLUSH_TIMEOUT seconds), then closes the socket.
+        """
+        if close:
+            await self._flush_outbound()
+            await super().send_json(content, close=True)
+            return
+        await self.queue_json(content)
+
+    async def queue_json(self, content: dict | str | bytes, droppable: bool = False,
+                         key: object = None) -> None:
+        """Queue a frame; droppable frames and keyed frames may be shed under load."""
+        if getattr(self, 'outbound', None) is None:
+            conf = settings.WS_OUTBOUND
+            self.outbound = OutboundQueue(conf['MAX_FRAMES'], conf['POLICY'])
+            self.outbound_task = asyncio.create_task(self._write_outbound())
+        elif self.outbound_task.done():
+            # Closed as a slow consumer: nothing more will be written.
+            return
+        if not self.outbound.push(content, droppable, key):
+            self.outbound_task.cancel()
+            await self.close(code=SLOW_CONSUMER_CLOSE_CODE)
+
+    async def _flush_outbound(self) -> None:
+        """Let the writer send the queued frames, then stop it."""
+        if getattr(self, 'outbound', None) is None or self.outbound_task.done():
+            return
+        self.outbound.finish()
+        done, _ = await asyncio.wait({self.outbound_task}, timeout=CLOSE_FLUSH_TIMEOUT)
+        if not done:
+            metrics.incr('ws.outbound.close_flush_timeouts')
+            self.outbound_task.cancel()
+
+    async def _write_outbound(self) -> None:
+        """Send queued frames in order; waits on the socket, not on the handlers.
+
+        Frames are encoded for the connection's wire format (see WireMixin);
+        str and bytes frames were already encoded for it and are written
+        verbatim. Returns once the queue is finished and empty.
+        """
+        while True:
+            frame = await self.outbound.pop()
+            if frame is None:
+                return
+            if isinstance(frame, str):
+                await self.send(text_data=frame)
+            elif isinstance(frame, bytes):
+                await self.send(bytes_data=frame)
+            elif getattr(self, 'wire', 'json') == 'msgpack':
+                await self.send(bytes_data=wire.encode(frame))
+            else:
+                await super().send_json(frame)
+
+    async def websocket_disconnect(self, message: dict) -> None:
+        """Stop the writer when the socket goes away."""
+        try:
+            await super().websocket_disconnect(message)
+        finally:
+            if getattr(self, 'outbound', None) is not None:
+                self.outbound_task.cancel()
@@ -1,131 +1,191 @@
 """WebSocket consumer logic for user presence (online/offline)."""
 
+import asyncio
+
 from channels.db import database_sync_to_async
 from channels.generic.websocket import AsyncJsonWebsocketConsumer
+from django.conf import settings
 
-from userauth.models import SiteUser
+from friends.models import Friendship
 from userprofile.models import Profile
 
+from .outbound import OutboundMixin
+from .ratelimit import RateLimitMixin
 from .redis_utils import RedisManager
+from .wire import WireMixin
 
 
-class PresenceConsumer(AsyncJsonWebsocketConsumer):
-    """Track user online/offline state and broadcast status changes.
+class PresenceMixin(OutboundMixin):
+    """Presence behaviour shared by every consumer that tracks a profile.
 
     Flow summary:
-    - connect: identify profile, join presence group, mark online, broadcast online
-    - receive_json: refresh TTL on ping
-    - disconnect: mark offline and broadcast offline
+    - join_presence: join own presence group, mark online, notify friends
+    - presence_subroutine: refresh TTL on ping, answer status subscriptions
+    - user_status: buffer friends' status changes, flushed as one
+      presence_batch frame per PRESENCE_BATCH_WINDOW
+    - leave_presence: mark offline and notify friends
+    - friends_invalidate: reload the friend set after a friendship change
+
+    Frames go through the connection's outbound queue; presence batches are
+    the first frames shed when a client falls behind. The consumer must set
+    ``self.profile`` before calling join_presence.
     """
 
-    async def connect(self) -> None:
-        """Authenticate socket context and announce the user as online."""
-        # Resolve who is connecting from scope (user/profile/session).
-        self.profile = await self._get_profile_from_scope()
-        if not self.profile:
-            # 4401: unauthorized websocket connection.
-            await self.close(code=4401)
-            return
-
-        # All presence clients listen to one group for status updates.
-        self.presence_group_name = "presence_updates"
+    async def join_presence(self) -> None:
+        """Register this socket for presence and announce the user as online."""
+        # Each user listens on its own group; status changes are only pushed
+        # to the groups of accepted friends instead of to every socket.
+        self.presence_group_name = f"presence_{self.profile.id}"
         await self.channel_layer.group_add(self.presence_group_name, self.channel_name)
+        self.friend_ids = self.scope.get("friend_ids", set())
+        self.pending_statuses = {}
+        self.flush_task = None
 
-        # Persist current online state in Redis with TTL.
+        # Persist current online state in Redis with TTL, and make sure this
+        # worker purges heartbeats that expire without a clean disconnect.
         await self.mark_user_online()
+        RedisManager.start_presence_sweeper()
 
-        # Accept only after identity and presence state are ready.
-        await self.accept()
-
-        # Notify all connected clients that this user is now online.
-        await self.channel_layer.group_send(
+    async def leave_presence(self) -> None:
+        """Announce the user as offline and drop this socket's presence state."""
+        if getattr(self, "presence_group_name", None) is None:
+            return
+        await self.mark_user_offline()
+        await self.broadcast_status("offline")
+        if self.flush_task:
+            self.flush_task.cancel()
+        await self.channel_layer.group_discard(
             self.presence_group_name,
-            {
-                "type": "user_status",
-                "username": self.profile.username,
-                "status": "online",
-                "user_id": self.profile.id,
-            },
+            self.channel_name,
         )
 
-    async def disconnect(self, close_code) -> None:
-        """Cleanup connection state and announce user as offline."""
-        # If profile exists, remove presence key then broadcast offline event.
-        if getattr(self, "profile", None):
-            await self.mark_user_offline()
-            await self.channel_layer.group_send(
-                self.presence_group_name,
-                {
-                    "type": "user_status",
-                    "username": self.profile.username,
-                    "status": "offline",
-                    "user_id": self.profile.id,
-                },
-            )
-
-        # Always remove this socket from presence broadcast group.
-        if getattr(self, "presence_group_name", None):
-            await self.channel_layer.group_discard(
-                self.presence_group_name,
-                self.channel_name,
-            )
-
-    async def receive_json(self, content) -> None:
-        """Handle client messages. Currently supports heartbeat ping only.Maybe will change it later"""
+    async def presence_subroutine(self, content: dict) -> None:
+        """Handle presence actions: heartbeat ping and status subscription."""
         action = content.get("action")
         if action == "ping":
             # Refresh TTL so the user stays online while socket is active.
             await self.mark_user_online()
             await self.send_json({"type": "pong"})
             return
+        if action == "subscribe":
+            # Snapshot of the requested friends (all of them by default);
+            # later changes arrive as presence_batch frames. Other users'
+            # presence is not disclosed.
+            user_ids = content.get("user_ids") or list(self.friend_ids)
+            try:
+                if (not isinstance(user_ids, list)
+                        or len(user_ids) > settings.PRESENCE_SUBSCRIBE_MAX_IDS):
+                    raise ValueError(user_ids)
+                user_ids = [int(user_id) for user_id in user_ids]
+            except (TypeError, ValueError):
+                await self.send_json({"type": "error", "message": "invalid_user_ids"})
+                return
+            user_ids = [user_id for user_id in dict.fromkeys(user_ids)
+                        if user_id in self.friend_ids]
+            presence = await RedisManager.are_users_online(user_ids)
+            await self.send_json({
+                "type": "presence_snapshot",
+                "statuses": [
+                    {"user_id": user_id, "status": "online" if online else "offline"}
+                    for user_id, online in presence.items()
+                ],
+            })
+            return
 
         # Explicit error response helps frontend debugging.
         await self.send_json({"type": "error", "message": "unsupported_action"})
 
-    async def user_status(self, event) -> None:
-        """Forward channel-layer presence events to this websocket client."""
-        await self.send_json(
-            {
-                "type": "user_status",
-                "username": event["username"],
-                "status": event["status"],
-                "user_id": event["user_id"],
-            }
-        )
-
-    @database_sync_to_async
-    def _get_profile_from_scope(self) -> Profile | None:
-        """Resolve profile from socket scope.
-
-        Priority:
-        1) Authenticated SiteUser.profile
-        2) Middleware-injected Profile in scope
-        3) guest_profile_id from session
+    async def broadcast_status(self, status: str) -> None:
+        """Send this user's status to the presence group of each friend."""
+        event = {
+            "type": "user_status",
+            "username": self.profile.username,
+            "status": status,
+            "user_id": self.profile.id,
+        }
+        await asyncio.gather(*(
+            self.channel_layer.group_send(f"presence_{friend_id}", event)
+            for friend_id in self.friend_ids
+        ))
+
+    async def user_status(self, event: dict) -> None:
+        """Buffer a friend's status change until the next batch flush.
+
+        Only the latest status per user is kept, so a reconnect storm
+        collapses into a single entry per friend and window.
         """
-        user = self.scope.get("user")
-        if user and isinstance(user, SiteUser) and user.is_authenticated:
-            try:
-                return user.profile
-            except Profile.DoesNotExist:
-                return None
-
-        # Optional profile attached by middleware.
-        profile = self.scope.get("profile")
-        if isinstance(profile, Profile):
-            return profile
+        self.pending_statuses[event["user_id"]] = {
+            "username": event["username"],
+            "status": event["status"],
+            "user_id": event["user_id"],
+        }
+        if self.flush_task is None:
+            self.flush_task = asyncio.create_task(self._flush_statuses())
+
+    async def _flush_statuses(self) -> None:
+        """Forward buffered status changes as one presence_batch frame."""
+        await asyncio.sleep(settings.PRESENCE_BATCH_WINDOW)
+        updates = list(self.pending_statuses.values())
+        self.pending_statuses = {}
+        self.flush_task = None
+        await self.queue_json({"type": "presence_batch", "updates": updates},
+                              droppable=True)
+
+    async def friends_invalidate(self, event: dict) -> None:
+        """Reload the friend entries cached in the scope after a friendship change."""
+        friends = await self._get_friends()
+        self.scope["friends"] = friends
+        self.scope["friend_ids"] = self.friend_ids = {
+            friend["id"] for friend in friends.values()}
 
-        # Guest fallback from session key.
-        session = self.scope.get("session", {})
-        guest_uid = session.get("guest_profile_uid")
-        if guest_uid:
-            return Profile.objects.filter(uid=guest_uid, is_guest=True).first()
-
-        return None
+    @database_sync_to_async
+    def _get_friends(self) -> dict:
+        """Load the accepted friends of this profile (guests have none)."""
+        return Friendship.friend_map(self.profile.user)
 
     async def mark_user_online(self) -> None:
         """Store online marker in Redis with short TTL for auto-expiry."""
-        await RedisManager.set_user_online(self.profile.id, ttl=60)
+        await RedisManager.set_user_online(self.profile.id, ttl=settings.PRESENCE_TTL)
 
     async def mark_user_offline(self) -> None:
         """Remove online marker in Redis when connection ends."""
         await RedisManager.set_user_offline(self.profile.id)
+
+
+class PresenceConsumer(RateLimitMixin, WireMixin, PresenceMixin,
+                       AsyncJsonWebsocketConsumer):
+    """Standalone presence socket (ws/presence/).
+
+    Kept for clients that have not moved to the ``presence`` module of
+    ws/global/, which carries the same protocol over the shared connection.
+    """
+
+    async def connect(self) -> None:
+        """Authenticate socket context and announce the user as online."""
+        # Resolve who is connecting from scope (user/profile/session).
+        self.profile = await self._get_profile_from_scope()
+        if not self.profile:
+            # 4401: unauthorized websocket connection.
+            await self.close(code=4401)
+            return
+
+        await self.join_presence()
+
+        # Accept only after identity and presence state are ready.
+        await self.accept_wire()
+
+        # Notify friends that this user is now online.
+        await self.broadcast_status("online")
+
+    async def disconnect(self, close_code) -> None:
+        """Cleanup connection state and announce user as offline."""
+        await self.leave_presence()
+
+    async def receive_json(self, content) -> None:
+        """Handle client messages with the presence protocol."""
+        if await self.check_rate_limit("presence", content.get("action")):
+            await self.presence_subroutine(content)
+
+    async def _get_profile_from_scope(self) -> Profile | None:
+        """Return the profile resolved at handshake by WebsocketProfileMiddleware."""
+        return self.scope.get("profile")
@@ -0,0 +1,114 @@
+"""Token-bucket flood control for WebSocket frames.
+
+Each frame is charged to two buckets of its category (WS_RATE_LIMITS):
+one per connection, always in memory, and one per profile, shared by all
+the profile's sockets either in the worker's memory or, with the ``redis``
+backend, across every worker.
+"""
+
+import time
+from collections import OrderedDict
+
+from django.conf import settings
+
+from . import metrics
+from .redis_utils import RedisManager
+
+# Frame (module, action) -> rate-limit category; anything else counts as 'message'.
+CATEGORIES = {
+    ('chat', 'join'): 'read',
+    ('chat', 'delivered'): 'read',
+    ('chat', 'read'): 'read',
+    ('game', 'guess'): 'guess',
+    ('game', 'pong'): 'read',
+    ('presence', 'ping'): 'presence',
+    ('presence', 'subscribe'): 'presence',
+}
+
+# Per-profile buckets of this worker (memory backend), least recently used first.
+MAX_PROFILE_BUCKETS = 10000
+
+
+class TokenBucket:
+    """Allow ``rate`` frames per second on average, with bursts up to ``capacity``."""
+
+    __slots__ = ('rate', 'capacity', 'tokens', 'updated')
+
+    def __init__(self, rate: float, capacity: float) -> None:
+        """Create a full bucket."""
+        self.rate = rate
+        self.capacity = capacity
+        self.tokens = capacity
+        self.updated = time.monotonic()
+
+    def take(self, cost: float = 1) -> float:
+        """Spend tokens for one frame.
+
+        Returns:
+            0 if the frame is allowed, else the seconds until it would be
+        """
+        now = time.monotonic()
+        self.tokens = min(self.capacity, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+        if self.tokens >= cost:
+            self.tokens -= cost
+            return 0
+        return (cost - self.tokens) / self.rate
+
+
+_profile_buckets: OrderedDict = OrderedDict()
+
+
+def _take_profile_token(profile_id: int, category: str, rate: float,
+                        capacity: float) -> float:
+    """Charge the in-memory bucket of a profile (memory backend)."""
+    key = (profile_id, category)
+    bucket = _profile_buckets.get(key)
+    if bucket is None:
+        bucket = _profile_buckets[key] = TokenBucket(rate, capacity)
+        if len(_profile_buckets) > MAX_PROFILE_BUCKETS:
+            _profile_buckets.popitem(last=False)
+    _profile_buckets.move_to_end(key)
+    return bucket.take()
+
+
+class RateLimitMixin:
+    """Reject frames that exceed the connection's or the profile's budget.
+
+    The consumer must set ``self.profile`` before receiving frames.
+    """
+
+    async def check_rate_limit(self, module: str, action: str) -> bool:
+        """Charge a frame to its buckets.
+
+        Returns:
+            True if the frame may be processed; otherwise a ``rate_limited``
+            error has already been sent to the client
+        """
+        category = CATEGORIES.get((module, action), 'message')
+        rate, capacity = settings.WS_RATE_LIMITS['RULES'][category]
+
+        buckets = self.__dict__.setdefault('rate_buckets', {})
+        bucket = buckets.get(category)
+        if bucket is None:
+            bucket = buckets[category] = TokenBucket(rate, capacity)
+        retry_after, scope = bucket.take(), 'connection'
+        if not retry_after:
+            if settings.WS_RATE_LIMITS['BACKEND'] == 'redis':
+                retry_after = await RedisManager.take_token(
+                    f"ratelimit:{self.profile.id}:{category}", rate, capacity)
+            else:
+                retry_after = _take_profile_token(self.profile.id, category, rate, capacity)
+            scope = 'profile'
+        if not retry_after:
+            return True
+
+        metrics.incr(f'ws.rate_limited.{category}')
+        await self.send_json({
+            'type': 'error',
+            'message': 'rate_limited',
+            'scope': scope,
+            'action': action,
+            'retry_after': round(retry_after, 3),
+        })
+        return False
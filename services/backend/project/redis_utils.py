@@ -1,134 +1,1101 @@
 """Redis utility functions for presence tracking and caching."""
 
-import redis.asyncio as redis_async
+import asyncio
+import json
+import time
+import weakref
 from typing import Optional
 
+import redis as redis_sync
+import redis.asyncio as redis_async
+from django.conf import settings
+from redis.asyncio.retry import Retry as AsyncRetry
+from redis.backoff import ExponentialBackoff
+from redis.exceptions import ConnectionError as RedisConnectionError
+from redis.exceptions import TimeoutError as RedisTimeoutError
+from redis.retry import Retry
+
+# Pop every member whose deadline (score) is in the past, in one atomic step,
+# so a heartbeat landing between the read and the removal is never lost.
+_SWEEP_SCRIPT = """
+local expired = redis.call('ZRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+if #expired > 0 then
+    redis.call('ZREMRANGEBYSCORE', KEYS[1], '-inf', ARGV[1])
+end
+return expired
+"""
+
+# Token bucket shared by every worker: refill from the elapsed Redis time,
+# then spend one token. Returns {allowed, seconds to wait as a string}.
+_TOKEN_BUCKET_SCRIPT = """
+local rate = tonumber(ARGV[1])
+local capacity = tonumber(ARGV[2])
+local clock = redis.call('TIME')
+local now = tonumber(clock[1]) + tonumber(clock[2]) / 1000000
+local state = redis.call('HMGET', KEYS[1], 'tokens', 'updated')
+local tokens = tonumber(state[1]) or capacity
+local updated = tonumber(state[2]) or now
+tokens = math.min(capacity, tokens + math.max(0, now - updated) * rate)
+local allowed = 0
+local retry_after = 0
+if tokens >= 1 then
+    tokens = tokens - 1
+    allowed = 1
+else
+    retry_after = (1 - tokens) / rate
+end
+redis.call('HSET', KEYS[1], 'tokens', tostring(tokens), 'updated', tostring(now))
+redis.call('EXPIRE', KEYS[1], math.ceil(capacity / rate) + 1)
+return {allowed, tostring(retry_after)}
+"""
+
+# Start the cold fill of a room's ring buffer: until the fill, messages
+# pushed to the room are kept in the fill list (after a '' placeholder that
+# makes it exist). KEYS: buffer, fill list. ARGV: fill TTL. Returns 0 if the
+# buffer exists.
+_BEGIN_RECENT_FILL_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+if redis.call('EXISTS', KEYS[2]) == 0 then
+    redis.call('RPUSH', KEYS[2], '')
+end
+redis.call('EXPIRE', KEYS[2], ARGV[1])
+return 1
+"""
+
+# Push a message to a room's ring buffer, or to its fill list while it is
+# being filled; a cold room is left cold. KEYS: buffer, fill list. ARGV:
+# size, TTL, entry.
+_PUSH_RECENT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    redis.call('LPUSH', KEYS[1], ARGV[3])
+    redis.call('LTRIM', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+    redis.call('EXPIRE', KEYS[1], ARGV[2])
+    return 1
+end
+if redis.call('EXISTS', KEYS[2]) == 1 then
+    redis.call('RPUSH', KEYS[2], ARGV[3])
+    return 1
+end
+return 0
+"""
+
+# Fill a room's ring buffer from the DB only if no other writer created it
+# meanwhile, adding the messages pushed since the fill began that the DB
+# snapshot lacks. KEYS: buffer, fill list. ARGV: size, TTL, entries newest
+# first. Returns 1 if the buffer was written.
+_FILL_RECENT_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 1 then
+    return 0
+end
+local known = {}
+for i = 3, #ARGV do
+    local ok, entry = pcall(cjson.decode, ARGV[i])
+    if ok and type(entry) == 'table' and entry['uid'] then
+        known[entry['uid']] = true
+    end
+end
+local pushed = redis.call('LRANGE', KEYS[2], 1, -1)
+redis.call('DEL', KEYS[2])
+for _, raw in ipairs(pushed) do
+    local ok, entry = pcall(cjson.decode, raw)
+    if not (ok and type(entry) == 'table' and known[entry['uid']]) then
+        redis.call('LPUSH', KEYS[1], raw)
+    end
+end
+if #ARGV > 2 then
+    redis.call('RPUSH', KEYS[1], unpack(ARGV, 3))
+end
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+redis.call('LTRIM', KEYS[1], 0, tonumber(ARGV[1]) - 1)
+redis.call('EXPIRE', KEYS[1], ARGV[2])
+return 1
+"""
+
+# Set or increment (ARGV[1]: 'set' or 'incr') a field of a hash that
+# already exists, and renew its TTL. KEYS: hash. ARGV: operation, field,
+# value, TTL in seconds. A missing hash is left missing, so that it is
+# rebuilt whole instead of partially.
+_UPDATE_IF_EXISTS_SCRIPT = """
+if redis.call('EXISTS', KEYS[1]) == 0 then
+    return 0
+end
+if ARGV[1] == 'incr' then
+    redis.call('HINCRBY', KEYS[1], ARGV[2], ARGV[3])
+else
+    redis.call('HSET', KEYS[1], ARGV[2], ARGV[3])
+end
+redis.call('EXPIRE', KEYS[1], ARGV[4])
+return 1
+"""
+
+# Take a lobby out of a playlist's matchmaking queue, atomically so that
+# workers matching the same queue never share a player. KEYS: skill zset,
+# waiting zset, queued hash, playlists set. ARGV: anchor profile id, skill
+# range, min and max players. Returns the players' JSON entries, or nothing
+# if fewer than min players are in range.
+_MATCHMAKING_POP_SCRIPT = """
+local ids = redis.call('ZRANGEBYSCORE', KEYS[1], ARGV[2], ARGV[3], 'LIMIT', 0, tonumber(ARGV[5]))
+if #ids < tonumber(ARGV[4]) then
+    return {}
+end
+local has_anchor = false
+for _, id in ipairs(ids) do
+    if id == ARGV[1] then has_anchor = true end
+end
+if not has_anchor then
+    if not redis.call('ZSCORE', KEYS[1], ARGV[1]) then
+        return {}
+    end
+    ids[#ids] = ARGV[1]
+end
+local entries = redis.call('HMGET', KEYS[3], unpack(ids))
+redis.call('ZREM', KEYS[1], unpack(ids))
+redis.call('ZREM', KEYS[2], unpack(ids))
+redis.call('HDEL', KEYS[3], unpack(ids))
+if redis.call('ZCARD', KEYS[1]) == 0 then
+    redis.call('SREM', KEYS[4], ARGV[6])
+end
+return entries
+"""
+
+# Remove a player from its matchmaking queue. KEYS: queued hash, playlists
+# set, skill and waiting zsets of the playlist the caller read in the
+# player's entry. ARGV: profile id, that playlist. Returns 1 if the player
+# was removed, 0 if it was not queued, -1 if it moved to another playlist
+# since the caller read its entry (read it again and retry).
+_MATCHMAKING_LEAVE_SCRIPT = """
+local entry = redis.call('HGET', KEYS[1], ARGV[1])
+if not entry then
+    return 0
+end
+if cjson.decode(entry)['playlist'] ~= ARGV[2] then
+    return -1
+end
+redis.call('ZREM', KEYS[3], ARGV[1])
+redis.call('ZREM', KEYS[4], ARGV[1])
+redis.call('HDEL', KEYS[1], ARGV[1])
+if redis.call('ZCARD', KEYS[3]) == 0 then
+    redis.call('SREM', KEYS[2], ARGV[2])
+end
+return 1
+"""
+
+# Queue a player, moving it out of the queue it is in. KEYS: queued hash,
+# playlists set, skill and waiting zsets of the current playlist (read in
+# the player's entry; the new ones if none), skill and waiting zsets of the
+# new playlist. ARGV: profile id, current playlist ('' if none), new
+# playlist, skill, join time, entry. Returns 1, or -1 like the leave script.
+_MATCHMAKING_JOIN_SCRIPT = """
+local entry = redis.call('HGET', KEYS[1], ARGV[1])
+local current = ''
+if entry then
+    current = cjson.decode(entry)['playlist']
+end
+if current ~= ARGV[2] then
+    return -1
+end
+if entry then
+    redis.call('ZREM', KEYS[3], ARGV[1])
+    redis.call('ZREM', KEYS[4], ARGV[1])
+    if redis.call('ZCARD', KEYS[3]) == 0 then
+        redis.call('SREM', KEYS[2], current)
+    end
+end
+redis.call('ZADD', KEYS[5], ARGV[4], ARGV[1])
+redis.call('ZADD', KEYS[6], ARGV[5], ARGV[1])
+redis.call('HSET', KEYS[1], ARGV[1], ARGV[6])
+redis.call('SADD', KEYS[2], ARGV[3])
+return 1
+"""
+
 
 class RedisManager:
-    """Manage Redis connections and operations for presence tracking."""
-    
-    REDIS_URL = "redis://localhost"
-    PRESENCE_KEY_PREFIX = "presence:user:"
-    
+    """Manage Redis connections and operations for presence tracking.
+
+    All callers share one connection pool per event loop. ASGI workers run
+    a single loop, so in production this is one long-lived pool per worker;
+    the per-loop bookkeeping only matters for tests and management commands
+    that spin up short-lived loops (asyncio pools cannot cross loops).
+    """
+
+    # Sorted set of online user IDs scored by their heartbeat deadline.
+    PRESENCE_INDEX_KEY = "presence:online"
+    # Capped list of the latest messages of a room, newest first, and the
+    # messages pushed while it is filled from the DB (RECENT_FILL_TTL
+    # seconds at most).
+    RECENT_MESSAGES_KEY = "chat:recent:{room_uid}"
+    RECENT_FILL_KEY = "chat:recent-fill:{room_uid}"
+    RECENT_FILL_TTL = 30
+    # Hash of room uid -> unread message count of a profile, plus the
+    # UNREAD_FILLED field so that a profile without rooms is cached too.
+    UNREAD_KEY = "chat:unread:{profile_id}"
+    UNREAD_FILLED = "_filled"
+    # Channel of the worker holding a live game session.
+    GAME_SESSION_KEY = "game:session:{game_uid}"
+    # Counter bumped whenever playlist contents change (sync_playlists).
+    PLAYLISTS_VERSION_KEY = "music:playlists:version"
+    # Matchmaking queue of a playlist: profile ids scored by exp_points, and
+    # by the time they joined; queued players' entries; non-empty queues.
+    MATCHMAKING_SKILL_KEY = "matchmaking:{playlist}:skill"
+    MATCHMAKING_SINCE_KEY = "matchmaking:{playlist}:since"
+    MATCHMAKING_QUEUED_KEY = "matchmaking:queued"
+    MATCHMAKING_PLAYLISTS_KEY = "matchmaking:playlists"
+    # Tries of a join or leave whose player moves between two playlists meanwhile.
+    MATCHMAKING_ATTEMPTS = 3
+
+    _clients: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, redis_async.Redis]" = (
+        weakref.WeakKeyDictionary()
+    )
+    _sync_client: Optional[redis_sync.Redis] = None
+    _sweepers: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Task]" = (
+        weakref.WeakKeyDictionary()
+    )
+
+    @staticmethod
+    def _pool_kwargs(retry_class: type) -> dict:
+        """Build the pool arguments shared by the async and sync clients."""
+        conf = settings.REDIS_POOL
+        return {
+            'max_connections': conf['MAX_CONNECTIONS'],
+            'timeout': conf['TIMEOUT'],
+            'health_check_interval': conf['HEALTH_CHECK_INTERVAL'],
+            'retry': retry_class(
+                ExponentialBackoff(cap=conf['BACKOFF_CAP'], base=conf['BACKOFF_BASE']),
+                conf['RETRY_ATTEMPTS'],
+            ),
+            'retry_on_error': [RedisConnectionError, RedisTimeoutError],
+            'decode_responses': True,
+        }
+
+    @classmethod
+    def _build_pool(cls) -> redis_async.BlockingConnectionPool:
+        """Create the connection pool from the REDIS_URL / REDIS_POOL settings."""
+        return redis_async.BlockingConnectionPool.from_url(
+            settings.REDIS_URL, **cls._pool_kwargs(AsyncRetry))
+
+    @classmethod
+    def get_sync_connection(cls) -> Optional[redis_sync.Redis]:
+        """Return the process-wide client used from sync code (DRF views).
+
+        The blocking pool is thread-safe, so one instance serves every
+        request thread of the worker.
+        """
+        if cls._sync_client is None:
+            try:
+                cls._sync_client = redis_sync.Redis(
+                    connection_pool=redis_sync.BlockingConnectionPool.from_url(
+                        settings.REDIS_URL, **cls._pool_kwargs(Retry)))
+            except Exception as e:
+                print(f"Failed to connect to Redis: {e}")
+                return None
+        return cls._sync_client
+
     @classmethod
     async def get_connection(cls) -> Optional[redis_async.Redis]:
-        """Get a Redis connection."""
+        """Return the shared Redis client, creating its pool on first use."""
+        loop = asyncio.get_running_loop()
+        client = cls._clients.get(loop)
+        if client is not None:
+            return client
         try:
-            return redis_async.from_url(cls.REDIS_URL, decode_responses=True)
+            client = redis_async.Redis(connection_pool=cls._build_pool())
         except Exception as e:
             print(f"Failed to connect to Redis: {e}")
             return None
-    
+        cls._clients[loop] = client
+        return client
+
+    @classmethod
+    async def close_connection(cls) -> None:
+        """Stop the sweeper and release the current loop's pool (worker shutdown)."""
+        loop = asyncio.get_running_loop()
+        sweeper = cls._sweepers.pop(loop, None)
+        if sweeper is not None:
+            sweeper.cancel()
+        client = cls._clients.pop(loop, None)
+        if client is not None:
+            await client.aclose(close_connection_pool=True)
+
+    @classmethod
+    def pool_stats(cls) -> dict:
+        """Report usage of the current loop's pool.
+
+        Returns:
+            Dict with the pool size limit and the number of created, in-use
+            and idle connections (all zero if no pool exists yet)
+        """
+        stats = {
+            'max_connections': settings.REDIS_POOL['MAX_CONNECTIONS'],
+            'created': 0,
+            'in_use': 0,
+            'idle': 0,
+        }
+        try:
+            client = cls._clients.get(asyncio.get_running_loop())
+        except RuntimeError:
+            client = None
+        if client is None:
+            return stats
+        pool = client.connection_pool
+        stats['idle'] = len(pool._available_connections)
+        stats['in_use'] = len(pool._in_use_connections)
+        stats['created'] = stats['idle'] + stats['in_use']
+        return stats
+
+
     @classmethod
     async def set_user_online(cls, user_id: int, ttl: int = 60) -> bool:
         """
         Mark user as online in Redis with TTL.
-        
+
+        The user is (re)inserted in the presence index with its expiry
+        deadline as score, so refreshing a heartbeat is a single ZADD.
+
         Args:
             user_id: User ID to mark online
             ttl: Time-to-live in seconds (default: 60s)
-        
+
         Returns:
             True if successful, False otherwise
         """
         redis = await cls.get_connection()
         if not redis:
             return False
-        
+
         try:
-            await redis.set(
-                f"{cls.PRESENCE_KEY_PREFIX}{user_id}",
-                "online",
-                ex=ttl
-            )
+            await redis.zadd(cls.PRESENCE_INDEX_KEY, {user_id: time.time() + ttl})
             return True
         except Exception as e:
             print(f"Error setting user online: {e}")
             return False
-        finally:
-            await redis.close()
-    
+
     @classmethod
     async def set_user_offline(cls, user_id: int) -> bool:
         """
         Mark user as offline by removing from Redis.
-        
+
         Args:
             user_id: User ID to mark offline
-        
+
         Returns:
             True if successful, False otherwise
         """
         redis = await cls.get_connection()
         if not redis:
             return False
-        
+
         try:
-            await redis.delete(f"{cls.PRESENCE_KEY_PREFIX}{user_id}")
+            await redis.zrem(cls.PRESENCE_INDEX_KEY, user_id)
             return True
         except Exception as e:
             print(f"Error setting user offline: {e}")
             return False
-        finally:
-            await redis.close()
-    
+
     @classmethod
     async def is_user_online(cls, user_id: int) -> bool:
         """
         Check if user is currently online.
-        
+
         Args:
             user_id: User ID to check
-        
+
         Returns:
             True if user is online, False otherwise
         """
         redis = await cls.get_connection()
         if not redis:
             return False
-        
+
         try:
-            result = await redis.get(f"{cls.PRESENCE_KEY_PREFIX}{user_id}")
-            return result is not None
+            deadline = await redis.zscore(cls.PRESENCE_INDEX_KEY, user_id)
+            return deadline is not None and deadline > time.time()
         except Exception as e:
             print(f"Error checking user online status: {e}")
             return False
-        finally:
-            await redis.close()
-    
+
     @classmethod
-    async def get_all_online_users(cls) -> list:
+    async def are_users_online(cls, user_ids: list) -> dict:
         """
-        Get list of all online user IDs.
-        
+        Check the presence of many users in a single round trip (ZMSCORE).
+
+        Args:
+            user_ids: User IDs to check
+
         Returns:
-            List of online user IDs
+            Dict mapping each user ID to True if online, False otherwise
+        """
+        user_ids = list(user_ids)
+        redis = await cls.get_connection()
+        if not redis or not user_ids:
+            return dict.fromkeys(user_ids, False)
+
+        try:
+            deadlines = await redis.zmscore(cls.PRESENCE_INDEX_KEY, user_ids)
+        except Exception as e:
+            print(f"Error checking users online status: {e}")
+            return dict.fromkeys(user_ids, False)
+        return cls._online_flags(user_ids, deadlines)
+
+    @classmethod
+    def are_users_online_sync(cls, user_ids: list) -> dict:
+        """Blocking variant of are_users_online for sync views and serializers."""
+        user_ids = list(user_ids)
+        redis = cls.get_sync_connection()
+        if not redis or not user_ids:
+            return dict.fromkeys(user_ids, False)
+
+        try:
+            deadlines = redis.zmscore(cls.PRESENCE_INDEX_KEY, user_ids)
+        except Exception as e:
+            print(f"Error checking users online status: {e}")
+            return dict.fromkeys(user_ids, False)
+        return cls._online_flags(user_ids, deadlines)
+
+    @staticmethod
+    def _online_flags(user_ids: list, deadlines: list) -> dict:
+        """Map user IDs to online flags given their heartbeat deadlines."""
+        now = time.time()
+        return {
+            user_id: deadline is not None and deadline > now
+            for user_id, deadline in zip(user_ids, deadlines, strict=True)
+        }
+
+    @classmethod
+    async def get_all_online_users(cls, offset: int = 0,
+                                   limit: Optional[int] = None) -> Optional[list]:
+        """
+        Get a page of online user IDs, in order of heartbeat expiry.
+
+        Runs in O(log N + page) on the presence index; members whose
+        deadline already passed are skipped even before the sweeper runs.
+
+        Args:
+            offset: Number of online users to skip
+            limit: Maximum number of IDs to return (None for all)
+
+        Returns:
+            List of online user IDs, or None if Redis could not be read
+            (which must not be taken for "nobody is online")
         """
         redis = await cls.get_connection()
         if not redis:
-            return []
-        
+            return None
+
         try:
-            keys = await redis.keys(f"{cls.PRESENCE_KEY_PREFIX}*")
-            # Extract user IDs from keys
-            user_ids = [int(key.split(":")[-1]) for key in keys]
-            return user_ids
+            if limit is None and offset:
+                limit = -1
+            members = await redis.zrangebyscore(
+                cls.PRESENCE_INDEX_KEY,
+                f"({time.time()}",
+                "+inf",
+                start=offset if limit is not None else None,
+                num=limit,
+            )
+            return [int(member) for member in members]
         except Exception as e:
             print(f"Error getting online users: {e}")
-            return []
-        finally:
-            await redis.close()
-    
+            return None
+
+    @classmethod
+    async def count_online_users(cls) -> int:
+        """
+        Count online users in O(log N).
+
+        Returns:
+            Number of users whose heartbeat has not expired
+        """
+        redis = await cls.get_connection()
+        if not redis:
+            return 0
+
+        try:
+            return await redis.zcount(cls.PRESENCE_INDEX_KEY, f"({time.time()}", "+inf")
+        except Exception as e:
+            print(f"Error counting online users: {e}")
+            return 0
+
     @classmethod
     async def refresh_user_session(cls, user_id: int, ttl: int = 60) -> bool:
         """
         Refresh user's online TTL (extend session).
-        
+
         Args:
             user_id: User ID
             ttl: New TTL in seconds
-        
+
         Returns:
             True if successful, False otherwise
         """
         return await cls.set_user_online(user_id, ttl)
+
+    @classmethod
+    async def sweep_expired_users(cls) -> list:
+        """
+        Atomically remove users whose heartbeat expired from the index.
+
+        Returns:
+            List of user IDs that were removed
+        """
+        redis = await cls.get_connection()
+        if not redis:
+            return []
+
+        try:
+            expired = await redis.eval(_SWEEP_SCRIPT, 1,
+                                       cls.PRESENCE_INDEX_KEY, time.time())
+            return [int(member) for member in expired]
+        except Exception as e:
+            print(f"Error sweeping expired users: {e}")
+            return []
+
+    @classmethod
+    def start_presence_sweeper(cls) -> asyncio.Task:
+        """Start the background sweeper of the running loop if not already running."""
+        loop = asyncio.get_running_loop()
+        task = cls._sweepers.get(loop)
+        if task is None or task.done():
+            task = loop.create_task(cls._sweep_forever())
+            cls._sweepers[loop] = task
+        return task
+
+    @classmethod
+    async def _sweep_forever(cls) -> None:
+        """Periodically purge expired presence entries."""
+        while True:
+            await asyncio.sleep(settings.PRESENCE_SWEEP_INTERVAL)
+            await cls.sweep_expired_users()
+
+    @classmethod
+    async def push_recent_message(cls, room_uid: str, entry: dict) -> bool:
+        """
+        Prepend a message to the ring buffer of a room (one Lua script).
+
+        A cold room gets no buffer: its next join loads the latest messages
+        from the DB and fills it (fill_recent_messages). While a join is
+        filling it, the message is kept for the fill instead.
+
+        Args:
+            room_uid: Room the message was sent to
+            entry: JSON-serializable message representation
+
+        Returns:
+            True if successful, False otherwise
+        """
+        redis = await cls.get_connection()
+        if not redis:
+            return False
+
+        try:
+            await redis.eval(
+                _PUSH_RECENT_SCRIPT, 2,
+                cls.RECENT_MESSAGES_KEY.format(room_uid=room_uid),
+                cls.RECENT_FILL_KEY.format(room_uid=room_uid),
+                settings.CHAT_RECENT_MESSAGES, settings.CHAT_RECENT_TTL,
+                json.dumps(entry))
+            return True
+        except Exception as e:
+            print(f"Error buffering recent message: {e}")
+            return False
+
+    @classmethod
+    async def begin_recent_fill(cls, room_uid: str) -> bool:
+        """
+        Start the cold fill of a room, before reading its messages from the DB.
+
+        Messages pushed from now on are kept until fill_recent_messages, so
+        that those the DB read misses still reach the buffer.
+
+        Args:
+            room_uid: Room about to be filled
+
+        Returns:
+            True if the room is cold and the fill may proceed, False otherwise
+        """
+        redis = await cls.get_connection()
+        if not redis:
+            return False
+
+        try:
+            return bool(await redis.eval(
+                _BEGIN_RECENT_FILL_SCRIPT, 2,
+                cls.RECENT_MESSAGES_KEY.format(room_uid=room_uid),
+                cls.RECENT_FILL_KEY.format(room_uid=room_uid),
+                cls.RECENT_FILL_TTL))
+        except Exception as e:
+            print(f"Error starting recent messages fill: {e}")
+            return False
+
+    @classmethod
+    async def fill_recent_messages(cls, room_uid: str, entries: list) -> bool:
+        """
+        Create the ring buffer of a room after loading it from the DB.
+
+        Nothing is written if the buffer exists: a concurrent join filled it,
+        and replacing it could drop a message pushed since. Messages pushed
+        since begin_recent_fill that entries lack (by uid) are added.
+
+        Args:
+            room_uid: Room to fill
+            entries: Message representations, newest first
+
+        Returns:
+            True if the buffer was written, False otherwise
+        """
+        redis = await cls.get_connection()
+        if not redis:
+            return False
+
+        try:
+            return bool(await redis.eval(
+                _FILL_RECENT_SCRIPT, 2,
+                cls.RECENT_MESSAGES_KEY.format(room_uid=room_uid),
+                cls.RECENT_FILL_KEY.format(room_uid=room_uid),
+                settings.CHAT_RECENT_MESSAGES, settings.CHAT_RECENT_TTL,
+                *(json.dumps(entry) for entry in entries[:settings.CHAT_RECENT_MESSAGES])))
+        except Exception as e:
+            print(f"Error filling recent messages: {e}")
+            return False
+
+    @classmethod
+    async def get_recent_messages(cls, room_uid: str) -> Optional[list]:
+        """
+        Read the ring buffer of a room with a single LRANGE.
+
+        Args:
+            room_uid: Room to read
+
+        Returns:
+            Message representations, newest first, or None if the room is
+            not buffered (cold room or Redis unavailable)
+        """
+        redis = await cls.get_connection()
+        if not redis:
+            return None
+
+        try:
+            entries = await redis.lrange(
+                cls.RECENT_MESSAGES_KEY.format(room_uid=room_uid),
+                0, settings.CHAT_RECENT_MESSAGES - 1)
+        except Exception as e:
+            print(f"Error reading recent messages: {e}")
+            return None
+        if not entries:
+            return None
+        return [json.loads(entry) for entry in entries]
+
+    @classmethod
+    async def increment_unread(cls, profile_ids: list, room_uid: str) -> bool:
+        """
+        Count one more unread message in a room for each profile (HINCRBY).
+
+        Only profiles whose counters exist are updated: a missing hash is
+        rebuilt whole from the read cursors (UnreadCountsView). Each update
+        renews the CHAT_UNREAD_TTL of the hash, so that counters an update
+        missed are rebuilt once the profile goes quiet.
+
+        Args:
+            profile_ids: Recipients of the message
+            room_uid: Room the message was sent to
+
+        Returns:
+            True if successful, False otherwise
+        """
+        redis = await cls.get_connection()
+        if not redis or not profile_ids:
+            return False
+
+        try:
+            async with redis.pipeline(transaction=False) as pipe:
+                for profile_id in profile_ids:
+                    pipe.eval(_UPDATE_IF_EXISTS_SCRIPT, 1,
+                              cls.UNREAD_KEY.format(profile_id=profile_id),
+                              'incr', room_uid, 1, settings.CHAT_UNREAD_TTL)
+                await pipe.execute()
+            return True
+        except Exception as e:
+            print(f"Error incrementing unread counters: {e}")
+            return False
+
+    @classmethod
+    async def set_unread(cls, profile_id: int, room_uid: str, count: int) -> bool:
+        """
+        Set the unread count of a profile in a room (reset on read).
+
+        Like increment_unread, a profile without counters is left without.
+
+        Args:
+            profile_id: Reader
+            room_uid: Room that was read
+            count: Messages still unread after the read cursor
+
+        Returns:
+            True if successful, False otherwise
+        """
+        redis = await cls.get_connection()
+        if not redis:
+            return False
+
+        try:
+            await redis.eval(_UPDATE_IF_EXISTS_SCRIPT, 1,
+                             cls.UNREAD_KEY.format(profile_id=profile_id),
+                             'set', room_uid, count, settings.CHAT_UNREAD_TTL)
+            return True
+        except Exception as e:
+            print(f"Error resetting unread counter: {e}")
+            return False
+
+    @classmethod
+    def get_unread_counts_sync(cls, profile_id: int) -> Optional[dict]:
+        """
+        Read every unread counter of a profile with a single HGETALL.
+
+        Args:
+            profile_id: Profile to read
+
+        Returns:
+            Dict of room uid -> unread count, or None if the profile has no
+            counters yet (cold cache or Redis unavailable)
+        """
+        redis = cls.get_sync_connection()
+        if not redis:
+            return None
+
+        try:
+            counts = redis.hgetall(cls.UNREAD_KEY.format(profile_id=profile_id))
+        except Exception as e:
+            print(f"Error reading unread counters: {e}")
+            return None
+        if counts.pop(cls.UNREAD_FILLED, None) is None:
+            return None
+        return {room_uid: int(count) for room_uid, count in counts.items()}
+
+    @classmethod
+    def fill_unread_counts_sync(cls, profile_id: int, counts: dict) -> bool:
+        """
+        Store unread counters rebuilt from the DB, for CHAT_UNREAD_TTL.
+
+        The UNREAD_FILLED field marks the hash as complete, empty or not.
+
+        Args:
+            profile_id: Profile the counters belong to
+            counts: Dict of room uid -> unread count
+
+        Returns:
+            True if successful, False otherwise
+        """
+        redis = cls.get_sync_connection()
+        if not redis:
+            return False
+
+        key = cls.UNREAD_KEY.format(profile_id=profile_id)
+        try:
+            with redis.pipeline() as pipe:
+                pipe.delete(key)
+                pipe.hset(key, mapping={**counts, cls.UNREAD_FILLED: 1})
+                pipe.expire(key, settings.CHAT_UNREAD_TTL)
+                pipe.execute()
+            return True
+        except Exception as e:
+            print(f"Error filling unread counters: {e}")
+            return False
+
+    @classmethod
+    async def take_token(cls, key: str, rate: float, capacity: float) -> float:
+        """
+        Spend one token of a bucket shared by all workers (atomic Lua script).
+
+        Fails open: if Redis is unavailable the frame is allowed.
+
+        Args:
+            key: Bucket key
+            rate: Tokens added per second
+            capacity: Bucket size (burst)
+
+        Returns:
+            0 if a token was spent, else the seconds until one is available
+        """
+        redis = await cls.get_connection()
+        if not redis:
+            return 0
+
+        try:
+            allowed, retry_after = await redis.eval(
+                _TOKEN_BUCKET_SCRIPT, 1, key, rate, capacity)
+        except Exception as e:
+            print(f"Error checking rate limit: {e}")
+            return 0
+        return 0 if allowed else float(retry_after)
+
+    @classmethod
+    async def set_game_session_owner(cls, game_uid: str, channel_name: str,
+                                     ttl: int) -> bool:
+        """
+        Record which worker channel holds a live game session.
+
+        Args:
+            game_uid: Game of the session
+            channel_name: Channel the owning worker receives game actions on
+            ttl: Seconds the record is kept
+
+        Returns:
+            True if successful, False otherwise
+        """
+        redis = await cls.get_connection()
+        if not redis:
+            return False
+
+        try:
+            await redis.set(cls.GAME_SESSION_KEY.format(game_uid=game_uid),
+                            channel_name, ex=ttl)
+            return True
+        except Exception as e:
+            print(f"Error registering game session: {e}")
+            return False
+
+    @classmethod
+    async def get_game_session_owner(cls, game_uid: str) -> Optional[str]:
+        """
+        Return the channel of the worker holding a game session.
+
+        Args:
+            game_uid: Game of the session
+
+        Returns:
+            Channel name, or None if no live session is known
+        """
+        redis = await cls.get_connection()
+        if not redis:
+            return None
+
+        try:
+            return await redis.get(cls.GAME_SESSION_KEY.format(game_uid=game_uid))
+        except Exception as e:
+            print(f"Error reading game session owner: {e}")
+            return None
+
+    @classmethod
+    async def clear_game_session_owner(cls, game_uid: str) -> bool:
+        """
+        Forget the owner of a game session once it is over.
+
+        Args:
+            game_uid: Game of the session
+
+        Returns:
+            True if successful, False otherwise
+        """
+        redis = await cls.get_connection()
+        if not redis:
+            return False
+
+        try:
+            await redis.delete(cls.GAME_SESSION_KEY.format(game_uid=game_uid))
+            return True
+        except Exception as e:
+            print(f"Error clearing game session owner: {e}")
+            return False
+
+    @classmethod
+    def get_playlists_version_sync(cls) -> Optional[int]:
+        """
+        Read the version of the playlists' contents.
+
+        Returns:
+            The version (0 before the first sync), or None if Redis is unavailable
+        """
+        redis = cls.get_sync_connection()
+        if not redis:
+            return None
+
+        try:
+            return int(redis.get(cls.PLAYLISTS_VERSION_KEY) or 0)
+        except Exception as e:
+            print(f"Error reading playlists version: {e}")
+            return None
+
+    @classmethod
+    def bump_playlists_version_sync(cls) -> bool:
+        """
+        Tell every worker that the playlists' contents changed.
+
+        Returns:
+            True if successful, False otherwise
+        """
+        redis = cls.get_sync_connection()
+        if not redis:
+            return False
+
+        try:
+            redis.incr(cls.PLAYLISTS_VERSION_KEY)
+            return True
+        except Exception as e:
+            print(f"Error bumping playlists version: {e}")
+            return False
+
+    @classmethod
+    async def join_matchmaking(cls, playlist: str, player: dict, skill: int) -> bool:
+        """
+        Put a player in the matchmaking queue of a playlist (O(log N)).
+
+        A player queued for another playlist is moved.
+
+        Args:
+            playlist: Slug of the playlist
+            player: Entry handed back when a lobby is formed (id, uid, username)
+            skill: Score the player is matched on (exp_points)
+
+        Returns:
+            True if successful, False otherwise
+        """
+        redis = await cls.get_connection()
+        if not redis:
+            return False
+
+        entry = json.dumps({**player, 'playlist': playlist})
+        try:
+            for _ in range(cls.MATCHMAKING_ATTEMPTS):
+                current = await cls._queued_playlist(redis, player['id'])
+                joined = await redis.eval(
+                    _MATCHMAKING_JOIN_SCRIPT, 6, cls.MATCHMAKING_QUEUED_KEY,
+                    cls.MATCHMAKING_PLAYLISTS_KEY,
+                    cls.MATCHMAKING_SKILL_KEY.format(playlist=current or playlist),
+                    cls.MATCHMAKING_SINCE_KEY.format(playlist=current or playlist),
+                    cls.MATCHMAKING_SKILL_KEY.format(playlist=playlist),
+                    cls.MATCHMAKING_SINCE_KEY.format(playlist=playlist),
+                    player['id'], current or '', playlist, skill, time.time(), entry)
+                if joined == 1:
+                    return True
+            return False
+        except Exception as e:
+            print(f"Error joining matchmaking: {e}")
+            return False
+
+    @classmethod
+    async def leave_matchmaking(cls, profile_id: int) -> bool:
+        """
+        Take a player out of the matchmaking queue it is in (O(log N)).
+
+        Args:
+            profile_id: Queued player
+
+        Returns:
+            True if the player was queued, False otherwise
+        """
+        redis = await cls.get_connection()
+        if not redis:
+            return False
+
+        try:
+            for _ in range(cls.MATCHMAKING_ATTEMPTS):
+                current = await cls._queued_playlist(redis, profile_id)
+                if current is None:
+                    return False
+                left = await redis.eval(
+                    _MATCHMAKING_LEAVE_SCRIPT, 4, cls.MATCHMAKING_QUEUED_KEY,
+                    cls.MATCHMAKING_PLAYLISTS_KEY,
+                    cls.MATCHMAKING_SKILL_KEY.format(playlist=current),
+                    cls.MATCHMAKING_SINCE_KEY.format(playlist=current),
+                    profile_id, current)
+                if left != -1:
+                    return bool(left)
+            return False
+        except Exception as e:
+            print(f"Error leaving matchmaking: {e}")
+            return False
+
+    @classmethod
+    async def _queued_playlist(cls, redis: redis_async.Redis,
+                               profile_id: int) -> Optional[str]:
+        """Return the playlist a player is queued for, or None.
+
+        Its queue keys are passed to the scripts, which check that the
+        entry did not change in the meantime.
+        """
+        entry = await redis.hget(cls.MATCHMAKING_QUEUED_KEY, profile_id)
+        return json.loads(entry)['playlist'] if entry else None
+
+    @classmethod
+    async def matchmaking_playlists(cls) -> list:
+        """
+        Return the playlists whose matchmaking queue has players.
+
+        Returns:
+            Playlist slugs (empty if Redis is unavailable)
+        """
+        redis = await cls.get_connection()
+        if not redis:
+            return []
+
+        try:
+            return list(await redis.smembers(cls.MATCHMAKING_PLAYLISTS_KEY))
+        except Exception as e:
+            print(f"Error reading matchmaking playlists: {e}")
+            return []
+
+    @classmethod
+    async def waiting_in_matchmaking(cls, playlist: str) -> list:
+        """
+        Return the players of a playlist's queue, longest waiting first.
+
+        Args:
+            playlist: Slug of the playlist
+
+        Returns:
+            (profile id, seconds waited, skill) of each queued player
+        """
+        redis = await cls.get_connection()
+        if not redis:
+            return []
+
+        try:
+            waiting = await redis.zrange(cls.MATCHMAKING_SINCE_KEY.format(playlist=playlist),
+                                         0, -1, withscores=True)
+            if not waiting:
+                return []
+            skills = await redis.zmscore(cls.MATCHMAKING_SKILL_KEY.format(playlist=playlist),
+                                         [profile_id for profile_id, _ in waiting])
+        except Exception as e:
+            print(f"Error reading matchmaking queue: {e}")
+            return []
+        now = time.time()
+        return [(int(profile_id), max(0.0, now - since), skill)
+                for (profile_id, since), skill in zip(waiting, skills, strict=True)
+                if skill is not None]
+
+    @classmethod
+    async def pop_matchmaking_lobby(cls, playlist: str, anchor_id: int, low: float,
+                                    high: float, min_players: int,
+                                    max_players: int) -> list:
+        """
+        Atomically take the players of a lobby out of a playlist's queue.
+
+        Args:
+            playlist: Slug of the playlist
+            anchor_id: Player the lobby is formed around (always included)
+            low: Lowest skill accepted
+            high: Highest skill accepted
+            min_players: Players needed to form the lobby
+            max_players: Players taken at most
+
+        Returns:
+            Entries of the lobby's players, or [] if it cannot be formed
+        """
+        redis = await cls.get_connection()
+        if not redis:
+            return []
+
+        try:
+            entries = await redis.eval(
+                _MATCHMAKING_POP_SCRIPT, 4,
+                cls.MATCHMAKING_SKILL_KEY.format(playlist=playlist),
+                cls.MATCHMAKING_SINCE_KEY.format(playlist=playlist),
+                cls.MATCHMAKING_QUEUED_KEY, cls.MATCHMAKING_PLAYLISTS_KEY,
+                anchor_id, low, high, min_players, max_players, playlist)
+        except Exception as e:
+            print(f"Error forming matchmaking lobby: {e}")
+            return []
+        return [json.loads(entry) for entry in entries if entry]
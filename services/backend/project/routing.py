@@ -6,8 +6,9 @@ from .consumers import GlobalConsumer, NotFoundConsumer
 from .presence_consumers import PresenceConsumer
 
 # websocket URL routes used by Channels' URLRouter.
-# - ws/presence/         -> presence tracking (online/offline status)
-# - ws/global/           -> global chat (all connected clients)
+# - ws/presence/         -> presence tracking (online/offline status), legacy:
+#                           ws/global/ carries the same protocol as module 'presence'
+# - ws/global/           -> multiplexed chat, game and presence modules
 # - ws/*                 -> 404 for unrecognized endpoints
 
 websocket_urlpatterns = [
@@ -110,15 +110,140 @@ CORS_ALLOWED_ORIGINS = [
 ASGI_APPLICATION = 'project.asgi.application'
 
 # Channels layer config (uses Redis for production, in-memory for dev without Redis)
+# Groups and channels are sharded over every host of CHANNEL_REDIS_HOSTS
+# (comma-separated redis:// URLs) with jump consistent hashing, so all ASGI
+# workers must be given the same list in the same order.
+CHANNEL_REDIS_HOSTS = [
+    host.strip()
+    for host in os.getenv('CHANNEL_REDIS_HOSTS', 'redis://127.0.0.1:6379').split(',')
+    if host.strip()
+]
 CHANNEL_LAYERS = {
     'default': {
-        'BACKEND': 'channels_redis.core.RedisChannelLayer',
+        'BACKEND': 'project.channel_layers.ShardedRedisChannelLayer',
         'CONFIG': {
-            'hosts': [('127.0.0.1', 6379)],
+            'hosts': CHANNEL_REDIS_HOSTS,
         },
     },
 }
 
+# Redis used directly for presence tracking and caching (see project/redis_utils.py).
+# Every ASGI worker keeps one shared pool instead of connecting per call.
+REDIS_URL = os.getenv('REDIS_URL', 'redis://127.0.0.1:6379')
+REDIS_POOL = {
+    'MAX_CONNECTIONS': int(os.getenv('REDIS_POOL_MAX_CONNECTIONS', '50')),
+    # Seconds a caller waits for a free connection once the pool is exhausted
+    'TIMEOUT': float(os.getenv('REDIS_POOL_TIMEOUT', '5')),
+    # Seconds of idleness after which a connection is PINGed before reuse
+    'HEALTH_CHECK_INTERVAL': int(os.getenv('REDIS_HEALTH_CHECK_INTERVAL', '30')),
+    # Reconnect attempts with exponential backoff (seconds) on connection errors
+    'RETRY_ATTEMPTS': int(os.getenv('REDIS_RETRY_ATTEMPTS', '3')),
+    'BACKOFF_BASE': 0.05,
+    'BACKOFF_CAP': 1.0,
+}
+
+# Tests: database of every Redis server the test runner uses instead of the
+# configured ones, flushed before and after each run (project/test_runner.py)
+TEST_RUNNER = 'project.test_runner.ScratchRedisTestRunner'
+TEST_REDIS_DB = int(os.getenv('TEST_REDIS_DB', '14'))
+
+# Presence: seconds a heartbeat keeps a user online, and how often each worker
+# purges expired entries from the presence index
+PRESENCE_TTL = 60
+PRESENCE_SWEEP_INTERVAL = 15
+# Seconds during which friends' status changes are coalesced into one
+# presence_batch frame per socket
+PRESENCE_BATCH_WINDOW = 0.25
+# Most user ids a presence subscribe frame may list (only friends are answered)
+PRESENCE_SUBSCRIBE_MAX_IDS = 500
+# Seconds between two bulk copies of Redis presence to Profile.is_online
+# (see the flush_presence management command)
+PRESENCE_FLUSH_INTERVAL = 30
+
+# Chat: per-worker LRU of room memberships checked on every message
+ROOM_CACHE_SIZE = 1024
+ROOM_CACHE_TTL = 60
+# Chat: messages kept per room in a Redis capped list for instant joins, and
+# seconds an idle room's buffer is kept
+CHAT_RECENT_MESSAGES = 100
+CHAT_RECENT_TTL = 24 * 60 * 60
+# Chat: seconds the unread counters of a profile are kept in Redis after
+# their last update; they are then rebuilt from the read cursors
+CHAT_UNREAD_TTL = 60 * 60
+# Chat: optional write-behind persistence (see chat/persistence.py for the
+# durability trade-offs). Messages are broadcast before being written, then
+# inserted in batches of BATCH_SIZE at most FLUSH_INTERVAL seconds later.
+CHAT_WRITE_BEHIND = {
+    'ENABLED': os.getenv('CHAT_WRITE_BEHIND') == 'True',
+    'BATCH_SIZE': 200,
+    'FLUSH_INTERVAL': 0.05,
+    # Queued messages after which senders wait for the writer (backpressure)
+    'MAX_PENDING': 10000,
+}
+
+# WebSockets: frames queued per connection before the overflow policy applies
+# (drop_oldest, coalesce or disconnect, see project/outbound.py)
+WS_OUTBOUND = {
+    'MAX_FRAMES': 256,
+    'POLICY': os.getenv('WS_OUTBOUND_POLICY', 'coalesce'),
+}
+
+# WebSockets: offer the compact MessagePack wire format (see project/wire.py);
+# broadcasts are then encoded for it as well as for JSON
+WS_MSGPACK = os.getenv('WS_MSGPACK') == 'True'
+
+# WebSockets: token buckets per connection and per profile, as (frames per
+# second, burst) for each frame category (see project/ratelimit.py). The
+# per-profile bucket lives in the worker's memory, or in Redis to be shared
+# by all workers.
+WS_RATE_LIMITS = {
+    'BACKEND': os.getenv('WS_RATE_LIMIT_BACKEND', 'memory'),
+    'RULES': {
+        'message': (5, 20),
+        'guess': (4, 10),
+        'read': (20, 50),
+        'presence': (1, 5),
+    },
+}
+
+# Games: live sessions are held in memory by the worker that created them
+# (see game/engine.py); the DB is only written when a game starts and ends.
+GAME_ENGINE = {
+    'ROUNDS': 10,
+    'MAX_ROUNDS': 30,
+    'ROUND_SECONDS': 30,
+    # Pause between the answer of a round and the next track
+    'INTERMISSION_SECONDS': 5,
+    'MAX_PLAYERS': 8,
+    # Seconds a session stays registered in Redis for other workers
+    'SESSION_TTL': 2 * 60 * 60,
+    # Latest rounds of each player whose tracks are kept out of new decks
+    'RECENT_ROUNDS': 50,
+    # Most seconds of round trip deducted from an answer time; also how long
+    # a round stays open for faster fair answers after the first right title
+    'MAX_LATENCY_COMPENSATION': 0.5,
+}
+# Games: matchmaking of public games (see game/matchmaking.py). A lobby of
+# LOBBY_SIZE players is formed around the longest-waiting player, among
+# players whose exp_points are within a window that widens while it waits;
+# past LATENCY_BUDGET seconds, MIN_PLAYERS are enough.
+MATCHMAKING = {
+    'LOBBY_SIZE': 4,
+    'MIN_PLAYERS': 2,
+    'LATENCY_BUDGET': 20,
+    # exp_points window: initial half-width, growth per second waited, cap
+    'BASE_WINDOW': 100,
+    'WINDOW_GROWTH': 50,
+    'MAX_WINDOW': 5000,
+    # Seconds between two passes of each worker over the queues
+    'TICK_SECONDS': 1,
+    # Seconds between the lobby notification and the first round
+    'COUNTDOWN_SECONDS': 3,
+}
+# Music: seconds the per-worker track index of a playlist is trusted when
+# Redis cannot tell whether sync_playlists changed it (see music/decks.py)
+TRACK_INDEX_TTL = 10 * 60
+
 # Fallback to in-memory if Redis is not available (development only)
 # To use this, comment out the Redis config above and uncomment below:
 # CHANNEL_LAYERS = {
@@ -0,0 +1,59 @@
+"""Test runner keeping the tests out of the Redis databases of the app."""
+
+import copy
+from urllib.parse import urlsplit, urlunsplit
+
+import redis
+from django.conf import settings
+from django.test.runner import DiscoverRunner
+from django.test.utils import override_settings
+
+
+def redis_db_url(url: str, db: int) -> str:
+    """Return a redis:// URL pointed at another database of the same server."""
+    return urlunsplit(urlsplit(url)._replace(path=f'/{db}'))
+
+
+class ScratchRedisTestRunner(DiscoverRunner):
+    """Run the tests against the TEST_REDIS_DB database of every Redis server.
+
+    REDIS_URL and the hosts of the channel layers are redirected for the
+    whole run. Like the test DB, the scratch databases are flushed before
+    and after it, so tests may create and delete keys freely without
+    touching presence, chat buffers or groups of a running app.
+    """
+
+    def setup_test_environment(self, **kwargs: dict) -> None:
+        """Redirect Redis to the scratch databases and empty them."""
+        super().setup_test_environment(**kwargs)
+        db = settings.TEST_REDIS_DB
+        layers = copy.deepcopy(settings.CHANNEL_LAYERS)
+        for layer in layers.values():
+            config = layer.get('CONFIG', {})
+            if 'hosts' in config:
+                config['hosts'] = [redis_db_url(host, db) for host in config['hosts']]
+        redis_url = redis_db_url(settings.REDIS_URL, db)
+        self._scratch_urls = {redis_url, *(
+            host for layer in layers.values()
+            for host in layer.get('CONFIG', {}).get('hosts', ()))}
+        self._redis_settings = override_settings(REDIS_URL=redis_url,
+                                                 CHANNEL_LAYERS=layers)
+        self._redis_settings.enable()
+        self._flush_scratch()
+
+    def teardown_test_environment(self, **kwargs: dict) -> None:
+        """Empty the scratch databases and restore the Redis settings."""
+        self._flush_scratch()
+        self._redis_settings.disable()
+        super().teardown_test_environment(**kwargs)
+
+    def _flush_scratch(self) -> None:
+        """Flush every scratch database; an unreachable server is skipped."""
+        for url in self._scratch_urls:
+            client = redis.Redis.from_url(url)
+            try:
+                client.flushdb()
+            except Exception as e:
+                print(f"Error flushing test Redis database {url}: {e}")
+            finally:
+                client.close()
@@ -0,0 +1,31 @@
+"""Helpers shared by the test modules of the apps."""
+
+from channels.testing import WebsocketCommunicator
+
+from userauth.serializers import RegisterSerializer
+
+from .asgi import application
+
+
+def register(email: str, username: str) -> object:
+    """Create a registered user with its profile."""
+    serializer = RegisterSerializer(data={'email': email,
+                                          'profile_username': username,
+                                          'password': 'Password123!'},
+                                    context={'is_creation': True})
+    serializer.is_valid(raise_exception=True)
+    return serializer.save()
+
+
+async def connect_global(user: object) -> WebsocketCommunicator:
+    """Open a global socket for a user.
+
+    Raises:
+        AssertionError: If the socket was refused
+    """
+    socket = WebsocketCommunicator(application, '/ws/global/')
+    socket.scope['user'] = user
+    connected, code = await socket.connect()
+    if not connected:
+        raise AssertionError(f'global socket refused with code {code}')
+    return socket
@@ -0,0 +1,499 @@
+"""Tests for the project-wide helpers (Redis presence, channel plumbing)."""
+
+import asyncio
+import json
+
+from asgiref.sync import async_to_sync
+from channels.testing import WebsocketCommunicator
+from django.conf import settings
+from django.test import SimpleTestCase, TestCase, TransactionTestCase, override_settings
+from django.urls import reverse
+
+from chat.models import Room
+from friends.models import Friendship
+from game.engine import frame_event
+from userprofile.models import Profile
+
+from . import metrics, wire
+from .asgi import application
+from .channel_layers import ShardedRedisChannelLayer, jump_hash
+from .consumers import GlobalConsumer
+from .outbound import OutboundQueue
+from .ratelimit import TokenBucket
+from .redis_utils import RedisManager
+from .test_runner import redis_db_url
+from .testing import register
+
+
+class RedisManagerTests(SimpleTestCase):
+    """Validate the shared Redis pool and presence helpers."""
+
+    def test_connection_is_shared_within_a_loop(self) -> None:
+        """Every call on the same loop should reuse one client and pool."""
+        async def scenario() -> None:
+            first = await RedisManager.get_connection()
+            second = await RedisManager.get_connection()
+            self.assertIs(first, second)
+            await RedisManager.set_user_online(4242, ttl=5)
+            await RedisManager.is_user_online(4242)
+            stats = RedisManager.pool_stats()
+            self.assertEqual(stats['created'], 1)
+            self.assertEqual(stats['in_use'], 0)
+            await RedisManager.set_user_offline(4242)
+            await RedisManager.close_connection()
+            self.assertEqual(RedisManager.pool_stats()['created'], 0)
+
+        async_to_sync(scenario)()
+
+    def test_presence_round_trip(self) -> None:
+        """A user marked online should be reported online until marked offline."""
+        async def scenario() -> None:
+            self.assertTrue(await RedisManager.set_user_online(4243, ttl=5))
+            self.assertTrue(await RedisManager.is_user_online(4243))
+            self.assertTrue(await RedisManager.set_user_offline(4243))
+            self.assertFalse(await RedisManager.is_user_online(4243))
+            await RedisManager.close_connection()
+
+        async_to_sync(scenario)()
+
+    def test_online_listing_pagination_and_sweep(self) -> None:
+        """The presence index should page live users and sweep expired ones."""
+        async def scenario() -> None:
+            redis = await RedisManager.get_connection()
+            await redis.delete(RedisManager.PRESENCE_INDEX_KEY)
+            for user_id in (1, 2, 3):
+                await RedisManager.set_user_online(user_id, ttl=30 + user_id)
+            await RedisManager.set_user_online(4, ttl=-1)
+
+            self.assertEqual(await RedisManager.count_online_users(), 3)
+            self.assertEqual(await RedisManager.get_all_online_users(), [1, 2, 3])
+            self.assertEqual(
+                await RedisManager.get_all_online_users(offset=1, limit=1), [2])
+            self.assertEqual(await RedisManager.get_all_online_users(offset=2), [3])
+            self.assertFalse(await RedisManager.is_user_online(4))
+
+            self.assertEqual(await RedisManager.sweep_expired_users(), [4])
+            self.assertEqual(await RedisManager.sweep_expired_users(), [])
+            self.assertEqual(await redis.zcard(RedisManager.PRESENCE_INDEX_KEY), 3)
+            await redis.delete(RedisManager.PRESENCE_INDEX_KEY)
+            await RedisManager.close_connection()
+
+        async_to_sync(scenario)()
+
+    def test_bulk_presence_lookup(self) -> None:
+        """Bulk lookups should answer for every requested id in one call."""
+        async def scenario() -> None:
+            await RedisManager.set_user_online(4244, ttl=5)
+            await RedisManager.set_user_online(4245, ttl=-1)
+            self.assertEqual(
+                await RedisManager.are_users_online([4244, 4245, 4246]),
+                {4244: True, 4245: False, 4246: False})
+            self.assertEqual(await RedisManager.are_users_online([]), {})
+            await RedisManager.set_user_offline(4244)
+            await RedisManager.set_user_offline(4245)
+            await RedisManager.close_connection()
+
+        async_to_sync(scenario)()
+        self.assertEqual(RedisManager.are_users_online_sync([4244]), {4244: False})
+
+
+class PresenceConsumerTests(TransactionTestCase):
+    """Validate friend-scoped, batched presence notifications."""
+
+    def setUp(self) -> None:
+        """Create two friends and one stranger."""
+        self.user = register('presence_a@mail.com', 'presence_a')
+        self.friend = register('presence_b@mail.com', 'presence_b')
+        self.stranger = register('presence_c@mail.com', 'presence_c')
+        Friendship.objects.create(from_user=self.user,
+                                  to_user=self.friend,
+                                  status='accepted')
+
+    def test_status_changes_reach_friends_only_in_batches(self) -> None:
+        """Friends get one presence_batch per window, strangers get nothing."""
+        async def scenario() -> None:
+            friend_socket = WebsocketCommunicator(application, '/ws/presence/')
+            friend_socket.scope['user'] = self.friend
+            stranger_socket = WebsocketCommunicator(application, '/ws/presence/')
+            stranger_socket.scope['user'] = self.stranger
+            self.assertTrue((await friend_socket.connect())[0])
+            self.assertTrue((await stranger_socket.connect())[0])
+
+            for _ in range(3):
+                user_socket = WebsocketCommunicator(application, '/ws/presence/')
+                user_socket.scope['user'] = self.user
+                self.assertTrue((await user_socket.connect())[0])
+                await user_socket.disconnect()
+
+            response = await friend_socket.receive_json_from(timeout=2)
+            self.assertEqual(response['type'], 'presence_batch')
+            self.assertEqual(response['updates'], [{
+                'username': 'presence_a',
+                'status': 'offline',
+                'user_id': self.user.profile.id,
+            }])
+            self.assertTrue(await friend_socket.receive_nothing(timeout=0.5))
+            self.assertTrue(await stranger_socket.receive_nothing(timeout=0.5))
+            await friend_socket.disconnect()
+            await stranger_socket.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_presence_module_on_global_socket(self) -> None:
+        """ws/global/ should carry heartbeats and status subscriptions."""
+        async def scenario() -> None:
+            friend_socket = WebsocketCommunicator(application, '/ws/global/')
+            friend_socket.scope['user'] = self.friend
+            self.assertTrue((await friend_socket.connect())[0])
+            user_socket = WebsocketCommunicator(application, '/ws/global/')
+            user_socket.scope['user'] = self.user
+            self.assertTrue((await user_socket.connect())[0])
+
+            await user_socket.send_json_to({'module': 'presence', 'action': 'ping'})
+            self.assertEqual(await user_socket.receive_json_from(), {'type': 'pong'})
+
+            await user_socket.send_json_to({'module': 'presence',
+                                            'action': 'subscribe'})
+            self.assertEqual(await user_socket.receive_json_from(), {
+                'type': 'presence_snapshot',
+                'statuses': [{'user_id': self.friend.profile.id,
+                              'status': 'online'}],
+            })
+
+            await user_socket.send_json_to({
+                'module': 'presence', 'action': 'subscribe',
+                'user_ids': [self.stranger.profile.id, self.friend.profile.id]})
+            self.assertEqual((await user_socket.receive_json_from())['statuses'],
+                             [{'user_id': self.friend.profile.id, 'status': 'online'}])
+            for user_ids in (str(self.friend.profile.id), list(range(501))):
+                await user_socket.send_json_to({'module': 'presence',
+                                                'action': 'subscribe',
+                                                'user_ids': user_ids})
+                self.assertEqual(await user_socket.receive_json_from(),
+                                 {'type': 'error', 'message': 'invalid_user_ids'})
+
+            response = await friend_socket.receive_json_from(timeout=2)
+            self.assertEqual(response['type'], 'presence_batch')
+            self.assertEqual(response['updates'][0]['status'], 'online')
+            await user_socket.disconnect()
+            await friend_socket.disconnect()
+
+        async_to_sync(scenario)()
+
+
+class ShardedChannelLayerTests(SimpleTestCase):
+    """Validate group sharding across Redis hosts and workers."""
+
+    # The scratch database of the test runner and the next one.
+    hosts = [redis_db_url(settings.REDIS_URL, settings.TEST_REDIS_DB + shard)
+             for shard in range(2)]
+
+    def test_jump_hash_only_moves_keys_to_new_shards(self) -> None:
+        """Adding a shard should move about 1/n of the keys, all to the new shard."""
+        keys = range(0, 10_000 * 7919, 7919)
+        before = [jump_hash(key, 3) for key in keys]
+        after = [jump_hash(key, 4) for key in keys]
+        moved = [new for old, new in zip(before, after) if old != new]
+        self.assertEqual(set(before), {0, 1, 2})
+        self.assertEqual(set(moved), {3})
+        self.assertAlmostEqual(len(moved) / len(before), 0.25, delta=0.03)
+
+    def test_user_groups_reach_sockets_on_other_workers(self) -> None:
+        """A group_send from one worker should reach sockets held by another."""
+        async def scenario() -> None:
+            # Two layer instances stand for two worker processes.
+            worker_a = ShardedRedisChannelLayer(hosts=self.hosts, prefix='shard-test')
+            worker_b = ShardedRedisChannelLayer(hosts=self.hosts, prefix='shard-test')
+            groups = [f'user_{user_id}' for user_id in range(20)]
+            self.assertEqual(
+                {worker_a.consistent_hash(group) for group in groups}, {0, 1})
+
+            channels = {}
+            for group in groups:
+                channels[group] = await worker_a.new_channel()
+                await worker_a.group_add(group, channels[group])
+            for group in groups:
+                await worker_b.group_send(group, {'type': 'chat.message',
+                                                  'message': group})
+            for group in groups:
+                received = await worker_a.receive(channels[group])
+                self.assertEqual(received['message'], group)
+            await worker_a.flush()
+            await worker_a.close_pools()
+            await worker_b.close_pools()
+
+        async_to_sync(scenario)()
+
+
+class OutboundQueueTests(SimpleTestCase):
+    """Validate the overflow policies of per-connection outbound queues."""
+
+    def test_drop_oldest_sheds_presence_before_messages(self) -> None:
+        """A full queue should drop presence frames first, then refuse."""
+        queue = OutboundQueue(2, 'drop_oldest')
+        self.assertTrue(queue.push({'type': 'presence_batch'}, droppable=True))
+        self.assertTrue(queue.push({'type': 'chat_message', 'message': 'a'}))
+        self.assertTrue(queue.push({'type': 'chat_message', 'message': 'b'}))
+        self.assertEqual(len(queue), 2)
+        self.assertFalse(queue.push({'type': 'chat_message', 'message': 'c'}))
+
+    def test_coalesce_replaces_queued_status_updates(self) -> None:
+        """Keyed frames should replace the queued frame with the same key."""
+        queue = OutboundQueue(4, 'coalesce')
+        coalesced = metrics.counters['ws.outbound.coalesced']
+        for up_to in ('m1', 'm2', 'm3'):
+            queue.push({'type': 'status_update', 'up_to': up_to}, key=('room', 'read'))
+        self.assertEqual(len(queue), 1)
+        self.assertEqual(async_to_sync(queue.pop)()['up_to'], 'm3')
+        self.assertEqual(metrics.counters['ws.outbound.coalesced'], coalesced + 2)
+
+    def test_disconnect_policy_refuses_when_full(self) -> None:
+        """The disconnect policy should never drop frames."""
+        queue = OutboundQueue(1, 'disconnect')
+        self.assertTrue(queue.push({'type': 'presence_batch'}, droppable=True))
+        self.assertFalse(queue.push({'type': 'presence_batch'}, droppable=True))
+
+
+class MetricsViewTests(TestCase):
+    """Validate access to the worker metrics."""
+
+    def test_metrics_are_staff_only(self) -> None:
+        """Only staff users should read queue depths and pool usage."""
+        user = register('metrics@mail.com', 'metrics_user')
+        self.client.force_login(user)
+        self.assertEqual(self.client.get(reverse('metrics')).status_code, 403)
+        user.is_staff = True
+        user.save()
+        response = self.client.get(reverse('metrics'))
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(set(response.json()['outbound']),
+                         {'sockets', 'depth_total', 'depth_max'})
+
+
+@override_settings(WS_RATE_LIMITS={'BACKEND': 'memory',
+                                   'RULES': {'message': (0.01, 2),
+                                             'guess': (0.01, 2),
+                                             'read': (0.01, 2),
+                                             'presence': (0.01, 2)}})
+class RateLimitTests(TransactionTestCase):
+    """Validate token-bucket flood control on WebSocket frames."""
+
+    def test_token_buckets(self) -> None:
+        """Buckets should allow a burst, then report when the next frame fits."""
+        bucket = TokenBucket(rate=1, capacity=2)
+        self.assertEqual(bucket.take(), 0)
+        self.assertEqual(bucket.take(), 0)
+        self.assertGreater(bucket.take(), 0)
+
+        async def shared_bucket() -> None:
+            redis = await RedisManager.get_connection()
+            await redis.delete('ratelimit:test')
+            self.assertEqual(await RedisManager.take_token('ratelimit:test', 1, 2), 0)
+            self.assertEqual(await RedisManager.take_token('ratelimit:test', 1, 2), 0)
+            self.assertGreater(await RedisManager.take_token('ratelimit:test', 1, 2), 0)
+            await redis.delete('ratelimit:test')
+            await RedisManager.close_connection()
+
+        async_to_sync(shared_bucket)()
+
+    def test_frames_over_budget_are_rejected(self) -> None:
+        """Extra frames should get rate_limited, per connection then per profile."""
+        user = register('flood@mail.com', 'flood_user')
+        frame = {'module': 'chat', 'action': 'chat-message', 'message': ''}
+
+        async def scenario() -> None:
+            first = WebsocketCommunicator(application, '/ws/global/')
+            first.scope['user'] = user
+            self.assertTrue((await first.connect())[0])
+            for _ in range(2):
+                await first.send_json_to(frame)
+                response = await first.receive_json_from()
+                self.assertEqual(response['message'], 'message is required')
+            await first.send_json_to(frame)
+            response = await first.receive_json_from()
+            self.assertEqual(response['message'], 'rate_limited')
+            self.assertEqual(response['scope'], 'connection')
+            self.assertGreater(response['retry_after'], 0)
+
+            second = WebsocketCommunicator(application, '/ws/global/')
+            second.scope['user'] = user
+            self.assertTrue((await second.connect())[0])
+            await second.send_json_to(frame)
+            response = await second.receive_json_from()
+            self.assertEqual(response['message'], 'rate_limited')
+            self.assertEqual(response['scope'], 'profile')
+            await first.disconnect()
+            await second.disconnect()
+
+        async_to_sync(scenario)()
+
+    def test_guesses_have_their_own_budget(self) -> None:
+        """Game guesses should not be charged to the chat message budget."""
+        user = register('guesser@mail.com', 'guesser_user')
+
+        async def scenario() -> None:
+            socket = WebsocketCommunicator(application, '/ws/global/')
+            socket.scope['user'] = user
+            self.assertTrue((await socket.connect())[0])
+            for _ in range(2):
+                await socket.send_json_to({'module': 'chat', 'action': 'chat-message',
+                                           'message': ''})
+                await socket.receive_json_from()
+            for _ in range(2):
+                await socket.send_json_to({'module': 'game', 'action': 'guess'})
+                response = await socket.receive_json_from()
+                self.assertEqual(response['message'], 'game_uid is required')
+            await socket.send_json_to({'module': 'game', 'action': 'guess'})
+            response = await socket.receive_json_from()
+            self.assertEqual((response['message'], response['action']),
+                             ('rate_limited', 'guess'))
+            await socket.disconnect()
+
+        async_to_sync(scenario)()
+
+
+class WireFormatTests(TransactionTestCase):
+    """Validate the opt-in MessagePack subprotocol."""
+
+    def test_codes_round_trip(self) -> None:
+        """Nested keys should be shortened on the wire and restored on decode."""
+        frame = {'type': 'presence_batch',
+                 'updates': [{'user_id': 1, 'status': 'online', 'extra': True}]}
+        encoded = wire.encode(frame)
+        self.assertLess(len(encoded), len(json.dumps(frame)) / 2)
+        self.assertEqual(wire.decode(encoded), frame)
+        with self.assertRaises(ValueError):
+            wire.decode(b'\x01')
+
+    @override_settings(WS_MSGPACK=False)
+    def test_msgpack_is_opt_in(self) -> None:
+        """Without WS_MSGPACK, neither sockets nor broadcasts should use the format."""
+        self.assertNotIn('packed', frame_event({'type': 'game_round'}))
+        user = register('json@mail.com', 'json_user')
+
+        async def scenario() -> None:
+            socket = WebsocketCommunicator(application, '/ws/global/',
+                                           subprotocols=[wire.SUBPROTOCOL])
+            socket.scope['user'] = user
+            self.assertEqual(await socket.connect(), (True, None))
+            await socket.disconnect()
+
+        async_to_sync(scenario)()
+
+    @override_settings(WS_MSGPACK=True)
+    def test_msgpack_socket(self) -> None:
+        """A socket offering the subprotocol should speak MessagePack both ways."""
+        user = register('wire@mail.com', 'wire_user')
+        room = Room.objects.create(name='wire_room')
+        room.participants.add(user.profile)
+
+        async def scenario() -> None:
+            socket = WebsocketCommunicator(application, '/ws/global/',
+                                           subprotocols=[wire.SUBPROTOCOL])
+            socket.scope['user'] = user
+            self.assertEqual(await socket.connect(), (True, wire.SUBPROTOCOL))
+            await socket.send_to(bytes_data=wire.encode({'module': 'presence',
+                                                         'action': 'ping'}))
+            self.assertEqual(wire.decode(await socket.receive_from()), {'type': 'pong'})
+
+            await socket.send_to(bytes_data=wire.encode({'module': 'chat',
+                                                         'action': 'chat-message',
+                                                         'room_uid': str(room.uid),
+                                                         'message': 'packed'}))
+            response = await socket.receive_output()
+            self.assertIn('bytes', response)
+            frame = wire.decode(response['bytes'])
+            self.assertEqual((frame['type'], frame['message']), ('chat_message', 'packed'))
+            await socket.disconnect()
+
+        async_to_sync(scenario)()
+
+    @override_settings(WS_MSGPACK=True)
+    def test_broadcast_is_written_verbatim(self) -> None:
+        """Pre-encoded broadcasts should reach each socket without re-encoding."""
+        event = {'type': 'chat.message', 'text': '{"verbatim": true}'}
+        if wire.available():
+            event['packed'] = b'\x81\xa1v\xc3'
+
+        async def scenario() -> None:
+            written = []
+
+            async def sink(message: dict) -> None:
+                written.append(message)
+
+            for wire_format, field in (('json', 'text'), ('msgpack', 'bytes')):
+                if field == 'bytes' and not wire.available():
+                    continue
+                consumer = GlobalConsumer()
+                consumer.base_send = sink
+                consumer.wire = wire_format
+                await consumer.chat_message(event)
+                while len(written) < 1:
+                    await asyncio.sleep(0)
+                sent = written.pop()
+                self.assertEqual(sent[field], event['text' if field == 'text' else 'packed'])
+                consumer.outbound_task.cancel()
+
+        async_to_sync(scenario)()
+
+    @override_settings(WS_MSGPACK=True)
+    def test_broadcast_without_packed_encoding(self) -> None:
+        """A MessagePack socket should encode a broadcast sent with JSON only."""
+        if not wire.available():
+            self.skipTest('msgpack is not installed')
+
+        async def scenario() -> None:
+            written = []
+
+            async def sink(message: dict) -> None:
+                written.append(message)
+
+            consumer = GlobalConsumer()
+            consumer.base_send = sink
+            consumer.wire = 'msgpack'
+            await consumer.chat_message({'type': 'chat.message',
+                                         'text': '{"verbatim": true}'})
+            while not written:
+                await asyncio.sleep(0)
+            self.assertEqual(wire.decode(written[0]['bytes']), {'verbatim': True})
+            consumer.outbound_task.cancel()
+
+        async_to_sync(scenario)()
+
+    def test_closing_frame_follows_queued_frames(self) -> None:
+        """A closing frame should be written after the frames queued before it."""
+        async def scenario() -> None:
+            written = []
+
+            async def sink(message: dict) -> None:
+                written.append(message)
+
+            consumer = GlobalConsumer()
+            consumer.base_send = sink
+            await consumer.queue_json({'type': 'presence_batch'}, droppable=True)
+            await consumer.send_json({'type': 'chat_message', 'message': 'last'})
+            await consumer.send_json({'type': 'error', 'message': 'bye'}, close=True)
+            self.assertEqual([json.loads(message['text'])['type']
+                              for message in written if 'text' in message],
+                             ['presence_batch', 'chat_message', 'error'])
+            self.assertEqual(written[-1]['type'], 'websocket.close')
+            self.assertTrue(consumer.outbound_task.done())
+
+        async_to_sync(scenario)()
+
+
+class GlobalConsumerTests(TransactionTestCase):
+    """Validate the identity checks of the global socket."""
+
+    def test_socket_without_profile_is_refused(self) -> None:
+        """A socket that resolves to no profile should be closed, not given one."""
+        async def scenario() -> None:
+            socket = WebsocketCommunicator(application, '/ws/global/')
+            connected, code = await socket.connect()
+            self.assertFalse(connected)
+            self.assertEqual(code, 4401)
+            # Lets the consumer stop before the test's event loop closes.
+            await socket.disconnect()
+
+        async_to_sync(scenario)()
+        self.assertFalse(Profile.objects.exists())
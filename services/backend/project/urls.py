@@ -4,6 +4,8 @@ from django.contrib import admin
 from django.urls import include, path
 from drf_spectacular.views import SpectacularAPIView, SpectacularSwaggerView
 
+from .metrics import metrics_view
+
 urlpatterns = [
     path('api/admin/', admin.site.urls),
     path('api/music/', include('music.urls')),
@@ -11,6 +13,7 @@ urlpatterns = [
     path('api/social/', include('friends.urls')),
     path('api/profile/', include('userprofile.urls')),
     path('api/chat/', include('chat.urls')),
+    path('api/metrics/', metrics_view, name='metrics'),
     path('api/schema/', SpectacularAPIView.as_view(), name='schema'),
     path('api/docs/swagger/', SpectacularSwaggerView.as_view(url_name='schema'),
          name='swagger-ui'),
@@ -0,0 +1,132 @@
+"""Compact MessagePack wire format, negotiated as a WebSocket subprotocol.
+
+Clients that offer ``transcendence.msgpack.v1`` at connect exchange binary
+MessagePack frames instead of JSON text, with the keys of every frame
+(nested ones included) replaced by the short codes of FIELD_CODES. Keys
+without a code are sent as is, so new fields never break the format.
+Frame values (e.g. ``type``) are unchanged.
+
+The format is opt-in with the WS_MSGPACK setting, so that broadcasts are
+only encoded for it where clients may use it. msgpack is an optional
+dependency: without it the subprotocol is simply not offered and every
+client stays on JSON.
+"""
+
+from typing import Any
+
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+try:
+    import msgpack
+except ImportError:  # pragma: no cover - depends on the environment
+    msgpack = None
+
+SUBPROTOCOL = 'transcendence.msgpack.v1'
+
+FIELD_CODES = {
+    'type': 't',
+    'module': 'M',
+    'action': 'a',
+    'message': 'm',
+    'message_id': 'i',
+    'message_uid': 'u',
+    'room_uid': 'r',
+    'user_uid': 'U',
+    'up_to': 'x',
+    'sender': 's',
+    'sender_name': 'S',
+    'username': 'n',
+    'created': 'c',
+    'delivered': 'd',
+    'seen': 'e',
+    'group': 'g',
+    'status': 'o',
+    'statuses': 'O',
+    'updates': 'p',
+    'user_id': 'I',
+    'user_ids': 'J',
+    'messages': 'l',
+    'uid': 'k',
+    'room': 'R',
+    'body': 'b',
+    'scope': 'z',
+    'retry_after': 'w',
+}
+FIELD_NAMES = {code: name for name, code in FIELD_CODES.items()}
+if len(FIELD_NAMES) != len(FIELD_CODES):
+    raise ImproperlyConfigured('wire field codes must be unique')
+
+
+def available() -> bool:
+    """Whether the MessagePack wire format is enabled and can be offered."""
+    return settings.WS_MSGPACK and msgpack is not None
+
+
+def _shorten(value: Any) -> Any:
+    """Replace the keys of every dict in value with their codes."""
+    if isinstance(value, dict):
+        return {FIELD_CODES.get(key, key): _shorten(item) for key, item in value.items()}
+    if isinstance(value, list | tuple):
+        return [_shorten(item) for item in value]
+    return value
+
+
+def _expand(value: Any) -> Any:
+    """Restore the field names of a decoded frame."""
+    if isinstance(value, dict):
+        return {FIELD_NAMES.get(key, key): _expand(item) for key, item in value.items()}
+    if isinstance(value, list):
+        return [_expand(item) for item in value]
+    return value
+
+
+def encode(frame: dict) -> bytes:
+    """Encode a frame for clients of the MessagePack subprotocol."""
+    return msgpack.packb(_shorten(frame), use_bin_type=True)
+
+
+def decode(data: bytes) -> dict:
+    """Decode a frame sent by a client of the MessagePack subprotocol.
+
+    Raises:
+        ValueError: If the data is not a MessagePack map
+    """
+    try:
+        frame = msgpack.unpackb(data, raw=False)
+    except Exception as e:
+        raise ValueError('invalid msgpack frame') from e
+    if not isinstance(frame, dict):
+        raise ValueError('frame must be a map')
+    return _expand(frame)
+
+
+class WireMixin:
+    """Negotiate the wire format of a JSON consumer at connect.
+
+    Use ``accept_wire`` instead of ``accept``; outgoing frames are encoded
+    by OutboundMixin according to ``self.wire``.
+    """
+
+    wire = 'json'
+
+    async def accept_wire(self) -> None:
+        """Accept the socket, picking MessagePack if the client offered it."""
+        if available() and SUBPROTOCOL in self.scope.get('subprotocols', ()):
+            self.wire = 'msgpack'
+            await self.accept(subprotocol=SUBPROTOCOL)
+            return
+        await self.accept()
+
+    async def receive(self, text_data: str | None = None,
+                      bytes_data: bytes | None = None, **kwargs: Any) -> None:
+        """Decode binary frames of MessagePack clients, JSON otherwise."""
+        if bytes_data is not None and self.wire == 'msgpack':
+            try:
+                content = decode(bytes_data)
+            except ValueError:
+                await self.send_json({'type': 'error', 'message': 'invalid_frame'})
+                return
+            await self.receive_json(content, **kwargs)
+            return
+        await super().receive(text_data=text_data, bytes_data=bytes_data, **kwargs)
@@ -46,6 +46,11 @@ class UserRoundStats(models.Model):
     xp_earned = models.IntegerField(default=0)
     played_at = models.DateTimeField(auto_now_add=True)
 
+    class Meta:
+        """Define the indexes of the round statistics in the DB."""
+        # Serves "tracks a player heard lately", excluded from new decks.
+        indexes = [models.Index(fields=['player', '-played_at'])]
+
 class UserGameStats(models.Model):
     """Define the model for a single player for a single game."""
 
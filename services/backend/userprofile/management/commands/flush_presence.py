@@ -0,0 +1,88 @@
+"""Periodic copy of the Redis presence index to Profile.is_online / last_active."""
+
+import asyncio
+from argparse import ArgumentParser
+from collections.abc import Iterator
+
+from asgiref.sync import sync_to_async
+from django.conf import settings
+from django.core.management.base import BaseCommand
+from django.db import transaction
+from django.utils import timezone
+
+from project.redis_utils import RedisManager
+from userprofile.models import Profile
+
+# Ids per UPDATE statement.
+FLUSH_CHUNK_SIZE = 5000
+
+
+def flush_presence(online_ids: list[int]) -> int:
+    """Copy the Redis presence snapshot to Profile in chunked UPDATEs.
+
+    Online profiles get is_online=True and a fresh last_active; profiles
+    still flagged online but absent from the snapshot are flagged offline.
+    Ids are sent FLUSH_CHUNK_SIZE at a time to stay under the bind
+    parameter limit of the database (32766 on SQLite). Returns the number
+    of rows touched.
+    """
+    now = timezone.now()
+    online = set(online_ids)
+    offline = set(Profile.objects.filter(is_online=True)
+                  .values_list('id', flat=True)) - online
+    updated = 0
+    with transaction.atomic():
+        for chunk in chunked(sorted(online)):
+            updated += Profile.objects.filter(id__in=chunk).update(
+                is_online=True, last_active=now)
+        for chunk in chunked(sorted(offline)):
+            updated += Profile.objects.filter(id__in=chunk).update(is_online=False)
+    return updated
+
+
+def chunked(ids: list[int]) -> Iterator[list[int]]:
+    """Split ids into lists of at most FLUSH_CHUNK_SIZE."""
+    for start in range(0, len(ids), FLUSH_CHUNK_SIZE):
+        yield ids[start:start + FLUSH_CHUNK_SIZE]
+
+
+class Command(BaseCommand):
+    """Flush presence every --interval seconds, or once with --once."""
+
+    help = "Periodically flush Redis presence to Profile.is_online / last_active."
+
+    def add_arguments(self, parser: ArgumentParser) -> None:
+        """Declare the --interval and --once options."""
+        parser.add_argument(
+            "--interval", type=float, default=settings.PRESENCE_FLUSH_INTERVAL,
+            help="Seconds between two flushes.",
+        )
+        parser.add_argument(
+            "--once", action="store_true",
+            help="Flush a single time and exit.",
+        )
+
+    def handle(self, *args: tuple, **options: dict) -> None:
+        """Run the flush loop on a fresh event loop."""
+        asyncio.run(self._run(options["interval"], options["once"]))
+
+    async def _run(self, interval: float, once: bool) -> None:
+        """Flush until interrupted; a Redis outage skips the flush.
+
+        Without a snapshot nothing is known about presence, and flushing an
+        empty one would flag every profile offline.
+        """
+        try:
+            while True:
+                online_ids = await RedisManager.get_all_online_users()
+                if online_ids is None:
+                    self.stderr.write("Presence unavailable in Redis, flush skipped")
+                else:
+                    updated = await sync_to_async(flush_presence)(online_ids)
+                    self.stdout.write(f"Flushed presence: {len(online_ids)} online, "
+                                      f"{updated} rows updated")
+                if once:
+                    return
+                await asyncio.sleep(interval)
+        finally:
+            await RedisManager.close_connection()
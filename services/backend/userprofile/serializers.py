@@ -7,6 +7,7 @@ from django.core.files.base import ContentFile
 from django.templatetags.static import static
 from PIL import Image, UnidentifiedImageError
 from project import settings
+from project.redis_utils import RedisManager
 from project.validators import validate_email, validate_username
 from rest_framework import serializers
 
@@ -65,6 +66,35 @@ class LightProfileSerializer(serializers.ModelSerializer):
                 f"default_avatars/default_avatar_{instance.pk % 18}.png"
         return ret
 
+class PresenceProfileSerializer(LightProfileSerializer):
+    """Light profile annotated with live presence.
+
+    Presence is read from the ``presence`` context entry (profile id -> bool),
+    which the view fills with one bulk Redis lookup, so listing N profiles
+    never costs N presence queries.
+    """
+
+    is_online = serializers.SerializerMethodField()
+
+    class Meta(LightProfileSerializer.Meta):
+        """Public light profile fields (no session key) and the online flag.
+
+        These profiles are other users' (friends, room participants).
+        """
+        fields = ['uid', 'username', 'avatar', 'is_guest', 'is_online']
+
+    @staticmethod
+    def presence_context(profiles: list[Profile]) -> dict:
+        """Build the serializer context holding the presence of all profiles."""
+        return {'presence': RedisManager.are_users_online_sync(p.id for p in profiles)}
+
+    def get_is_online(self, instance: Profile) -> bool:
+        """Return the live presence, falling back on the last flushed value."""
+        presence = self.context.get('presence')
+        if presence is None:
+            return instance.is_online
+        return presence.get(instance.id, False)
+
 class UsersSerializer(LightProfileSerializer):
     """Set how to serialize a user (user obj <-> JSON)."""
 
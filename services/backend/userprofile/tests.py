@@ -4,16 +4,21 @@ import io
 import os
 import shutil
 from pathlib import Path
+from unittest import mock
 
+from asgiref.sync import async_to_sync
 from django.conf import settings
 from django.core.files.uploadedfile import SimpleUploadedFile
+from django.core.management import call_command
 from django.test import TransactionTestCase, override_settings
 from PIL import Image
+from project.redis_utils import RedisManager
 from rest_framework import status
 from rest_framework.test import APIClient
 from userauth.models import SiteUser
 from userauth.serializers import RegisterSerializer
 
+from .management.commands import flush_presence as flush_presence_command
 from .models import Profile
 from .serializers import LightProfileSerializer, ProfileSerializer
 
@@ -337,4 +342,51 @@ class ProfileTests(TransactionTestCase):
                 self.assertTrue(valid, serializer.errors)
                 raw_data['avatar'] = image_generator(image)
                 raw_data['avatar'].seek(0)
-                self.assertTrue(valid_light, serializer_light.errors)
\ No newline at end of file
+                self.assertTrue(valid_light, serializer_light.errors)
+
+    def test_flush_presence_bulk_updates_profiles(self) -> None:
+        """The flush job should mirror the Redis presence index in the DB."""
+        online = self.user1.profile
+        offline = self.user2.profile
+        Profile.objects.filter(id=online.id).update(is_online=False)
+        Profile.objects.filter(id=offline.id).update(is_online=True)
+
+        async def mark_online() -> None:
+            await RedisManager.set_user_offline(offline.id)
+            await RedisManager.set_user_online(online.id, ttl=30)
+            await RedisManager.close_connection()
+
+        async_to_sync(mark_online)()
+        call_command('flush_presence', '--once', stdout=io.StringIO())
+        online.refresh_from_db()
+        offline.refresh_from_db()
+        self.assertTrue(online.is_online)
+        self.assertFalse(offline.is_online)
+
+        async def cleanup() -> None:
+            await RedisManager.set_user_offline(online.id)
+            await RedisManager.close_connection()
+
+        async_to_sync(cleanup)()
+
+    def test_flush_presence_sends_ids_in_chunks(self) -> None:
+        """Every chunk of the snapshot should be flushed, online and offline."""
+        profiles = [self.user1.profile, self.user2.profile, self.user3]
+        Profile.objects.filter(id=profiles[2].id).update(is_online=True)
+        with mock.patch.object(flush_presence_command, 'FLUSH_CHUNK_SIZE', 1):
+            updated = flush_presence_command.flush_presence(
+                [profiles[0].id, profiles[1].id])
+        self.assertEqual(updated, 3)
+        self.assertEqual(
+            dict(Profile.objects.filter(id__in=[profile.id for profile in profiles])
+                 .values_list('id', 'is_online')),
+            {profiles[0].id: True, profiles[1].id: True, profiles[2].id: False})
+
+    def test_flush_presence_skips_redis_outages(self) -> None:
+        """A failed Redis read should not flag every profile offline."""
+        Profile.objects.filter(id=self.user1.profile.id).update(is_online=True)
+        with mock.patch.object(RedisManager, 'get_all_online_users',
+                               mock.AsyncMock(return_value=None)):
+            call_command('flush_presence', '--once', stdout=io.StringIO(),
+                         stderr=io.StringIO())
+        self.assertTrue(Profile.objects.get(id=self.user1.profile.id).is_online)